@@ -0,0 +1,123 @@
+# backend/ann_index.py
+import os
+import numpy as np
+
+
+class IVFIndex:
+    """
+    Inverted-file ANN structure over the rows of a SpeakerIndex matrix.
+
+    Rows (L2-normalized) are clustered by spherical k-means into `nlist`
+    cells; each row's cell is kept in `assign`, aligned with the matrix. A
+    search scores the probe against the centroids, then only against the rows
+    of the `nprobe` closest cells. Adding a row just assigns it to its nearest
+    centroid, so enrollments are incremental; the centroids themselves are
+    only recomputed by train() (on a full build).
+    """
+    name = "ivf"
+
+    def __init__(self, nlist: int = 0, nprobe: int = 16, train_sample: int = 20_000,
+                 iterations: int = 8, seed: int = 0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_sample = train_sample
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids: np.ndarray | None = None
+        self.assign = np.empty(0, dtype=np.int32)
+
+    # retrain once the largest cell holds this many times the mean cell size
+    max_imbalance = float(os.getenv("SPEAKER_INDEX_MAX_IMBALANCE", 8))
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def resize(self, capacity: int, size: int):
+        if capacity <= self.assign.shape[0]:
+            return
+        assign = np.zeros(capacity, dtype=np.int32)
+        keep = min(size, self.assign.shape[0])
+        assign[:keep] = self.assign[:keep]
+        self.assign = assign
+
+    def _nearest(self, vecs: np.ndarray) -> np.ndarray:
+        return np.argmax(vecs @ self.centroids.T, axis=1).astype(np.int32)
+
+    def train(self, matrix: np.ndarray, n: int):
+        """Fit centroids on a sample of matrix[:n], then assign every row."""
+        rng = np.random.default_rng(self.seed)
+        nlist = self.nlist or max(1, int(4 * np.sqrt(n)))
+        nlist = min(nlist, n)
+        sample_idx = rng.choice(n, size=min(n, max(self.train_sample, nlist)), replace=False)
+        sample = np.asarray(matrix[sample_idx], dtype=np.float32)
+
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(self.iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=nlist)
+            empty = counts == 0
+            # re-seed empty cells from random sample rows
+            sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+            centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+
+        self.centroids = centroids.astype(np.float32)
+        self.resize(matrix.shape[0], 0)
+        for start in range(0, n, 8192):
+            stop = min(n, start + 8192)
+            self.assign[start:stop] = self._nearest(np.asarray(matrix[start:stop]))
+
+    def stale(self, n: int) -> bool:
+        """
+        True when the centroids no longer fit matrix[:n]: untrained, fitted
+        with an automatic nlist for less than a quarter of the rows, or with
+        cells so uneven that probing them stops saving any work.
+        """
+        if not self.trained:
+            return True
+        nlist = len(self.centroids)
+        if not self.nlist and nlist < min(n, int(4 * np.sqrt(n))) // 2:
+            return True
+        counts = np.bincount(self.assign[:n], minlength=nlist)
+        return counts.max() > self.max_imbalance * max(1.0, n / nlist)
+
+    def set(self, row: int, vec: np.ndarray):
+        if self.trained:
+            self.assign[row] = int(np.argmax(self.centroids @ vec))
+
+    def move(self, dst: int, src: int):
+        self.assign[dst] = self.assign[src]
+
+    def candidates(self, vec: np.ndarray, n: int) -> np.ndarray:
+        """Row numbers in the `nprobe` cells closest to `vec`."""
+        sims = self.centroids @ vec
+        nprobe = min(self.nprobe, len(sims))
+        wanted = np.zeros(len(sims), dtype=bool)
+        wanted[np.argpartition(-sims, nprobe - 1)[:nprobe]] = True
+        return np.flatnonzero(wanted[self.assign[:n]])
+
+    def arrays(self) -> dict:
+        return {"centroids": self.centroids, "assign": self.assign}
+
+    def load_arrays(self, arrays: dict):
+        self.centroids = arrays["centroids"]
+        self.assign = arrays["assign"]
+
+
+# SPEAKER_INDEX_BACKEND → ANN class ("exact" disables ANN); others plug in here
+_BACKENDS = {"ivf": IVFIndex}
+
+
+def make_ann():
+    """ANN structure from SPEAKER_INDEX_BACKEND / _NLIST / _NPROBE, or None for exact."""
+    kind = os.getenv("SPEAKER_INDEX_BACKEND", "ivf").lower()
+    if kind == "exact":
+        return None
+    if kind not in _BACKENDS:
+        raise RuntimeError(f"Unknown SPEAKER_INDEX_BACKEND: {kind}")
+    return _BACKENDS[kind](
+        nlist=int(os.getenv("SPEAKER_INDEX_NLIST", 0)),
+        nprobe=int(os.getenv("SPEAKER_INDEX_NPROBE", 16)),
+    )
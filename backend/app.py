@@ -9,6 +9,12 @@ from routes.voice import voice_bp
 import os
 from dotenv import load_dotenv
 from models import User, db, VoicePhrase
+from speaker_index import load_speaker_index
+from commands import register_commands, ensure_indexes, ensure_voice_columns
+from audit import init_audit
+from audit_archive import start_archiver
+from rbac import init_rbac
+import voice_service
 from werkzeug.security import generate_password_hash
 load_dotenv()
 
@@ -29,6 +35,9 @@ app.register_blueprint(data_bp)
 app.register_blueprint(auth_bp)
 app.register_blueprint(voice_bp, url_prefix='/voice')
 app.register_blueprint(admin_bp)
+register_commands(app)
+# per-endpoint role sets, for `flask rbac-policy` and introspection
+init_rbac(app)
 app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(hours=8)
 
 with app.app_context():
@@ -36,6 +45,8 @@ with app.app_context():
     # print("Dropped tables")
 
     db.create_all()
+    ensure_voice_columns()
+    ensure_indexes()
 
     if VoicePhrase.query.count() == 0:
         phrases = [
@@ -64,5 +75,32 @@ with app.app_context():
 
     print("Created tables:", db.metadata.tables.keys())
 
+    # background audit writer; replays events spilled by a previous process
+    init_audit(app)
+    # monthly partitions ahead + archival of expired audit months: started by
+    # the server entry points (below, asgi.py), or here for WSGI servers such
+    # as gunicorn with AUDIT_ARCHIVE_ON_START=1, never by `flask` CLI commands
+    if os.getenv("AUDIT_ARCHIVE_ON_START", "0").lower() in ("1", "true", "yes"):
+        start_archiver(app)
+
+    # map the saved speaker index, or rebuild it when enrollments changed
+    index = load_speaker_index()
+    print("Loaded voice profiles:", len(index))
+
+# load speech models before serving instead of on the first voice request
+if os.getenv("VOICE_WARMUP_ON_START", "0").lower() in ("1", "true", "yes"):
+    print("Warmed up models:", voice_service.warm_up())
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    """
+    Readiness probe: 503 until every enabled model is loaded. Read-only; load
+    them with VOICE_WARMUP_ON_START, `flask warm-up` or POST /admin/warm-up.
+    """
+    status = voice_service.models_status()
+    is_ready = all(m["loaded"] for m in status.values() if m["enabled"])
+    return jsonify(ready=is_ready, models=status), 200 if is_ready else 503
+
 if __name__ == "__main__":
+    start_archiver(app)
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,215 @@
+"""
+ASGI entry point:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+Views marked with flows.flow_view (/voice/verify, /voice/identify,
+/voice/enroll, /auth/login/voice) run as coroutines. Their request parsing,
+auth and DB work run on the default thread pool. Inference is awaited on the
+model schedulers, so a request waiting for Whisper or ECAPA holds no thread,
+and one process can keep thousands of them in flight. Size VOICE_QUEUE_MAX
+and VOICE_QUEUE_TIMEOUT for that. Every other route runs as the usual
+synchronous Flask view on a worker thread, so light endpoints keep
+answering while the models are busy.
+
+benchmarks/bench_voice_load.py with a stubbed 0.5 s Whisper batch (batches
+of 8): one process answered 15.8 verifies/s with 64 in flight and 15.1/s
+with 512, against 8.6 and 8.3/s for the sync app on 8 threads, and the
+/voice/phrases p95 stayed at 50 / 127 ms instead of 7.2 / 30 s.
+
+The WebSocket /voice/stream (voice_stream.py) logs a voice in while the
+user is still speaking.
+"""
+import asyncio
+import contextvars
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from flask import g
+from werkzeug.exceptions import HTTPException
+from app import app as flask_app
+from models import db
+from flows import run_flow_async
+from audit_archive import start_archiver
+import voice_stream
+
+_MAX_BODY = int(os.getenv("ASGI_MAX_BODY_BYTES", 64 * 1024 * 1024))
+# threads for the sync steps of flow views, and, separately, for all other
+# views, so light endpoints never queue behind voice request steps
+_THREADS = int(os.getenv("ASGI_THREADS", 32))
+_wsgi_pool = ThreadPoolExecutor(int(os.getenv("ASGI_WSGI_THREADS", 32)), thread_name_prefix="asgi-wsgi")
+
+
+def _environ(scope, body: bytes) -> dict:
+    """WSGI environ for an ASGI http scope and its (fully read) body."""
+    headers = {}
+    for name, value in scope["headers"]:
+        key = name.decode("latin1").upper().replace("-", "_")
+        if key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            key = "HTTP_" + key
+        value = value.decode("latin1")
+        headers[key] = f"{headers[key]},{value}" if key in headers else value
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    root_path, path = scope.get("root_path", ""), scope["path"]
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    return {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root_path.encode("utf-8").decode("latin1"),
+        "PATH_INFO": path.encode("utf-8").decode("latin1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+        **headers,
+    }
+
+
+class _Disconnected(Exception):
+    """The client went away before its request body was complete."""
+
+
+async def _read_body(receive) -> bytes | None:
+    """
+    The request body, or None once it grows past ASGI_MAX_BODY_BYTES.
+    Raises _Disconnected if the client disconnects part-way through.
+    """
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise _Disconnected()
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > _MAX_BODY:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+def _wire_headers(headers) -> list:
+    return [(k.lower().encode("latin1"), v.encode("latin1")) for k, v in headers]
+
+
+def _is_flow(environ) -> bool:
+    adapter = flask_app.url_map.bind_to_environ(environ)
+    try:
+        endpoint, _ = adapter.match()
+    except HTTPException:
+        return False
+    return getattr(flask_app.view_functions.get(endpoint), "is_flow", False)
+
+
+def _start_flow():
+    # Flask's full_dispatch_request, minus finalizing: a flow view hands back
+    # its generator once the decorators have let the request through
+    rv = flask_app.preprocess_request()
+    return rv if rv is not None else flask_app.dispatch_request()
+
+
+async def _serve_flow(environ, send):
+    with flask_app.request_context(environ):
+        g.async_flow = True
+        try:
+            try:
+                rv = await asyncio.to_thread(_start_flow)
+                if hasattr(rv, "send") and hasattr(rv, "throw"):
+                    rv = await run_flow_async(rv, release=db.session.rollback)
+            except Exception as e:
+                rv = await asyncio.to_thread(flask_app.handle_user_exception, e)
+            response = await asyncio.to_thread(flask_app.finalize_request, rv)
+        except Exception as e:
+            response = flask_app.handle_exception(e)
+        await send({"type": "http.response.start", "status": response.status_code,
+                    "headers": _wire_headers(response.headers.items())})
+        await send({"type": "http.response.body", "body": response.get_data()})
+
+
+def _run_wsgi(environ, send_sync):
+    # the plain Flask app on a worker thread, streaming its body back to the loop
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [int(status.split(" ", 1)[0]), headers]
+
+    result = flask_app(environ, start_response)
+    try:
+        sent = False
+        for chunk in result:
+            if not sent:
+                send_sync({"type": "http.response.start", "status": started[0],
+                           "headers": _wire_headers(started[1])})
+                sent = True
+            if chunk:
+                send_sync({"type": "http.response.body", "body": chunk, "more_body": True})
+        if not sent:
+            send_sync({"type": "http.response.start", "status": started[0],
+                       "headers": _wire_headers(started[1])})
+        send_sync({"type": "http.response.body", "body": b""})
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+
+
+async def _serve_wsgi(environ, send):
+    loop = asyncio.get_running_loop()
+
+    def send_sync(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    ctx = contextvars.copy_context()
+    await loop.run_in_executor(_wsgi_pool, ctx.run, _run_wsgi, environ, send_sync)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            asyncio.get_running_loop().set_default_executor(
+                ThreadPoolExecutor(_THREADS, thread_name_prefix="asgi"))
+            start_archiver(flask_app)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] == "websocket":
+        if scope["path"] == voice_stream.PATH:
+            return await voice_stream.serve(flask_app, scope, receive, send)
+        await receive()
+        return await send({"type": "websocket.close", "code": 1008})
+    if scope["type"] != "http":
+        raise RuntimeError(f"Unsupported ASGI scope: {scope['type']}")
+
+    try:
+        body = await _read_body(receive)
+    except _Disconnected:
+        return                                  # never run a view on a truncated body
+    if body is None:
+        await send({"type": "http.response.start", "status": 413,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": b'{"msg": "Request body too large"}'})
+        return
+
+    environ = _environ(scope, body)
+    if _is_flow(environ):
+        await _serve_flow(environ, send)
+    else:
+        await _serve_wsgi(environ, send)
@@ -0,0 +1,122 @@
+# backend/audio_upload.py
+import base64
+import binascii
+import os
+from flask import request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+# largest accepted recording, checked while the body is read
+MAX_AUDIO_BYTES = int(os.getenv("VOICE_UPLOAD_MAX_BYTES", 10 * 1024 * 1024))
+
+_CHUNK = 64 * 1024
+# room for the other form fields and part headers of a multipart upload
+_FORM_OVERHEAD = 64 * 1024
+
+
+class UploadError(Exception):
+    """A voice request whose audio is missing, malformed or too large."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def _too_large(limit: int) -> UploadError:
+    return UploadError(f"Audio exceeds {limit} bytes", 413)
+
+
+def _read_limited(stream, limit: int) -> bytes:
+    buf = bytearray()
+    while True:
+        chunk = stream.read(_CHUNK)
+        if not chunk:
+            return bytes(buf)
+        buf += chunk
+        if len(buf) > limit:
+            raise _too_large(limit)
+
+
+def _from_base64(value, limit: int) -> bytes:
+    # accepts a bare base64 string or a data: URI
+    if not isinstance(value, str):
+        raise UploadError("Invalid base64 audio")
+    if "," in value:
+        value = value.split(",", 1)[1]
+    if len(value) * 3 // 4 > limit:
+        raise _too_large(limit)
+    try:
+        return base64.b64decode(value)
+    except (binascii.Error, ValueError):
+        raise UploadError("Invalid base64 audio")
+
+
+def _number(value: str):
+    # isdigit() also accepts superscripts like "²", which int() rejects
+    return int(value) if value.isdecimal() else value
+
+
+def _fields(multidict) -> dict:
+    # form and query values are strings; numeric ones come back as ints, like JSON
+    return {k: _number(v) for k, v in multidict.items()}
+
+
+def _is_raw() -> bool:
+    mimetype = request.mimetype
+    return mimetype.startswith("audio/") or mimetype == "application/octet-stream"
+
+
+def _multipart(limit: int):
+    request.max_content_length = limit + _FORM_OVERHEAD
+    try:
+        return request.form, request.files
+    except RequestEntityTooLarge:
+        raise _too_large(limit)
+
+
+def read_audio(field: str = "audio", limit: int = MAX_AUDIO_BYTES) -> tuple[dict, bytes | None]:
+    """
+    Fields and raw clip of a voice request, whichever way it was sent:
+
+    - a raw audio/* (or application/octet-stream) body, fields in the query string
+    - multipart/form-data with the clip as file `field`
+    - JSON with the clip base64-encoded under `field` (the original format)
+
+    The clip is None when missing. Raises UploadError (400/413).
+    """
+    if _is_raw():
+        if (request.content_length or 0) > limit:
+            raise _too_large(limit)
+        return _fields(request.args), _read_limited(request.stream, limit) or None
+    if request.mimetype == "multipart/form-data":
+        form, files = _multipart(limit)
+        upload = files.get(field)
+        fields = {**_fields(request.args), **_fields(form)}
+        return fields, _read_limited(upload.stream, limit) if upload else None
+    data = request.get_json(silent=True) or {}
+    value = data.get(field)
+    return data, _from_base64(value, limit) if value else None
+
+
+def read_recordings(max_count: int, limit: int = MAX_AUDIO_BYTES) -> list[dict] | None:
+    """
+    Enrollment recordings as [{"phrase_id", "audio": bytes | None}, ...], from
+    multipart (repeated phrase_id fields and audio files, in order) or JSON
+    {"recordings": [{"phrase_id", "audio": base64}, ...]}. None when the body
+    holds no recording list. Raises UploadError (400/413).
+    """
+    if request.mimetype == "multipart/form-data":
+        form, files = _multipart(limit * max_count)
+        ids = [_number(v) for v in form.getlist("phrase_id")]
+        uploads = files.getlist("audio")
+        if len(ids) != len(uploads):
+            raise UploadError("Send one phrase_id per audio file")
+        return [{"phrase_id": pid, "audio": _read_limited(f.stream, limit)}
+                for pid, f in zip(ids, uploads)]
+    recs = (request.get_json(silent=True) or {}).get("recordings")
+    if not isinstance(recs, list):
+        return None
+    if not all(isinstance(rec, dict) for rec in recs):
+        raise UploadError("Each recording must be an object")
+    return [{"phrase_id": rec.get("phrase_id"),
+             "audio": _from_base64(rec["audio"], limit) if rec.get("audio") else None}
+            for rec in recs]
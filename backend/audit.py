@@ -0,0 +1,290 @@
+# backend/audit.py
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError
+from models import db, AuditLog
+
+
+class AuditWriter:
+    """
+    Buffers audit events in memory and writes them with bulk INSERTs from a
+    background thread, so request handlers never commit just for an audit row.
+
+    A batch is flushed when it reaches `batch_size` events or `flush_interval`
+    seconds after its first event. The queue is bounded; when it is full the
+    `policy` decides: "drop" discards the event (counted), "block" waits up to
+    `block_timeout` seconds for room and then drops. Events that cannot be
+    written (database down, process exiting) are appended to a JSONL spill file
+    and replayed by the next process that starts. Events the database refuses
+    outright (e.g. a user deleted while their event was queued) go to
+    `<spill_path>.rejected` instead, so one bad row never holds up the rest.
+    """
+
+    def __init__(self, app, batch_size=200, flush_interval=1.0, max_queue=10000,
+                 policy="drop", block_timeout=0.05, spill_path=None):
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.spill_path = spill_path
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0, "dropped": 0, "flushed": 0, "batches": 0,
+            "spilled": 0, "replayed": 0, "rejected": 0, "failed_flushes": 0,
+            "last_flush_ms": None, "last_batch_size": None,
+        }
+
+    def _count(self, **deltas):
+        with self._stats_lock:
+            for k, v in deltas.items():
+                self._stats[k] += v
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+                self._thread.start()
+
+    def record(self, user_id, action, details=None):
+        event = {
+            "user_id":   int(user_id) if user_id is not None else None,
+            "action":    action,
+            "details":   details,
+            "timestamp": datetime.utcnow(),
+        }
+        self._ensure_thread()
+        try:
+            if self.policy == "block":
+                self._queue.put(event, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(event)
+        except queue.Full:
+            self._count(dropped=1)
+            return False
+        self._count(enqueued=1)
+        return True
+
+    def _take_batch(self) -> list:
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop.is_set():
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._take_batch()
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch: list) -> int:
+        """Insert `batch`; returns how many rows were written. Never raises."""
+        started = time.perf_counter()
+        with self.app.app_context():
+            try:
+                db.session.execute(insert(AuditLog), batch)
+                db.session.commit()
+            except (IntegrityError, DataError):
+                # some row is bad, not the database: find it row by row
+                db.session.rollback()
+                return self._write_rows(batch)
+            except Exception:
+                traceback.print_exc()
+                db.session.rollback()
+                self._count(failed_flushes=1)
+                self._spill(batch)
+                return 0
+        self._count(flushed=len(batch), batches=1)
+        with self._stats_lock:
+            self._stats["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            self._stats["last_batch_size"] = len(batch)
+        return len(batch)
+
+    def _write_rows(self, batch: list) -> int:
+        written, rejected = 0, []
+        for i, event in enumerate(batch):
+            try:
+                db.session.execute(insert(AuditLog), [event])
+                db.session.commit()
+                written += 1
+            except (IntegrityError, DataError):
+                db.session.rollback()
+                rejected.append(event)
+            except Exception:
+                traceback.print_exc()
+                db.session.rollback()
+                self._count(failed_flushes=1)
+                self._spill(batch[i:])
+                break
+        self._count(flushed=written, batches=1)
+        self._reject(rejected)
+        return written
+
+    def _drain(self) -> list:
+        events = []
+        while True:
+            try:
+                events.append(self._queue.get_nowait())
+            except queue.Empty:
+                return events
+
+    def flush(self):
+        """Write everything queued so far, on the calling thread."""
+        while True:
+            events = self._drain()
+            if not events:
+                return
+            for i in range(0, len(events), self.batch_size):
+                self._write(events[i:i + self.batch_size])
+
+    def _append(self, path: str, lines: list):
+        with self._spill_lock, open(path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def _line(event: dict) -> str:
+        return json.dumps({**event, "timestamp": event["timestamp"].isoformat()}, default=str) + "\n"
+
+    def _spill(self, events: list):
+        if not self.spill_path or not events:
+            return
+        self._append(self.spill_path, [self._line(e) for e in events])
+        self._count(spilled=len(events))
+
+    def _reject(self, events: list, lines: list = ()):
+        # kept for inspection, never replayed
+        if not events and not lines:
+            return
+        print(f"audit: rejected {len(events) + len(lines)} event(s)")
+        if self.spill_path:
+            self._append(f"{self.spill_path}.rejected", [self._line(e) for e in events] + list(lines))
+        self._count(rejected=len(events) + len(lines))
+
+    def shutdown(self):
+        """Stop the flusher; whatever is still queued goes to the spill file."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 1)
+        self._spill(self._drain())
+
+    def replay_spill(self) -> int:
+        """
+        Insert events left in the spill file by a previous process. Never
+        raises: events that still cannot be written are spilled again for the
+        next start, and lines that cannot be parsed are rejected.
+        """
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return 0
+        # claim the file first so concurrently starting workers don't double-insert
+        claimed = f"{self.spill_path}.{uuid.uuid4().hex}.replay"
+        try:
+            os.replace(self.spill_path, claimed)
+        except FileNotFoundError:
+            return 0
+        try:
+            events, bad = [], []
+            with open(claimed, encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        event = json.loads(line)
+                        event["timestamp"] = datetime.fromisoformat(event["timestamp"])
+                        events.append(event)
+                    except (ValueError, KeyError, TypeError):
+                        bad.append(line)
+            self._reject([], bad)
+            written = sum(self._write(events[i:i + self.batch_size])
+                          for i in range(0, len(events), self.batch_size))
+        except Exception:
+            # leave the file where the next start (or an operator) finds it
+            traceback.print_exc()
+            os.replace(claimed, f"{self.spill_path}.{uuid.uuid4().hex}.failed")
+            return 0
+        os.unlink(claimed)
+        self._count(replayed=written)
+        return written
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                **self._stats,
+                "queue_depth":    self._queue.qsize(),
+                "queue_capacity": self._queue.maxsize,
+                "policy":         self.policy,
+            }
+
+
+_writer: AuditWriter | None = None
+
+
+def init_audit(app):
+    """
+    Create the process-wide writer from AUDIT_* settings and replay any spill
+    file. Must be called inside an application context. AUDIT_ASYNC=0 keeps
+    audit writes synchronous (one INSERT + commit per event).
+    """
+    global _writer
+    if os.getenv("AUDIT_ASYNC", "1").lower() in ("0", "false", "no"):
+        _writer = None
+        return None
+    _writer = AuditWriter(
+        app,
+        batch_size=int(os.getenv("AUDIT_BATCH_SIZE", 200)),
+        flush_interval=float(os.getenv("AUDIT_FLUSH_INTERVAL", 1.0)),
+        max_queue=int(os.getenv("AUDIT_QUEUE_MAX", 10000)),
+        policy=os.getenv("AUDIT_QUEUE_POLICY", "drop").lower(),
+        spill_path=os.getenv("AUDIT_SPILL_PATH") or os.path.join(app.instance_path, "audit-spill.jsonl"),
+    )
+    os.makedirs(os.path.dirname(_writer.spill_path), exist_ok=True)
+    _writer.replay_spill()
+    atexit.register(_writer.shutdown)
+    return _writer
+
+
+def record(user_id, action, details=None):
+    """Record an audit event without touching the caller's session."""
+    if _writer is not None:
+        return _writer.record(user_id, action, details)
+    db.session.add(AuditLog(user_id=user_id, action=action, details=details))
+    db.session.commit()
+    return True
+
+
+def flush():
+    if _writer is not None:
+        _writer.flush()
+
+
+def audit_stats() -> dict:
+    if _writer is None:
+        return {"async": False}
+    return {"async": True, **_writer.stats()}
@@ -0,0 +1,398 @@
+# backend/audit_archive.py
+import gzip
+import json
+import os
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from sqlalchemy import DateTime, bindparam, text
+from models import db
+
+# Audit logs are kept "hot" in the database for AUDIT_RETENTION_DAYS, in whole
+# calendar months. Older months are archived to gzip-compressed JSONL files
+# (at most _FILE_ROWS rows each, oldest first) under AUDIT_ARCHIVE_DIR, listed
+# in index.json, and removed from the database. Each file is a series of gzip
+# members of _BLOCK_ROWS rows; a sidecar <file>.idx maps each block's first
+# (timestamp, id) to its byte offset, so a page deep in the archive is read
+# by seeking to its block instead of decompressing whole files. On Postgres the table can be
+# converted to native monthly RANGE partitions (`flask audit-partition`), in
+# which case an expired month is detached and dropped instead of DELETEd.
+
+_FILE_ROWS = int(os.getenv("AUDIT_ARCHIVE_FILE_ROWS", 100_000))
+_BLOCK_ROWS = 1000
+_READ_BATCH = 5000
+
+
+def retention_days() -> int:
+    return int(os.getenv("AUDIT_RETENTION_DAYS", 90))
+
+
+def archive_dir(app) -> str:
+    path = os.getenv("AUDIT_ARCHIVE_DIR") or os.path.join(app.instance_path, "audit-archive")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _month_start(dt: datetime) -> datetime:
+    return datetime(dt.year, dt.month, 1)
+
+
+def _next_month(dt: datetime) -> datetime:
+    return datetime(dt.year + dt.month // 12, dt.month % 12 + 1, 1)
+
+
+def _partition_name(month: datetime) -> str:
+    return f"audit_logs_y{month.year}m{month.month:02d}"
+
+
+# ---------------------------------------------------------------- partitions
+
+def is_partitioned() -> bool:
+    if db.engine.dialect.name != "postgresql":
+        return False
+    return bool(db.session.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = 'audit_logs'"
+    )).scalar())
+
+
+def ensure_partitions(months_ahead: int = 2):
+    """Create monthly partitions from the current month up to `months_ahead` ahead."""
+    if not is_partitioned():
+        return
+    month = _month_start(datetime.utcnow())
+    for _ in range(months_ahead + 1):
+        _create_partition(month)
+        month = _next_month(month)
+    db.session.commit()
+
+
+def _create_partition(month: datetime):
+    db.session.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {_partition_name(month)} PARTITION OF audit_logs "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')"
+    ))
+
+
+def convert_to_partitioned():
+    """
+    One-off Postgres migration: rebuild audit_logs as a table RANGE-partitioned
+    by month on timestamp (primary key becomes (id, timestamp)), with a DEFAULT
+    partition, and copy the existing rows over. Runs in one transaction.
+    """
+    if db.engine.dialect.name != "postgresql":
+        raise RuntimeError("Native partitioning needs Postgres; SQLite uses archival only")
+    if is_partitioned():
+        return False
+
+    bounds = db.session.execute(text("SELECT min(timestamp), max(timestamp) FROM audit_logs")).one()
+    statements = [
+        "ALTER TABLE audit_logs RENAME TO audit_logs_unpartitioned",
+        "ALTER TABLE audit_logs_unpartitioned RENAME CONSTRAINT audit_logs_pkey TO audit_logs_unpartitioned_pkey",
+        "DROP INDEX IF EXISTS ix_audit_logs_timestamp_id",
+        "DROP INDEX IF EXISTS ix_audit_logs_user_timestamp_id",
+        "DROP INDEX IF EXISTS ix_audit_logs_action_timestamp_id",
+        "ALTER SEQUENCE audit_logs_id_seq OWNED BY NONE",
+        "CREATE TABLE audit_logs (LIKE audit_logs_unpartitioned INCLUDING DEFAULTS) "
+        "PARTITION BY RANGE (timestamp)",
+        "ALTER TABLE audit_logs ADD PRIMARY KEY (id, timestamp)",
+        "ALTER TABLE audit_logs ADD FOREIGN KEY (user_id) REFERENCES users (id)",
+        "CREATE INDEX ix_audit_logs_timestamp_id ON audit_logs (timestamp, id)",
+        "CREATE INDEX ix_audit_logs_user_timestamp_id ON audit_logs (user_id, timestamp, id)",
+        "CREATE INDEX ix_audit_logs_action_timestamp_id ON audit_logs (action, timestamp, id)",
+        "CREATE TABLE audit_logs_default PARTITION OF audit_logs DEFAULT",
+    ]
+    for stmt in statements:
+        db.session.execute(text(stmt))
+
+    first = _month_start(bounds[0] or datetime.utcnow())
+    last = _month_start(max(bounds[1] or datetime.utcnow(), datetime.utcnow()))
+    month = first
+    while month <= _next_month(_next_month(last)):
+        _create_partition(month)
+        month = _next_month(month)
+
+    db.session.execute(text("INSERT INTO audit_logs SELECT * FROM audit_logs_unpartitioned"))
+    db.session.execute(text("DROP TABLE audit_logs_unpartitioned"))
+    db.session.execute(text("ALTER SEQUENCE audit_logs_id_seq OWNED BY audit_logs.id"))
+    db.session.commit()
+    return True
+
+
+def _partition_exists(month: datetime) -> bool:
+    return bool(db.session.execute(
+        text("SELECT to_regclass(:name) IS NOT NULL"), {"name": _partition_name(month)}
+    ).scalar())
+
+
+# ------------------------------------------------------------------ archival
+
+def _load_index(root: str) -> list[dict]:
+    path = os.path.join(root, "index.json")
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_index(root: str, entries: list[dict]):
+    tmp = os.path.join(root, "index.json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(sorted(entries, key=lambda e: (e["min_ts"], e["min_id"])), f, indent=1)
+    os.replace(tmp, os.path.join(root, "index.json"))
+
+
+def _rows_in(start: datetime, end: datetime, after: tuple | None = None):
+    """
+    Stream audit rows (with username) in [start, end), ordered by (timestamp,
+    id), starting after the (timestamp, id) key `after` if given.
+    """
+    select = text(
+        "SELECT a.id, a.user_id, u.username, a.action, a.timestamp, a.details "
+        "FROM audit_logs a LEFT JOIN users u ON u.id = a.user_id "
+        "WHERE a.timestamp >= :start AND a.timestamp < :end "
+        "AND (a.timestamp > :ts OR (a.timestamp = :ts AND a.id > :id)) "
+        "ORDER BY a.timestamp, a.id LIMIT :n"
+    ).bindparams(
+        # typed, so SQLite compares them in the stored text format
+        bindparam("start", type_=DateTime), bindparam("end", type_=DateTime),
+        bindparam("ts", type_=DateTime),
+    )
+    ts, last_id = after or (start - timedelta(microseconds=1), 0)
+    while True:
+        batch = db.session.execute(
+            select, {"start": start, "end": end, "ts": ts, "id": last_id, "n": _READ_BATCH}
+        ).all()
+        if not batch:
+            return
+        for row in batch:
+            yield row
+        ts, last_id = _as_datetime(batch[-1].timestamp), batch[-1].id
+
+
+def _as_datetime(value) -> datetime:
+    # SQLite hands back text for raw SELECTs
+    return value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+
+
+def _write_file(root: str, month: datetime, seq: int, rows: list) -> dict:
+    name = f"audit-{month:%Y-%m}-{seq:05d}.jsonl.gz"
+    tmp = os.path.join(root, name + ".tmp")
+    blocks = []                                 # [first ts, first id, byte offset]
+    with open(tmp, "wb") as f:
+        for start in range(0, len(rows), _BLOCK_ROWS):
+            block = rows[start:start + _BLOCK_ROWS]
+            lines = []
+            for r in block:
+                details = r.details
+                if isinstance(details, str):
+                    details = json.loads(details)
+                lines.append(json.dumps({
+                    "id": r.id, "user_id": r.user_id, "username": r.username,
+                    "action": r.action, "timestamp": _as_datetime(r.timestamp).isoformat(),
+                    "details": details,
+                }) + "\n")
+            blocks.append([_as_datetime(block[0].timestamp).isoformat(), block[0].id, f.tell()])
+            # concatenated members are still one valid gzip file
+            f.write(gzip.compress("".join(lines).encode("utf-8")))
+    with open(tmp + ".idx", "w", encoding="utf-8") as f:
+        json.dump(blocks, f)
+    os.replace(tmp + ".idx", os.path.join(root, name + ".idx"))
+    os.replace(tmp, os.path.join(root, name))
+    return {
+        "file": name, "month": f"{month:%Y-%m}", "rows": len(rows),
+        "min_ts": _as_datetime(rows[0].timestamp).isoformat(), "min_id": rows[0].id,
+        "max_ts": _as_datetime(rows[-1].timestamp).isoformat(), "max_id": rows[-1].id,
+    }
+
+
+def _archive_month(root: str, month: datetime, index: list[dict]) -> int:
+    end = _next_month(month)
+    done = [e for e in index if e["month"] == f"{month:%Y-%m}"]
+    seq = len(done)
+    # rows already in an indexed file (a previous run died before its DELETE
+    # committed) are only deleted, never written out twice
+    after = max(((datetime.fromisoformat(e["max_ts"]), e["max_id"]) for e in done), default=None)
+    archived, buf = 0, []
+
+    def flush():
+        nonlocal seq, archived
+        index.append(_write_file(root, month, seq, buf))
+        _save_index(root, index)
+        seq += 1
+        archived += len(buf)
+        buf.clear()
+
+    for row in _rows_in(month, end, after):
+        buf.append(row)
+        if len(buf) >= _FILE_ROWS:
+            flush()
+    if buf:
+        flush()
+
+    # the files are durable and indexed; now drop the rows
+    if is_partitioned() and _partition_exists(month):
+        db.session.execute(text(f"ALTER TABLE audit_logs DETACH PARTITION {_partition_name(month)}"))
+        db.session.execute(text(f"DROP TABLE {_partition_name(month)}"))
+    # rows can also sit in the default partition / an unpartitioned table
+    db.session.execute(
+        text("DELETE FROM audit_logs WHERE timestamp >= :start AND timestamp < :end"),
+        {"start": month, "end": end},
+    )
+    db.session.commit()
+    return archived
+
+
+def archive_expired(app, now: datetime | None = None) -> dict:
+    """
+    Archive and remove every whole month older than the retention window.
+    Returns {"YYYY-MM": rows archived}.
+    """
+    days = retention_days()
+    if days <= 0:
+        return {}
+    cutoff = _month_start((now or datetime.utcnow()) - timedelta(days=days))
+    oldest = db.session.execute(text("SELECT min(timestamp) FROM audit_logs")).scalar()
+    if oldest is None:
+        return {}
+
+    root = archive_dir(app)
+    index = _load_index(root)
+    done = {}
+    month = _month_start(_as_datetime(oldest))
+    while month < cutoff:
+        done[f"{month:%Y-%m}"] = _archive_month(root, month, index)
+        month = _next_month(month)
+    return done
+
+
+# ------------------------------------------------------------- reading back
+
+def has_archive(app) -> bool:
+    return bool(_load_index(archive_dir(app)))
+
+
+def _blocks(root: str, entry: dict) -> list[tuple]:
+    """[((first ts, first id), start, end)] byte ranges of a file's gzip members, oldest first."""
+    path = os.path.join(root, entry["file"])
+    size = os.path.getsize(path)
+    try:
+        with open(path + ".idx", encoding="utf-8") as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        # written before block indexes: one block, the whole file
+        index = [[entry["min_ts"], entry["min_id"], 0]]
+    starts = [offset for _, _, offset in index]
+    return [((datetime.fromisoformat(ts), row_id), start, end)
+            for (ts, row_id, start), end in zip(index, starts[1:] + [size])]
+
+
+def scan_archive(app, before, match, limit: int, max_blocks: int = 50):
+    """
+    Read archived rows newest-first, strictly older than `before` ((ts, id) or
+    None), keeping those for which `match(row)` is true. Blocks starting at
+    or after `before` are skipped without being read, and at most
+    `max_blocks` blocks are decompressed, so neither a deep page nor a sparse
+    filter turns into a full archive scan.
+
+    Returns (rows, resume) where `resume` is the (ts, id) to continue from, or
+    None when the archive is exhausted.
+    """
+    root = archive_dir(app)
+    files = sorted(_load_index(root), key=lambda e: (e["max_ts"], e["max_id"]), reverse=True)
+    if before is not None:
+        b_ts, b_id = before
+        files = [e for e in files
+                 if (datetime.fromisoformat(e["min_ts"]), e["min_id"]) < (b_ts, b_id)]
+
+    rows, scanned = [], 0
+    for entry in files:
+        with open(os.path.join(root, entry["file"]), "rb") as f:
+            for first, start, end in reversed(_blocks(root, entry)):
+                if before is not None and first >= before:
+                    continue
+                if scanned >= max_blocks:
+                    # every row of the blocks read so far is older than `floor`
+                    return rows, floor
+                scanned += 1
+                f.seek(start)
+                lines = gzip.decompress(f.read(end - start)).decode("utf-8").splitlines()
+                for line in reversed(lines):
+                    rec = json.loads(line)
+                    rec["timestamp"] = datetime.fromisoformat(rec["timestamp"])
+                    if before is not None and (rec["timestamp"], rec["id"]) >= before:
+                        continue
+                    if match(rec):
+                        rows.append(rec)
+                        if len(rows) >= limit:
+                            return rows, (rec["timestamp"], rec["id"])
+                floor = first
+    return rows, None
+
+
+# ------------------------------------------------------------ background job
+
+class _ArchiveLock:
+    """Cross-process lock so only one worker archives at a time (no-op without fcntl)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.f = None
+
+    def __enter__(self):
+        try:
+            import fcntl
+        except ImportError:
+            return True
+        self.f = open(self.path, "a")
+        try:
+            fcntl.flock(self.f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def __exit__(self, *exc):
+        if self.f is not None:
+            self.f.close()
+
+
+def run_maintenance(app) -> dict:
+    """Create upcoming partitions and archive expired months (one pass)."""
+    with app.app_context():
+        with _ArchiveLock(os.path.join(archive_dir(app), ".lock")) as acquired:
+            if not acquired:
+                return {}
+            ensure_partitions()
+            return archive_expired(app)
+
+
+_archiver: threading.Thread | None = None
+
+
+def start_archiver(app):
+    """
+    Run run_maintenance every AUDIT_ARCHIVE_INTERVAL seconds on a daemon thread
+    (once per process). Disabled when the interval or AUDIT_RETENTION_DAYS is 0.
+    Called by the server entry points only, never by `flask` CLI commands.
+    """
+    global _archiver
+    interval = float(os.getenv("AUDIT_ARCHIVE_INTERVAL", 6 * 3600))
+    if interval <= 0 or retention_days() <= 0:
+        return None
+    if _archiver is not None:
+        return _archiver
+
+    def loop():
+        while True:
+            try:
+                done = run_maintenance(app)
+                if done:
+                    print("Archived audit months:", done)
+            except Exception:
+                traceback.print_exc()
+            time.sleep(interval)
+
+    _archiver = threading.Thread(target=loop, name="audit-archiver", daemon=True)
+    _archiver.start()
+    return _archiver
@@ -1,36 +1,73 @@
 from flask import request, jsonify, Blueprint
-from models import db, User, AuditLog
+from models import db, User
 from flask_jwt_extended import create_access_token
-import base64, io, json, numpy as np
-from voice_service import extract_embedding
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from rbac import roles_required
+from voice_service import extract_embedding, extract_embedding_async
+from inference import Overloaded
+from passwords import hash_pool, login_ip_limiter, login_user_limiter
+from speaker_index import speaker_index
+from flask_jwt_extended import jwt_required
+from rbac import ROLES, normalize_role, roles_required
+from flows import Await, flow_view
+from audio_upload import UploadError, read_audio
+import audit
 import datetime
 
 # auth_bp = Blueprint("auth", __name__)
 auth_bp = Blueprint("auth", __name__, url_prefix="/auth")
 
+
+@auth_bp.errorhandler(UploadError)
+def _upload_error(e):
+    return jsonify(msg=str(e)), e.status
+
+
+def _too_many(retry_after: float):
+    resp = jsonify(msg="Too many login attempts, try again later")
+    resp.headers['Retry-After'] = str(int(retry_after) + 1)
+    return resp, 429
+
+
 @auth_bp.route('/login', methods=['POST'])
 def login():
     data = request.get_json()
+    ip = request.remote_addr or ''
+    # reject bursts before touching the database or the KDF; the per-user
+    # bucket is keyed by the username alone, so rotating addresses buys no
+    # extra guesses. Each attempt is charged up front (concurrent guesses
+    # cannot all slip through one remaining token) and refunded on success.
+    user_key = str(data['username']).strip().lower()
+    retry_after = login_ip_limiter.hit(ip) or login_user_limiter.hit(user_key)
+    if retry_after:
+        return _too_many(retry_after)
+
     user = User.query.filter_by(username=data['username']).first()
-    if user and user.check_password(data['password']):
+    if not user:
+        return jsonify(msg="Bad credentials"), 401
+    try:
+        ok, new_hash = hash_pool.verify(user.password_hash, data['password'])
+    except Overloaded:
+        login_user_limiter.refund(user_key)
+        return jsonify(msg="Login service busy, try again"), 503
+    if ok:
+        login_user_limiter.refund(user_key)
+        if new_hash:
+            # stored with outdated KDF parameters: upgrade transparently
+            user.password_hash = new_hash
+            db.session.commit()
         now_iso = datetime.datetime.utcnow().isoformat()
         access_token = create_access_token(
             identity=str(user.id),
             additional_claims={
-                'role': user.role.lower(),
+                'role': normalize_role(user.role),
                 'username': user.username,
                 'voice_verified_at': now_iso
             }
         )
-        log = AuditLog(
+        audit.record(
             user_id=user.id,
             action='login',
             details={'method': 'password'}
         )
-        db.session.add(log)
-        db.session.commit()
         return  jsonify(access_token=access_token),  200
     return jsonify(msg="Bad credentials"), 401
 
@@ -50,10 +87,14 @@ def register():
     if not all([username, password, role]):
         return jsonify(msg="Username, password, and role are required"), 400
 
+    role = normalize_role(role)
+    if role not in ROLES:
+        return jsonify(msg=f"Invalid role: must be one of {list(ROLES)}"), 400
+
     if User.query.filter_by(username=username).first():
         return jsonify(msg="User already exists"), 409
     
-    new_user = User(username=username, role=role.lower())
+    new_user = User(username=username, role=role)
     new_user.set_password(password)
     
     db.session.add(new_user)
@@ -61,60 +102,66 @@ def register():
     
     return jsonify(msg="User created successfully"), 201
 
+# lowest speaker-index cosine that logs a voice in
+VOICE_LOGIN_MIN_CONFIDENCE = 0.5
+
+
+def issue_voice_token(user_id, phrase_id, confidence, **details):
+    """
+    JWT for a voice login of `user_id`, recorded in the audit log, or None if
+    the user no longer exists. Needs an app context.
+    """
+    # role and username come from the database, not from the index, so a
+    # role change or deletion handled by another worker is respected
+    user = User.query.get(user_id)
+    if user is None:
+        return None
+
+    # success → issue JWT
+    token = create_access_token(
+        identity=str(user_id),
+        additional_claims={
+            "role": normalize_role(user.role),
+            "username": user.username
+        }
+    )
+    audit.record(
+        user_id=user_id,
+        action='login_voice',
+        details={'phrase_id': phrase_id, 'confidence': confidence, **details}
+    )
+    return token
+
+
 @auth_bp.route('/login/voice', methods=['POST'])
+@flow_view
 def login_voice():
-    data = request.get_json()
+    # base64 JSON (data: URI or raw), a raw audio/webm body or a multipart upload
+    data, webm_bytes = read_audio()
     phrase_id = data.get('phrase_id')
-    audio_b64 = data.get('audio')
-    if phrase_id is None or not audio_b64:
+    if phrase_id is None or not webm_bytes:
         return jsonify(msg="phrase_id and audio are required"), 400
 
-    # decode base64 (allow data: URI or raw)
-    header, b64 = audio_b64.split(',', 1) if ',' in audio_b64 else ("", audio_b64)
-    webm_bytes = base64.b64decode(b64)
-
     # extract ECAPA-TDNN embedding
     try:
-        probe_emb = extract_embedding(webm_bytes)
+        probe_emb = yield Await(extract_embedding, extract_embedding_async, webm_bytes)
+    except Overloaded:
+        return jsonify(msg="Voice service busy, try again"), 503
     except Exception as e:
         return jsonify(msg="Embedding extraction failed", error=str(e)), 500
 
-    # find best cosine-similarity match
-    probe_arr = np.array(probe_emb, dtype=float)
-    probe_norm = np.linalg.norm(probe_arr) + 1e-8
-    best_user, best_conf = None, -1.0
-
-    for user in User.query.filter(User.voice_profile.isnot(None)).all():
-        try:
-            profile = np.array(json.loads(user.voice_profile.decode('utf-8')), dtype=float)
-        except Exception:
-            continue
-        cos_sim = float(np.dot(probe_arr, profile) /
-                        (probe_norm * (np.linalg.norm(profile) + 1e-8)))
-        if cos_sim > best_conf:
-            best_conf, best_user = cos_sim, user
-
-    if best_user is None:
+    # find best cosine-similarity match against the in-memory speaker index
+    matches = speaker_index.search(probe_emb, k=1)
+    if not matches:
         return jsonify(message="No enrolled users", confidence=0), 404
+    best_user_id, best_conf = matches[0]
 
     # threshold = 0.6
     # if best_conf < 0.6:
-    if best_conf < 0.5:
+    if best_conf < VOICE_LOGIN_MIN_CONFIDENCE:
         return jsonify(message="No matching user", confidence=best_conf), 401
 
-    # success → issue JWT
-    token = create_access_token(
-        identity=str(best_user.id),
-        additional_claims={
-            "role": best_user.role.lower(),
-            "username": best_user.username
-        }
-    )
-    log = AuditLog(
-        user_id=best_user.id,
-        action='login_voice',
-        details={'phrase_id': phrase_id, 'confidence': best_conf}
-    )
-    db.session.add(log)
-    db.session.commit()
+    token = issue_voice_token(best_user_id, phrase_id, best_conf)
+    if token is None:
+        return jsonify(message="No matching user", confidence=best_conf), 401
     return jsonify(access_token=token, confidence=best_conf), 200
\ No newline at end of file
@@ -0,0 +1,104 @@
+"""
+Speaker identification: IVF approximate search vs. the exact matcher.
+
+    python benchmarks/bench_ann.py [--users 200000] [--dim 192] [--queries 500]
+                                   [--nprobe 1,4,8,16,32,64] [--nlist 0]
+
+Profiles are synthetic: users are drawn around a few thousand "accent"
+clusters (real speaker embeddings are far from uniform), and each probe is
+one user's profile plus noise, i.e. a new utterance by an enrolled speaker.
+Recall@1 is the share of probes where the ANN returns the same best user as
+exact search; recall@10 compares the top-10 sets. Also reports training time
+and how long a worker takes to open the saved index memory-mapped, and checks
+that an index grown one enrollment at a time past ann_min switches to the ANN
+once it is trained the way SharedSpeakerIndex.compact() trains it.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ann_index import IVFIndex  # noqa: E402
+from speaker_index import SpeakerIndex  # noqa: E402
+
+
+def synthetic_profiles(rng, n, dim, clusters):
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    return centers[labels] + 0.8 * rng.standard_normal((n, dim)).astype(np.float32)
+
+
+def run(index, probes, k, exact):
+    started = time.perf_counter()
+    results = [index.search(p, k=k, exact=exact) for p in probes]
+    return results, (time.perf_counter() - started) * 1000 / len(probes)
+
+
+def check_growth(profiles, ann_min):
+    """Enroll one by one past ann_min; search must stay exact until compaction trains the ANN."""
+    index = SpeakerIndex(ann=IVFIndex(), ann_min=ann_min)
+    for i in range(min(len(profiles), 2 * ann_min)):
+        index.upsert(i, profiles[i])
+    assert not index.stats()["ann_active"], "ANN active before training"
+    assert index.needs_training(), "grown index not due for training"
+    index.train()
+    stats = index.stats()
+    assert stats["ann_active"] and not index.needs_training(), stats
+    print(f"growth check: {stats['profiles']} enrolled, ann_min={ann_min}, ann_active after compaction")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200_000)
+    parser.add_argument('--dim', type=int, default=192)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--clusters', type=int, default=2000)
+    parser.add_argument('--nlist', type=int, default=0, help='0 = 4*sqrt(users)')
+    parser.add_argument('--nprobe', default='1,4,8,16,32,64')
+    parser.add_argument('--ann-min', type=int, default=1000, help='threshold for the growth check')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    profiles = synthetic_profiles(rng, args.users, args.dim, args.clusters)
+    picks = rng.integers(0, args.users, size=args.queries)
+    probes = profiles[picks] + 0.5 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    check_growth(profiles, args.ann_min)
+
+    index = SpeakerIndex(ann=IVFIndex(nlist=args.nlist), ann_min=0)
+    started = time.perf_counter()
+    index.build((i, profiles[i]) for i in range(args.users))
+    build_s = time.perf_counter() - started
+    print(f"users={args.users} dim={args.dim} nlist={len(index._ann.centroids)} "
+          f"build+train={build_s:.1f}s")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'speaker-index.bin')
+        index.save(path)
+        started = time.perf_counter()
+        mapped = SpeakerIndex(ann=IVFIndex(), ann_min=0)
+        mapped.load(path)
+        mapped.search(probes[0])
+        print(f"file={os.path.getsize(path) / 1e6:.1f} MB  mmap open+first search="
+              f"{(time.perf_counter() - started) * 1000:.1f} ms")
+
+    exact1, exact_ms = run(index, probes, 1, exact=True)
+    exact10, _ = run(index, probes, 10, exact=True)
+    print(f"\n{'nprobe':>8} {'ms/query':>10} {'speedup':>8} {'recall@1':>9} {'recall@10':>10}")
+    print(f"{'exact':>8} {exact_ms:>10.3f} {'1x':>8} {1.0:>9.3f} {1.0:>10.3f}")
+    for nprobe in (int(x) for x in args.nprobe.split(',')):
+        index._ann.nprobe = nprobe
+        ann1, ann_ms = run(index, probes, 1, exact=False)
+        ann10, _ = run(index, probes, 10, exact=False)
+        r1 = np.mean([a[0][0] == e[0][0] for a, e in zip(ann1, exact1)])
+        r10 = np.mean([len({u for u, _ in a} & {u for u, _ in e}) / len(e)
+                       for a, e in zip(ann10, exact10)])
+        print(f"{nprobe:>8} {ann_ms:>10.3f} {exact_ms / ann_ms:>7.1f}x {r1:>9.3f} {r10:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Auth overhead per request: the old roles_required vs. the compiled RBAC policy.
+
+    python benchmarks/bench_auth.py [--requests 5000]
+
+Runs a throwaway Flask app (no database) with four copies of one trivial
+view: unprotected, @jwt_required() only, @jwt_required() + the old
+roles_required (second verify_jwt_in_request, role list rebuilt per request)
+and @jwt_required() + rbac.roles_required. Each is called through the test
+client with the same token; the "auth" column is the time over the
+unprotected view.
+"""
+import argparse
+import os
+import sys
+import time
+from functools import wraps
+
+from flask import Flask, jsonify
+from flask_jwt_extended import (JWTManager, create_access_token, get_jwt,
+                                jwt_required, verify_jwt_in_request)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rbac import roles_required  # noqa: E402
+
+
+def legacy_roles_required(*allowed_roles):
+    # rbac.roles_required before the policy table
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            verify_jwt_in_request()
+            claims = get_jwt()
+            user_role = claims.get("role", "").lower()
+            allowed = [r.lower() for r in allowed_roles]
+            if user_role not in allowed:
+                return jsonify({"msg": "Access denied"}), 403
+            return fn(*args, **kwargs)
+        return decorator
+    return wrapper
+
+
+def make_app():
+    app = Flask(__name__)
+    app.config["JWT_SECRET_KEY"] = "bench-secret-key-that-is-long-enough"
+    JWTManager(app)
+
+    def view():
+        return jsonify(ok=True)
+
+    roles = ("admin", "data analyst", "business user", "viewer")
+    app.add_url_rule("/open", "open", view)
+    app.add_url_rule("/jwt", "jwt", jwt_required()(view))
+    app.add_url_rule("/legacy", "legacy", jwt_required()(legacy_roles_required(*roles)(view)))
+    app.add_url_rule("/policy", "policy", jwt_required()(roles_required(*roles)(view)))
+    return app
+
+
+def timed(client, path, headers, n):
+    assert client.get(path, headers=headers).status_code == 200
+    t0 = time.perf_counter()
+    for _ in range(n):
+        client.get(path, headers=headers)
+    return (time.perf_counter() - t0) / n * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=5000)
+    args = parser.parse_args()
+
+    app = make_app()
+    with app.app_context():
+        token = create_access_token(identity="1", additional_claims={"role": "viewer"})
+    headers = {"Authorization": f"Bearer {token}"}
+    client = app.test_client()
+
+    base = timed(client, "/open", headers, args.requests)
+    print(f"{'route':>8} {'us/req':>8} {'auth us':>8}")
+    for name in ("open", "jwt", "legacy", "policy"):
+        us = base if name == "open" else timed(client, f"/{name}", headers, args.requests)
+        print(f"{name:>8} {us:>8.1f} {us - base:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
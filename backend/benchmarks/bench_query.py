@@ -0,0 +1,96 @@
+"""
+Query engine latency over a synthetic dataset (default 10M rows).
+
+    python benchmarks/bench_query.py [--rows 10000000] [--dir /tmp/ttd-bench-query]
+
+Writes the dataset once as 1M-row Parquet parts (reused on later runs), then
+times common aggregate shapes through query_engine.execute.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from query_engine import normalize_query, open_dataset, execute  # noqa: E402
+
+_PART_ROWS = 1_000_000
+
+SHAPES = {
+    "count(*)": {"aggregates": [{"fn": "count"}]},
+    "filtered sum": {
+        "filter": [{"column": "amount", "op": ">", "value": 500}],
+        "aggregates": [{"fn": "sum", "column": "amount"}],
+    },
+    "group by region (8)": {
+        "group_by": ["region"],
+        "aggregates": [{"fn": "sum", "column": "amount"}, {"fn": "mean", "column": "qty"}],
+    },
+    "group by customer (100k), top 10": {
+        "group_by": ["customer_id"],
+        "aggregates": [{"fn": "sum", "column": "amount", "as": "total"}],
+        "order_by": [{"column": "total", "desc": True}],
+        "limit": 10,
+    },
+    "range filter + group by": {
+        "filter": [{"column": "day", "op": "between", "value": [100, 130]},
+                   {"column": "region", "op": "in", "value": ["r1", "r2"]}],
+        "group_by": ["day"],
+        "aggregates": [{"fn": "count"}, {"fn": "max", "column": "amount"}],
+    },
+    "projection, first page": {"select": ["customer_id", "amount"], "limit": 100},
+}
+
+
+def build(path, rows):
+    os.makedirs(path, exist_ok=True)
+    files = []
+    rng = np.random.default_rng(0)
+    regions = np.array([f"r{i}" for i in range(8)])
+    for i, start in enumerate(range(0, rows, _PART_ROWS)):
+        n = min(_PART_ROWS, rows - start)
+        f = os.path.join(path, f"part-{i:05d}.parquet")
+        files.append(f)
+        if os.path.exists(f):
+            continue
+        table = pa.table({
+            "day": np.sort(rng.integers(0, 365, n)),
+            "region": regions[rng.integers(0, len(regions), n)],
+            "customer_id": rng.integers(0, 100_000, n),
+            "qty": rng.integers(1, 20, n),
+            "amount": rng.random(n) * 1000,
+        })
+        pq.write_table(table, f, row_group_size=128_000)
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--dir', default='/tmp/ttd-bench-query')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    files = build(os.path.join(args.dir, str(args.rows)), args.rows)
+    dataset = open_dataset(files, pq.read_schema(files[0]))
+    columns = dataset.schema.names
+
+    print(f"{args.rows:,} rows in {len(files)} parts")
+    print(f"{'shape':<36} {'best ms':>9} {'result rows':>12}")
+    for label, spec in SHAPES.items():
+        query = normalize_query(spec, columns)
+        best, result = float('inf'), None
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            result = execute(dataset, query)
+            best = min(best, time.perf_counter() - t0)
+        print(f"{label:<36} {best * 1000:>9.1f} {result['row_count']:>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Per-request resampling cost: building a new Resample transform each call (old
+extract_embedding) vs. the cached kernels from voice_service.get_resampler.
+
+    python benchmarks/bench_resample.py [--seconds 3] [--repeat 50]
+
+Only torch/torchaudio are needed; voice_service itself is not imported so the
+speech models are never loaded.
+"""
+import argparse
+import time
+from functools import lru_cache
+
+import torch
+import torchaudio
+
+
+@lru_cache(maxsize=8)
+def cached_resampler(orig_sr, new_sr):
+    # same construction as voice_service.get_resampler
+    return torchaudio.transforms.Resample(orig_sr, new_sr)
+
+
+def per_call(wav, sr):
+    return torchaudio.transforms.Resample(sr, 16000)(wav)
+
+
+def cached(wav, sr):
+    return cached_resampler(sr, 16000)(wav)
+
+
+def timed(fn, wav, sr, repeat):
+    fn(wav, sr)  # warm-up (fills the cache for the cached variant)
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn(wav, sr)
+    return (time.perf_counter() - t0) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    print(f"{'rate':>8} {'per-call ms':>12} {'cached ms':>10} {'saved':>7}")
+    for sr in (48000, 44100, 22050):
+        wav = torch.randn(int(sr * args.seconds))
+        assert torch.allclose(per_call(wav, sr), cached(wav, sr))
+        t_new = timed(per_call, wav, sr, args.repeat)
+        t_cached = timed(cached, wav, sr, args.repeat)
+        print(f"{sr:>8} {t_new:>12.2f} {t_cached:>10.2f} {1 - t_cached / t_new:>6.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Memory per worker: private in-memory speaker index vs. the shared mapped file.
+
+    python benchmarks/bench_shared_index.py [--users 200000] [--dim 192] [--workers 1,2,4,8]
+
+Forks N "workers" that each load the index and run searches, then sums
+their proportional set size (PSS, Linux /proc/<pid>/smaps_rollup): pages
+shared through the page cache are split between the processes that map
+them, so the total stays flat for the mapped file and grows linearly for
+private copies.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from speaker_index import SpeakerIndex  # noqa: E402
+
+
+def pss_kb(pid) -> int:
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Pss:"):
+                return int(line.split()[1])
+    return 0
+
+
+def worker(path, mode, probes, ready_w, done_r):
+    index = SpeakerIndex()
+    index.load(path, mode=mode)
+    for p in probes:
+        index.search(p, exact=True)
+    os.write(ready_w, b"x")
+    os.read(done_r, 1)
+    os._exit(0)
+
+
+def measure(path, mode, workers, probes) -> float:
+    ready_r, ready_w = os.pipe()
+    done_r, done_w = os.pipe()
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            worker(path, mode, probes, ready_w, done_r)
+        pids.append(pid)
+    for _ in range(workers):
+        os.read(ready_r, 1)
+    time.sleep(0.2)
+    total = sum(pss_kb(pid) for pid in pids)
+    os.write(done_w, b"x" * workers)
+    for pid in pids:
+        os.waitpid(pid, 0)
+    return total / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200_000)
+    parser.add_argument('--dim', type=int, default=192)
+    parser.add_argument('--workers', default='1,2,4,8')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    index = SpeakerIndex(ann=None)
+    index.build((i, v) for i, v in enumerate(rng.standard_normal((args.users, args.dim)).astype(np.float32)))
+    probes = rng.standard_normal((20, args.dim)).astype(np.float32)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'speaker-index.bin')
+        index.save(path)
+        print(f"index file: {os.path.getsize(path) / 1e6:.1f} MB")
+        print(f"{'workers':>8} {'private MB':>11} {'mapped MB':>10}")
+        for n in (int(x) for x in args.workers.split(',')):
+            print(f"{n:>8} {measure(path, None, n, probes):>11.1f} {measure(path, 'r', n, probes):>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
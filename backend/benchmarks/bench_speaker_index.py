@@ -0,0 +1,73 @@
+"""
+Login matching latency: per-user JSON + cosine loop vs. the in-memory SpeakerIndex.
+
+    python benchmarks/bench_speaker_index.py [--dim 192] [--sizes 100,1000,10000,100000]
+
+The "loop" column reproduces the old login_voice/identify_voice path (json.loads
+and one cosine per enrolled user, without the DB round-trip); the "index"
+column is one SpeakerIndex.search call. Index latency should stay roughly flat.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from speaker_index import SpeakerIndex  # noqa: E402
+
+
+def loop_match(probe, blobs):
+    probe_arr = np.array(probe, dtype=float)
+    probe_norm = np.linalg.norm(probe_arr) + 1e-8
+    best_id, best_conf = None, -1.0
+    for user_id, blob in blobs:
+        profile = np.array(json.loads(blob.decode('utf-8')), dtype=float)
+        cos_sim = float(np.dot(probe_arr, profile) /
+                        (probe_norm * (np.linalg.norm(profile) + 1e-8)))
+        if cos_sim > best_conf:
+            best_conf, best_id = cos_sim, user_id
+    return best_id, best_conf
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dim', type=int, default=192)
+    parser.add_argument('--sizes', default='100,1000,10000,100000')
+    parser.add_argument('--loop-max', type=int, default=100000,
+                        help='skip the slow loop baseline above this size')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'users':>8} {'loop ms':>10} {'index ms':>10} {'speedup':>8}")
+    for n in (int(x) for x in args.sizes.split(',')):
+        profiles = rng.standard_normal((n, args.dim)).astype(np.float32)
+        probe = profiles[n // 2] + 0.1 * rng.standard_normal(args.dim).astype(np.float32)
+
+        index = SpeakerIndex(ann=None)
+        index.build((i, profiles[i]) for i in range(n))
+        t_index = timed(lambda: index.search(probe, k=1), repeat=50)
+
+        if n <= args.loop_max:
+            blobs = [(i, json.dumps(profiles[i].tolist()).encode('utf-8')) for i in range(n)]
+            t_loop = timed(lambda: loop_match(probe, blobs), repeat=3)
+            assert loop_match(probe, blobs)[0] == index.search(probe)[0][0]
+            print(f"{n:>8} {t_loop:>10.2f} {t_index:>10.3f} {t_loop / t_index:>7.0f}x")
+        else:
+            print(f"{n:>8} {'-':>10} {t_index:>10.3f} {'-':>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Import time and peak RSS of voice_service: lazy import vs. import + warm_up()
+(the latter is what every process paid before models were loaded lazily).
+
+    python benchmarks/bench_startup.py [--models whisper,ecapa]
+
+Each variant runs in a fresh interpreter; peak RSS comes from ru_maxrss.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r"""
+import json, resource, sys, time
+t0 = time.perf_counter()
+import voice_service
+t_import = time.perf_counter() - t0
+t_warm = 0.0
+if sys.argv[1] == "warm":
+    t1 = time.perf_counter()
+    voice_service.warm_up()
+    t_warm = time.perf_counter() - t1
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({"import_s": t_import, "warm_s": t_warm, "rss_mb": rss_kb / 1024}))
+"""
+
+
+def run(mode, models):
+    env = dict(os.environ, VOICE_MODELS=models)
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE, mode],
+        cwd=BACKEND, env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--models', default='whisper,ecapa')
+    args = parser.parse_args()
+
+    print(f"{'variant':<22} {'import s':>9} {'warm-up s':>10} {'peak RSS MB':>12}")
+    for label, mode in (("lazy import", "lazy"), ("import + warm_up", "warm")):
+        r = run(mode, args.models)
+        print(f"{label:<22} {r['import_s']:>9.3f} {r['warm_s']:>10.2f} {r['rss_mb']:>12.0f}")
+
+
+if __name__ == '__main__':
+    main()
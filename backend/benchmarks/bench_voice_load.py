@@ -0,0 +1,101 @@
+"""
+Load test: sync (WSGI) vs. async (ASGI) serving of the voice endpoints.
+
+    python benchmarks/bench_voice_load.py --url http://127.0.0.1:5000 --audio clip.webm
+                                          [--phrase-id 1] [--concurrency 8,64,512]
+                                          [--requests 512]
+
+Start the server under test in another shell with the same environment
+(models, VOICE_QUEUE_MAX large enough for the highest concurrency, and
+VOICE_CACHE_MAX_BYTES=0 so the repeated clip is not answered from the clip
+cache), e.g.
+
+    sync:   gunicorn -w 1 --threads 8 app:app -b 127.0.0.1:5000
+    async:  uvicorn asgi:app --port 5000
+
+For each concurrency level, keeps that many POST /voice/verify requests in
+flight until --requests have completed. Meanwhile it polls GET /voice/phrases
+every 100 ms, to show whether light endpoints still answer while the models are
+busy. Reports throughput, verify latency (p50/p95), how many were rejected
+(503) or failed, and the phrases latency under load.
+"""
+import argparse
+import asyncio
+import base64
+import time
+
+import httpx
+import numpy as np
+
+
+async def verify_worker(client, payload, remaining, latencies, statuses):
+    while remaining[0] > 0:
+        remaining[0] -= 1
+        t0 = time.perf_counter()
+        try:
+            r = await client.post('/voice/verify', json=payload)
+            statuses.append(r.status_code)
+        except httpx.HTTPError:
+            statuses.append(0)
+        latencies.append(time.perf_counter() - t0)
+
+
+async def poll_phrases(client, stop, latencies):
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        try:
+            await client.get('/voice/phrases')
+            latencies.append(time.perf_counter() - t0)
+        except httpx.HTTPError:
+            latencies.append(None)
+        await asyncio.sleep(0.1)
+
+
+async def run(url, payload, concurrency, requests):
+    limits = httpx.Limits(max_connections=concurrency + 1, max_keepalive_connections=concurrency + 1)
+    async with httpx.AsyncClient(base_url=url, timeout=300, limits=limits) as client:
+        latencies, statuses, light = [], [], []
+        remaining, stop = [requests], asyncio.Event()
+        poller = asyncio.create_task(poll_phrases(client, stop, light))
+        started = time.perf_counter()
+        await asyncio.gather(*(verify_worker(client, payload, remaining, latencies, statuses)
+                               for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await poller
+    ok = [lat for lat, s in zip(latencies, statuses) if s == 200]
+    ms = lambda xs, q: np.percentile(xs, q) * 1000 if xs else float('nan')  # noqa: E731
+    return {
+        'rps': len(ok) / elapsed,
+        'p50': ms(ok, 50),
+        'p95': ms(ok, 95),
+        'busy': statuses.count(503),
+        'errors': sum(1 for s in statuses if s not in (200, 503)),
+        'light_p95': ms([lat for lat in light if lat is not None], 95),
+        'light_failed': light.count(None),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--audio', required=True, help='recorded clip of the phrase')
+    parser.add_argument('--phrase-id', type=int, default=1)
+    parser.add_argument('--concurrency', default='8,64,512')
+    parser.add_argument('--requests', type=int, default=512)
+    args = parser.parse_args()
+
+    with open(args.audio, 'rb') as f:
+        audio = base64.b64encode(f.read()).decode('ascii')
+    payload = {'phrase_id': args.phrase_id, 'audio': audio}
+
+    print(f"{'conc':>6} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'503':>6} {'errors':>7} "
+          f"{'phrases p95 ms':>15} {'phrases failed':>15}")
+    for c in (int(x) for x in args.concurrency.split(',')):
+        r = asyncio.run(run(args.url, payload, c, max(args.requests, c)))
+        print(f"{c:>6} {r['rps']:>8.1f} {r['p50']:>9.0f} {r['p95']:>9.0f} {r['busy']:>6} "
+              f"{r['errors']:>7} {r['light_p95']:>15.0f} {r['light_failed']:>15}")
+
+
+if __name__ == '__main__':
+    main()
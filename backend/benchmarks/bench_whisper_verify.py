@@ -0,0 +1,88 @@
+"""
+Phrase verification: fast Whisper mode vs. full open-vocabulary decoding.
+
+    python benchmarks/bench_whisper_verify.py DATASET_DIR [--modes full,fast] [--repeat 1]
+
+DATASET_DIR holds recorded clips plus a manifest.jsonl, one line per clip:
+
+    {"file": "alice-01.webm", "phrase": "open sesame", "match": true}
+
+"match" is the ground truth: whether the speaker actually said the phrase
+(include silent, cut-off and wrong-phrase recordings with "match": false).
+Clips are decoded once up front, so only the transcription + matching step is
+timed. Per mode, reports accuracy against the labels, false accepts / false
+rejects, how many clips came back empty (in fast mode: skipped as silent or
+too short, without inference), and mean / p50 / p95 latency. Needs the whisper package and model weights.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import voice_service  # noqa: E402
+
+
+def load_dataset(root):
+    clips = []
+    with open(os.path.join(root, 'manifest.jsonl')) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            with open(os.path.join(root, item['file']), 'rb') as audio:
+                wav = voice_service.decode_audio(audio.read())
+            clips.append((item['file'], wav, item['phrase'], bool(item['match'])))
+    return clips
+
+
+def run(clips, mode, repeat):
+    latencies, correct, false_accept, false_reject, empty = [], 0, 0, 0, 0
+    for _, wav, phrase, expected in clips:
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            transcript, score, match = voice_service.transcribe_and_match(wav, phrase, mode=mode)
+            latencies.append((time.perf_counter() - t0) * 1000)
+        correct += match == expected
+        false_accept += match and not expected
+        false_reject += expected and not match
+        empty += transcript == ''
+    lat = np.array(latencies)
+    return {
+        'accuracy': correct / len(clips),
+        'far': false_accept,
+        'frr': false_reject,
+        'empty': empty,
+        'mean': lat.mean(),
+        'p50': np.percentile(lat, 50),
+        'p95': np.percentile(lat, 95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dataset')
+    parser.add_argument('--modes', default='full,fast')
+    parser.add_argument('--repeat', type=int, default=1)
+    args = parser.parse_args()
+
+    clips = load_dataset(args.dataset)
+    print(f"clips={len(clips)} positives={sum(c[3] for c in clips)} "
+          f"model={voice_service._WHISPER_MODEL_NAME}")
+    # load the model and warm the kernels outside the timed runs
+    voice_service.transcribe_and_match(clips[0][1], clips[0][2], mode='full')
+
+    print(f"\n{'mode':>6} {'accuracy':>9} {'FA':>4} {'FR':>4} {'empty':>8} "
+          f"{'mean ms':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for mode in args.modes.split(','):
+        r = run(clips, mode, args.repeat)
+        print(f"{mode:>6} {r['accuracy']:>9.3f} {r['far']:>4} {r['frr']:>4} {r['empty']:>8} "
+              f"{r['mean']:>8.1f} {r['p50']:>8.1f} {r['p95']:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
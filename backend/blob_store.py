@@ -0,0 +1,149 @@
+# backend/blob_store.py
+import hashlib
+import os
+import time
+import uuid
+from flask import current_app
+from models import db, Voice
+
+# leading magic bytes → content type of a stored recording
+_AUDIO_SIGNATURES = [
+    (b'\x1a\x45\xdf\xa3', 'audio/webm'),
+    (b'OggS',             'audio/ogg'),
+    (b'fLaC',             'audio/flac'),
+    (b'ID3',              'audio/mpeg'),
+    (b'\xff\xfb',         'audio/mpeg'),
+]
+
+
+def audio_content_type(head: bytes) -> str:
+    """Sniff the container of a recording from its first 12+ bytes."""
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return 'audio/wav'
+    if head[4:8] == b'ftyp':
+        return 'audio/mp4'
+    for magic, mime in _AUDIO_SIGNATURES:
+        if head.startswith(magic):
+            return mime
+    return 'application/octet-stream'
+
+
+class LocalBlobStore:
+    """
+    Content-addressed blobs on the local filesystem. A blob's key is the
+    SHA-256 of its bytes and it lives at <root>/<k[:2]>/<k[2:4]>/<k>, so
+    identical uploads are stored once. Writes go to a temp file and are
+    renamed into place, so a key either resolves to the full blob or nothing.
+    """
+    name = "local"
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        if len(key) != 64 or not all(c in "0123456789abcdef" for c in key):
+            raise ValueError(f"Invalid blob key: {key!r}")
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def put_stream(self, chunks) -> tuple[str, int]:
+        """Store an iterable of byte chunks; returns (key, size)."""
+        digest = hashlib.sha256()
+        size = 0
+        tmp = os.path.join(self.root, f".tmp-{uuid.uuid4().hex}")
+        try:
+            with open(tmp, "wb") as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+            key = digest.hexdigest()
+            path = self._path(key)
+            if os.path.exists(path):
+                # dedup hit; refresh mtime so gc's grace period covers the new reference
+                os.utime(path)
+                os.unlink(tmp)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        return key, size
+
+    def put(self, data: bytes) -> tuple[str, int]:
+        return self.put_stream([data])
+
+    def open(self, key: str):
+        """Binary file object for a blob (raises FileNotFoundError)."""
+        return open(self._path(key), "rb")
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def delete(self, key: str):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def age(self, key: str) -> float:
+        """Seconds since the blob was last written or deduplicated against."""
+        return time.time() - os.path.getmtime(self._path(key))
+
+    def keys(self):
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                if not name.startswith(".tmp-"):
+                    yield name
+
+
+# BLOB_STORE_BACKEND → class; other backends (S3, ...) plug in here
+_BACKENDS = {"local": LocalBlobStore}
+
+_stores: dict = {}
+
+
+def blob_store():
+    """The app's blob store (BLOB_STORE_BACKEND, BLOB_STORE_DIR default <instance>/blobs)."""
+    kind = os.getenv("BLOB_STORE_BACKEND", "local").lower()
+    root = current_app.config.get("BLOB_STORE_DIR") or os.getenv("BLOB_STORE_DIR") \
+        or os.path.join(current_app.instance_path, "blobs")
+    store = _stores.get((kind, root))
+    if store is None:
+        if kind not in _BACKENDS:
+            raise RuntimeError(f"Unknown BLOB_STORE_BACKEND: {kind}")
+        store = _stores[(kind, root)] = _BACKENDS[kind](root)
+    return store
+
+
+def collect_garbage(keys=None, grace_seconds: float | None = None) -> int:
+    """
+    Delete blobs no Voice row references. `keys` limits the check to the
+    given blobs (what a delete just released); None sweeps the whole store.
+    Blobs touched within `grace_seconds` (BLOB_GC_GRACE_SECONDS, default 600)
+    are kept, since an upload may have written (or deduplicated against) one
+    without committing its row yet.
+    """
+    if grace_seconds is None:
+        grace_seconds = float(os.getenv("BLOB_GC_GRACE_SECONDS", 600))
+    store = blob_store()
+    candidates = set(k for k in (keys if keys is not None else store.keys()) if k)
+    if not candidates:
+        return 0
+    referenced = set()
+    pending = list(candidates)
+    for i in range(0, len(pending), 500):
+        referenced.update(r for (r,) in db.session.query(Voice.audio_ref)
+                          .filter(Voice.audio_ref.in_(pending[i:i + 500])).distinct())
+    removed = 0
+    for key in candidates - referenced:
+        try:
+            if store.age(key) < grace_seconds:
+                continue
+        except FileNotFoundError:
+            continue
+        store.delete(key)
+        removed += 1
+    return removed
@@ -0,0 +1,120 @@
+# backend/clip_cache.py
+import hashlib
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+
+
+def clip_digest(data) -> bytes:
+    """Content hash used as the cache key for a raw audio clip."""
+    return hashlib.sha1(data).digest()
+
+
+def _nbytes(value) -> int:
+    if hasattr(value, "nbytes"):                       # numpy
+        return int(value.nbytes)
+    if hasattr(value, "element_size"):                 # torch
+        return int(value.element_size() * value.nelement())
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, (list, tuple)):
+        return 8 * len(value)
+    return 64
+
+
+class ClipCache:
+    """
+    Per-process cache of work done on an audio clip, keyed by (kind, content
+    hash): decoded waveforms ("wav"), Whisper transcripts ("text:<model>")
+    and speaker embeddings ("emb"). A clip sent to /voice/verify and then to
+    /auth/login/voice, or retried, is decoded, transcribed and embedded once.
+
+    LRU over the total size of the cached values, with a TTL per entry.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()   # (kind, digest) -> (expires_at, size, value)
+        self._bytes = 0
+        self._hits: Counter = Counter()
+        self._misses: Counter = Counter()
+        self.evictions = 0
+        self.expired = 0
+
+    def _drop(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def get(self, kind: str, digest: bytes):
+        key = (kind, digest)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._drop(key)
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self._misses[kind] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits[kind] += 1
+            return entry[2]
+
+    def set(self, kind: str, digest: bytes, value):
+        size = _nbytes(value)
+        if size > self.max_bytes:
+            return
+        key = (kind, digest)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_or_compute(self, kind: str, digest: bytes | None, compute):
+        """Cached value for (kind, digest), else compute() and cache it. None digest: no caching."""
+        if digest is None:
+            return compute()
+        value = self.get(kind, digest)
+        if value is None:
+            value = compute()
+            self.set(kind, digest, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            kinds = sorted(set(self._hits) | set(self._misses))
+            return {
+                "entries":   len(self._entries),
+                "bytes":     self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl":       self.ttl,
+                "evictions": self.evictions,
+                "expired":   self.expired,
+                "kinds": {
+                    k: {
+                        "hits":     self._hits[k],
+                        "misses":   self._misses[k],
+                        "hit_rate": self._hits[k] / (self._hits[k] + self._misses[k]),
+                    }
+                    for k in kinds
+                },
+            }
+
+
+# process-wide cache used by voice_service
+clip_cache = ClipCache(
+    max_bytes=int(os.getenv("VOICE_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+    ttl=float(os.getenv("VOICE_CACHE_TTL", 300)),
+)
@@ -0,0 +1,240 @@
+# backend/commands.py
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import inspect, text
+from models import db, AuditLog, Voice
+from embedding_codec import encode_embedding, decode_embedding, is_binary
+import audit_archive
+import datasets
+from blob_store import audio_content_type, blob_store, collect_garbage
+
+
+def ensure_indexes():
+    """
+    create_all() only builds indexes together with new tables; add any index
+    declared on an existing table that the database does not have yet.
+    """
+    for table in (AuditLog.__table__,):
+        if table is AuditLog.__table__ and audit_archive.is_partitioned():
+            continue  # audit-partition created them on the partitioned parent
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+
+def ensure_voice_columns():
+    """
+    Add the blob-store columns to an existing voices table and make the
+    legacy audio_data column nullable (rows move to the blob store).
+    """
+    engine = db.engine
+    cols = {c['name']: c for c in inspect(engine).get_columns('voices')}
+    added = []
+    with engine.begin() as conn:
+        for column in ('audio_ref', 'audio_size', 'audio_codec'):
+            if column not in cols:
+                ddl = Voice.__table__.c[column].type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE voices ADD COLUMN {column} {ddl}"))
+                added.append(column)
+    if added:
+        for index in Voice.__table__.indexes:
+            index.create(engine, checkfirst=True)
+        click.echo(f"Added voices columns: {', '.join(added)}")
+
+    if cols['audio_data']['nullable']:
+        return
+    if engine.dialect.name == 'postgresql':
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE voices ALTER COLUMN audio_data DROP NOT NULL"))
+    elif engine.dialect.name == 'sqlite':
+        # SQLite cannot alter a constraint: rebuild the table around the data
+        names = ', '.join(c.name for c in Voice.__table__.columns)
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE voices RENAME TO voices_old"))
+            for index in Voice.__table__.indexes:
+                conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+            Voice.__table__.create(conn)
+            conn.execute(text(f"INSERT INTO voices ({names}) SELECT {names} FROM voices_old"))
+            conn.execute(text("DROP TABLE voices_old"))
+    click.echo("voices.audio_data is now nullable")
+
+
+def _ensure_binary_column(table: str, column: str):
+    """
+    On Postgres, a JSON column must become BYTEA before binary rows can be
+    written; existing JSON is kept as UTF-8 text so readers still accept it.
+    SQLite stores whatever it is given, so nothing to do there.
+    """
+    engine = db.engine
+    if engine.dialect.name != 'postgresql':
+        return
+    cols = {c['name']: c for c in inspect(engine).get_columns(table)}
+    if column not in cols or 'JSON' not in str(cols[column]['type']).upper():
+        return
+    with engine.begin() as conn:
+        conn.execute(text(
+            f"ALTER TABLE {table} ALTER COLUMN {column} TYPE BYTEA "
+            f"USING convert_to({column}::text, 'UTF8')"
+        ))
+    click.echo(f"Converted {table}.{column} to BYTEA")
+
+
+def _rewrite_embeddings(table: str, column: str, batch_size: int) -> tuple[int, int]:
+    """Stream `table` in id order, rewriting legacy JSON values in place."""
+    select = text(
+        f"SELECT id, {column} FROM {table} "
+        f"WHERE id > :last AND {column} IS NOT NULL ORDER BY id LIMIT :n"
+    )
+    update = text(f"UPDATE {table} SET {column} = :blob WHERE id = :id")
+
+    last_id, scanned, converted = 0, 0, 0
+    while True:
+        rows = db.session.execute(select, {'last': last_id, 'n': batch_size}).all()
+        if not rows:
+            break
+        params = [
+            {'id': row_id, 'blob': encode_embedding(decode_embedding(value))}
+            for row_id, value in rows
+            if not is_binary(value)
+        ]
+        if params:
+            db.session.execute(update, params)
+        db.session.commit()
+
+        last_id = rows[-1][0]
+        scanned += len(rows)
+        converted += len(params)
+    return scanned, converted
+
+
+@click.command('migrate-embeddings')
+@click.option('--batch-size', default=500, show_default=True,
+              help='Rows read and rewritten per transaction.')
+@with_appcontext
+def migrate_embeddings_command(batch_size):
+    """Rewrite JSON voice profiles and embeddings to the binary float32 format."""
+    for table, column in (('users', 'voice_profile'), ('voices', 'embedding')):
+        _ensure_binary_column(table, column)
+        scanned, converted = _rewrite_embeddings(table, column, batch_size)
+        click.echo(f"{table}.{column}: {converted} of {scanned} rows converted")
+
+
+@click.command('migrate-voice-blobs')
+@click.option('--batch-size', default=50, show_default=True,
+              help='Recordings held in memory and committed per transaction.')
+@with_appcontext
+def migrate_voice_blobs_command(batch_size):
+    """Move in-row Voice.audio_data into the blob store."""
+    store = blob_store()
+    select = text(
+        "SELECT id, audio_data FROM voices "
+        "WHERE id > :last AND audio_ref IS NULL AND audio_data IS NOT NULL "
+        "ORDER BY id LIMIT :n"
+    )
+    update = text(
+        "UPDATE voices SET audio_ref = :ref, audio_size = :size, audio_codec = :codec, "
+        "audio_data = NULL WHERE id = :id"
+    )
+    last_id, moved, total_bytes = 0, 0, 0
+    while True:
+        rows = db.session.execute(select, {'last': last_id, 'n': batch_size}).all()
+        if not rows:
+            break
+        params = []
+        for row_id, data in rows:
+            data = bytes(data)
+            ref, size = store.put(data)
+            params.append({'id': row_id, 'ref': ref, 'size': size,
+                           'codec': audio_content_type(data[:16])})
+            total_bytes += size
+        db.session.execute(update, params)
+        db.session.commit()
+        last_id = rows[-1][0]
+        moved += len(rows)
+        click.echo(f"moved {moved} recordings ({total_bytes / 1e6:.1f} MB)")
+    click.echo(f"Done: {moved} recordings moved to the {store.name} blob store")
+    if moved and db.engine.dialect.name == 'postgresql':
+        click.echo("Run VACUUM FULL voices (or pg_repack) to return the space")
+
+
+@click.command('gc-blobs')
+@click.option('--grace-seconds', default=None, type=float,
+              help='Keep unreferenced blobs younger than this (default BLOB_GC_GRACE_SECONDS).')
+@with_appcontext
+def gc_blobs_command(grace_seconds):
+    """Delete blobs that no voice recording references any more."""
+    removed = collect_garbage(grace_seconds=grace_seconds)
+    click.echo(f"Removed {removed} unreferenced blobs")
+
+
+@click.command('gc-datasets')
+@click.option('--grace-seconds', default=None, type=float,
+              help='Keep retired parts younger than this (default DATASET_GC_GRACE_SECONDS).')
+@with_appcontext
+def gc_datasets_command(grace_seconds):
+    """Delete dataset parts that no published version references any more."""
+    removed = datasets.collect_garbage(grace_seconds=grace_seconds)
+    click.echo(f"Removed {removed} retired dataset files")
+
+
+@click.command('build-speaker-index')
+@with_appcontext
+def build_speaker_index_command():
+    """Rebuild the shared speaker index file from the database (retrains the ANN)."""
+    from speaker_index import load_speaker_index
+    index = load_speaker_index(force=True)
+    click.echo(f"Published {index.stats()}")
+
+
+@click.command('warm-up')
+@click.option('--model', 'models', multiple=True,
+              help='Model to load (whisper, ecapa); default: all enabled.')
+def warm_up_command(models):
+    """Load the speech models now instead of on the first voice request."""
+    from voice_service import warm_up
+    loaded = warm_up(models or None)
+    click.echo(f"Loaded models: {', '.join(loaded) or 'none'}")
+
+
+@click.command('audit-partition')
+@with_appcontext
+def audit_partition_command():
+    """Convert audit_logs to monthly RANGE partitions (Postgres only)."""
+    try:
+        converted = audit_archive.convert_to_partitioned()
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    audit_archive.ensure_partitions()
+    click.echo("audit_logs is now partitioned by month" if converted else "audit_logs is already partitioned")
+
+
+@click.command('audit-archive')
+@with_appcontext
+def audit_archive_command():
+    """Archive audit months older than AUDIT_RETENTION_DAYS and remove them."""
+    done = audit_archive.run_maintenance(current_app._get_current_object())
+    for month, rows in done.items():
+        click.echo(f"{month}: {rows} rows archived")
+    if not done:
+        click.echo("Nothing to archive")
+
+
+@click.command('rbac-policy')
+@with_appcontext
+def rbac_policy_command():
+    """Print which roles may call each protected endpoint."""
+    policy = current_app.extensions.get("rbac", {})
+    for endpoint in sorted(policy):
+        click.echo(f"{endpoint:<32} {', '.join(sorted(policy[endpoint]))}")
+
+
+def register_commands(app):
+    app.cli.add_command(migrate_embeddings_command)
+    app.cli.add_command(warm_up_command)
+    app.cli.add_command(migrate_voice_blobs_command)
+    app.cli.add_command(gc_blobs_command)
+    app.cli.add_command(gc_datasets_command)
+    app.cli.add_command(build_speaker_index_command)
+    app.cli.add_command(audit_partition_command)
+    app.cli.add_command(audit_archive_command)
+    app.cli.add_command(rbac_policy_command)
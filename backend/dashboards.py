@@ -0,0 +1,182 @@
+# backend/dashboards.py
+import os
+import threading
+import traceback
+import time
+from collections import deque
+from datetime import datetime
+import pyarrow as pa
+import pyarrow.compute as pc
+from models import db, DashboardTile, Dataset
+from datasets import dataset_dir, dataset_schema
+from query_engine import QueryError, normalize_query, open_dataset, scanner, group_aggregate, aggregate, page_result
+
+# aggregate fn → [(partial fn, combine fn), ...]; mean is carried as sum + count
+_PARTIALS = {
+    "sum":       [("sum", "sum")],
+    "min":       [("min", "min")],
+    "max":       [("max", "max")],
+    "count":     [("count", "sum")],
+    "count_all": [("count_all", "sum")],
+    "mean":      [("sum", "sum"), ("count", "sum")],
+}
+
+_metrics_lock = threading.Lock()
+_render_ms: deque = deque(maxlen=512)
+_refresh = {"full": 0, "incremental": 0, "last_ms": None, "last_lag_s": None}
+
+
+def is_incremental(query: dict) -> bool:
+    """True if every aggregate can be merged from per-chunk partials."""
+    return bool(query["aggregates"]) and all(a["fn"] in _PARTIALS for a in query["aggregates"])
+
+
+def _partial_specs(query: dict) -> list[tuple]:
+    """Flattened (source column, partial fn, combine fn) list for the query."""
+    specs = []
+    for a in query["aggregates"]:
+        for partial_fn, combine_fn in _PARTIALS[a["fn"]]:
+            specs.append(([] if partial_fn == "count_all" else a["column"], partial_fn, combine_fn))
+    return specs
+
+
+def _partials(table: pa.Table, query: dict) -> pa.Table:
+    keys = query["group_by"]
+    specs = _partial_specs(query)
+    key_cols, agg_cols = group_aggregate(table, keys, [(col, fn) for col, fn, _ in specs])
+    return pa.Table.from_arrays(
+        list(key_cols) + list(agg_cols),
+        names=keys + [f"__p{i}" for i in range(len(specs))]
+    )
+
+
+def _combine(state: pa.Table, partial: pa.Table, query: dict) -> pa.Table:
+    keys = query["group_by"]
+    specs = _partial_specs(query)
+    merged = pa.concat_tables([state, partial], promote_options="permissive")
+    key_cols, agg_cols = group_aggregate(
+        merged, keys, [(f"__p{i}", combine_fn) for i, (_, _, combine_fn) in enumerate(specs)]
+    )
+    return pa.Table.from_arrays(
+        list(key_cols) + list(agg_cols),
+        names=keys + [f"__p{i}" for i in range(len(specs))]
+    )
+
+
+def _finalize(state: pa.Table, query: dict) -> pa.Table:
+    """Turn partial columns back into the query's aggregate columns."""
+    arrays = [state.column(k) for k in query["group_by"]]
+    i = 0
+    for a in query["aggregates"]:
+        if a["fn"] == "mean":
+            total = pc.cast(state.column(f"__p{i}"), pa.float64())
+            count = pc.cast(state.column(f"__p{i + 1}"), pa.float64())
+            arrays.append(pc.divide(total, pc.if_else(pc.equal(count, 0), None, count)))
+        else:
+            arrays.append(state.column(f"__p{i}"))
+        i += len(_PARTIALS[a["fn"]])
+    return pa.Table.from_arrays(arrays, names=query["group_by"] + [a["as"] for a in query["aggregates"]])
+
+
+def refresh_tile(tile: DashboardTile, dataset: Dataset) -> str:
+    """
+    Bring one tile up to the dataset's current version. When the tile's
+    aggregates are mergeable and the dataset only gained parts since the last
+    refresh, only the new parts are scanned and merged into the saved partial
+    state; anything else is recomputed from all parts. Returns the mode used.
+    """
+    started = time.perf_counter()
+    query = normalize_query(tile.spec, [c["name"] for c in dataset.columns or []])
+    schema = dataset_schema(dataset)
+    root = dataset_dir(dataset)
+    parts = list(dataset.parts or [])
+    seen = tile.source_parts or []
+    new_parts = [p for p in parts if p not in seen]
+
+    mode, state, table = "full", None, None
+    if is_incremental(query):
+        if tile.state and set(seen) <= set(parts):
+            try:
+                partial = _partials(
+                    scanner(open_dataset([os.path.join(root, p) for p in new_parts], schema), query).to_table(),
+                    query,
+                )
+                state = _combine(pa.Table.from_pylist(tile.state), partial, query)
+                mode = "incremental"
+            except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, KeyError):
+                state = None
+        if state is None:
+            state = _partials(
+                scanner(open_dataset([os.path.join(root, p) for p in parts], schema), query).to_table(),
+                query,
+            )
+        table = _finalize(state, query)
+    else:
+        table = aggregate(
+            scanner(open_dataset([os.path.join(root, p) for p in parts], schema), query).to_table(),
+            query,
+        )
+
+    result = page_result(table, query, table.num_rows)
+    now = datetime.utcnow()
+    tile.result = {"columns": result["columns"], "rows": result["rows"], "total": result["total"]}
+    tile.state = state.to_pylist() if state is not None else None
+    tile.source_parts = parts
+    tile.source_version = dataset.version
+    tile.refreshed_at = now
+    tile.refresh_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    with _metrics_lock:
+        _refresh[mode] += 1
+        _refresh["last_ms"] = tile.refresh_ms
+        if dataset.updated_at:
+            _refresh["last_lag_s"] = round((now - dataset.updated_at).total_seconds(), 3)
+    return mode
+
+
+def refresh_dataset_tiles(dataset: Dataset):
+    """Re-materialize every tile over `dataset`; called right after an upload."""
+    for tile in DashboardTile.query.filter_by(dataset_id=dataset.id).all():
+        try:
+            refresh_tile(tile, dataset)
+        except (QueryError, pa.ArrowException):
+            # e.g. a replace dropped a column the tile uses; it stays stale
+            traceback.print_exc()
+    db.session.commit()
+
+
+def tile_info(tile: DashboardTile, dataset: Dataset) -> dict:
+    lag = None
+    if tile.refreshed_at and dataset.updated_at:
+        lag = max(0.0, (tile.refreshed_at - dataset.updated_at).total_seconds())
+    return {
+        "id":             tile.id,
+        "name":           tile.name,
+        "dataset":        dataset.name,
+        "query":          tile.spec,
+        "result":         tile.result,
+        "version":        tile.source_version,
+        "stale":          tile.source_version != dataset.version,
+        "refreshed_at":   tile.refreshed_at.isoformat() if tile.refreshed_at else None,
+        "refresh_ms":     tile.refresh_ms,
+        "refresh_lag_s":  lag,
+    }
+
+
+def record_render(ms: float):
+    with _metrics_lock:
+        _render_ms.append(ms)
+
+
+def dashboard_stats() -> dict:
+    with _metrics_lock:
+        samples = sorted(_render_ms)
+        refresh = dict(_refresh)
+
+    def pct(p):
+        return samples[min(len(samples) - 1, int(p * len(samples)))] if samples else None
+
+    return {
+        "refreshes":  refresh,
+        "render_ms":  {"samples": len(samples), "p50": pct(0.5), "p95": pct(0.95)},
+    }
@@ -0,0 +1,309 @@
+# backend/datasets.py
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from flask import current_app
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from models import db, Dataset
+
+# rows per pandas chunk; bounds ingest memory regardless of file size
+_DEFAULT_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", 100_000))
+# registry compare-and-set attempts when concurrent uploads race to publish
+_PUBLISH_ATTEMPTS = 5
+# unreferenced parts younger than this may still be read (or about to be published)
+_GC_GRACE_SECONDS = float(os.getenv("DATASET_GC_GRACE_SECONDS", 600))
+
+
+class PublishConflict(RuntimeError):
+    """Other uploads kept winning the race to publish a new version."""
+
+
+def data_dir() -> str:
+    """Root of the managed dataset storage (DATA_DIR, default <instance>/datasets)."""
+    path = current_app.config.get("DATA_DIR") or os.path.join(current_app.instance_path, "datasets")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def dataset_dir(dataset: Dataset) -> str:
+    return os.path.join(data_dir(), str(dataset.id))
+
+
+def dataset_files(dataset: Dataset) -> list[str]:
+    """Absolute paths of the Parquet parts that make up the current version."""
+    root = dataset_dir(dataset)
+    return [os.path.join(root, p) for p in (dataset.parts or [])]
+
+
+def dataset_schema(dataset: Dataset) -> pa.Schema:
+    """Unified Arrow schema recorded in the registry (parts are cast to it on read)."""
+    return pa.schema([(c["name"], _type_from_name(c["type"])) for c in dataset.columns or []])
+
+
+def _type_from_name(name: str) -> pa.DataType:
+    if name.startswith("timestamp"):
+        return pa.timestamp("ns")
+    return pa.type_for_alias(name)
+
+
+def _widen(a: pa.DataType, b: pa.DataType) -> pa.DataType:
+    """Smallest common type for two inferred column types."""
+    if a == b or pa.types.is_null(b):
+        return a
+    if pa.types.is_null(a):
+        return b
+    numeric = (pa.types.is_integer, pa.types.is_floating, pa.types.is_boolean)
+    if any(f(a) for f in numeric) and any(f(b) for f in numeric):
+        if pa.types.is_floating(a) or pa.types.is_floating(b):
+            return pa.float64()
+        return pa.int64()
+    return pa.string()
+
+
+def _unify(schema: pa.Schema | None, other: pa.Schema) -> pa.Schema:
+    if schema is None:
+        return other
+    fields = {f.name: f.type for f in schema}
+    for f in other:
+        fields[f.name] = _widen(fields[f.name], f.type) if f.name in fields else f.type
+    return pa.schema(list(fields.items()))
+
+
+def _conform(table: pa.Table, schema: pa.Schema) -> pa.Table:
+    """Reorder/cast `table` to `schema`, adding all-null columns it lacks."""
+    arrays = []
+    for f in schema:
+        if f.name in table.column_names:
+            arrays.append(table.column(f.name).cast(f.type))
+        else:
+            arrays.append(pa.nulls(table.num_rows, type=f.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def _chunks(stream, chunk_rows: int):
+    reader = pd.read_csv(stream, chunksize=chunk_rows)
+    for df in reader:
+        # per-chunk type inference: pandas dtypes → Arrow
+        yield pa.Table.from_pandas(df, preserve_index=False)
+
+
+def ingest_csv(stream, name: str, owner_id=None, mode: str = "replace",
+               chunk_rows: int = _DEFAULT_CHUNK_ROWS) -> tuple[Dataset, dict]:
+    """
+    Stream a CSV into the columnar dataset `name`, one chunk at a time.
+
+    Each chunk is written as a row group of a Parquet part in a private staging
+    directory; the registry row only points at the new parts once the whole
+    file has been read, so readers never see a half-ingested upload, and a
+    new dataset is only registered then, so a file that fails to parse or
+    convert leaves no empty entry behind.
+    `mode` is "replace" (new version replaces all parts) or "append".
+    Returns (dataset, ingest stats).
+    """
+    if mode not in ("replace", "append"):
+        raise ValueError("mode must be 'replace' or 'append'")
+
+    dataset = Dataset.query.filter_by(name=name).first()
+
+    staging = os.path.join(data_dir(), f"_staging-{uuid.uuid4().hex}")
+    os.makedirs(staging)
+
+    schema = dataset_schema(dataset) if mode == "append" and dataset is not None and dataset.parts else None
+    new_parts, rows, started = [], 0, time.perf_counter()
+    writer = None
+    try:
+        for table in _chunks(stream, chunk_rows):
+            unified = _unify(schema, table.schema)
+            if writer is None or not unified.equals(schema):
+                # start a new part whenever the inferred schema widens
+                if writer is not None:
+                    writer.close()
+                schema = unified
+                new_parts.append(f"part-{len(new_parts):05d}.parquet")
+                writer = pq.ParquetWriter(os.path.join(staging, new_parts[-1]), schema)
+            writer.write_table(_conform(table, schema))
+            rows += table.num_rows
+        if writer is not None:
+            writer.close()
+            writer = None
+
+        if dataset is None:
+            dataset = _get_or_create(name, owner_id)
+        root = dataset_dir(dataset)
+        os.makedirs(root, exist_ok=True)
+
+        # publish: move parts next to the live ones under upload-unique names,
+        # so a concurrent upload of the same dataset can never overwrite them
+        token = uuid.uuid4().hex[:12]
+        published = []
+        for part in new_parts:
+            final = f"{token}-{part}"
+            os.replace(os.path.join(staging, part), os.path.join(root, final))
+            _touch(os.path.join(root, final))
+            published.append(final)
+        try:
+            # queries, streams and tile refreshes may still be reading the old
+            # version; its parts are left for collect_garbage() once the
+            # grace period has passed
+            _publish(dataset, published, rows, schema, mode)
+        except Exception:
+            _unlink_parts(root, published)
+            raise
+    except Exception:
+        if writer is not None:
+            writer.close()
+        db.session.rollback()
+        raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    collect_garbage(dataset)
+
+    elapsed = time.perf_counter() - started
+    try:
+        read_bytes = stream.tell()
+    except (AttributeError, OSError):
+        read_bytes = None
+    stats = {
+        "rows":        rows,
+        "columns":     len(schema) if schema is not None else 0,
+        "bytes":       read_bytes,
+        "seconds":     round(elapsed, 3),
+        "rows_per_sec": round(rows / elapsed) if elapsed else None,
+        "mb_per_sec":  round(read_bytes / elapsed / 1e6, 2) if read_bytes and elapsed else None,
+    }
+    return dataset, stats
+
+
+def _get_or_create(name: str, owner_id) -> Dataset:
+    dataset = Dataset.query.filter_by(name=name).first()
+    if dataset is not None:
+        return dataset
+    try:
+        dataset = Dataset(name=name, owner_id=owner_id, parts=[], columns=[])
+        db.session.add(dataset)
+        db.session.commit()
+        return dataset
+    except IntegrityError:
+        # a concurrent first upload of the same name created it
+        db.session.rollback()
+        return Dataset.query.filter_by(name=name).one()
+
+
+def _touch(path: str):
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _unlink_parts(root: str, parts: list):
+    for part in parts:
+        try:
+            os.unlink(os.path.join(root, part))
+        except OSError:
+            pass
+
+
+def _publish(dataset: Dataset, published: list, rows: int, schema, mode: str):
+    """
+    Point the registry row at the new parts with a compare-and-set on
+    `version`, re-reading the row and retrying when another upload published
+    in between (appends then keep both uploads' parts). Parts a replace
+    retires are touched first, so their grace period starts before a
+    collect_garbage() pass can see them unreferenced.
+    """
+    root = dataset_dir(dataset)
+    for _ in range(_PUBLISH_ATTEMPTS):
+        db.session.refresh(dataset)
+        current = dataset.version or 0
+        old_parts = list(dataset.parts or [])
+        if mode == "replace":
+            parts, row_count, merged = published, rows, schema
+            for part in old_parts:
+                _touch(os.path.join(root, part))
+        else:
+            parts = old_parts + published
+            row_count = (dataset.row_count or 0) + rows
+            base = dataset_schema(dataset) if old_parts else None
+            merged = _unify(base, schema) if schema is not None else base
+        values = {
+            "parts":      parts,
+            "row_count":  row_count,
+            "version":    current + 1,
+            "size_bytes": sum(os.path.getsize(os.path.join(root, p)) for p in parts),
+            "updated_at": datetime.utcnow(),
+        }
+        if merged is not None:
+            values["columns"] = [{"name": f.name, "type": str(f.type)} for f in merged]
+        result = db.session.execute(
+            update(Dataset)
+            .where(Dataset.id == dataset.id, Dataset.version == dataset.version)
+            .values(**values)
+        )
+        if result.rowcount == 1:
+            db.session.commit()
+            db.session.refresh(dataset)
+            return
+        db.session.rollback()
+    raise PublishConflict(f"Dataset {dataset.name!r} is being updated concurrently, try again")
+
+
+def collect_garbage(dataset: Dataset | None = None, grace_seconds: float | None = None) -> int:
+    """
+    Delete Parquet parts the registry no longer references, and staging
+    directories abandoned by crashed uploads. `dataset` limits the sweep to
+    its directory; None sweeps every dataset. Parts retired (or published)
+    within `grace_seconds` (DATASET_GC_GRACE_SECONDS, default 600) are kept,
+    since a reader may still have the old version open or an upload may not
+    have committed its new one yet.
+    """
+    if grace_seconds is None:
+        grace_seconds = _GC_GRACE_SECONDS
+    datasets = [dataset] if dataset is not None else Dataset.query.all()
+    cutoff = time.time() - grace_seconds
+    removed = 0
+    # uploads stage under the data root (the dataset may not exist yet)
+    roots = [(data_dir(), set())] if dataset is None else []
+    for ds in datasets:
+        db.session.refresh(ds)
+        roots.append((dataset_dir(ds), set(ds.parts or [])))
+    for root, live in roots:
+        try:
+            entries = list(os.scandir(root))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if entry.name in live:
+                continue
+            try:
+                if entry.is_dir() and entry.name.startswith("_staging-"):
+                    # an upload still writing its part keeps the file fresh
+                    with os.scandir(entry.path) as staged:
+                        newest = max([entry.stat().st_mtime] + [f.stat().st_mtime for f in staged])
+                    if newest < cutoff:
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                        removed += 1
+                elif entry.name.endswith(".parquet") and entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+                    removed += 1
+            except OSError:
+                pass                            # gone already, or not ours to remove
+    return removed
+
+
+def dataset_info(dataset: Dataset) -> dict:
+    return {
+        "id":         dataset.id,
+        "name":       dataset.name,
+        "version":    dataset.version,
+        "rows":       dataset.row_count,
+        "columns":    dataset.columns,
+        "size_bytes": dataset.size_bytes,
+        "updated_at": dataset.updated_at.isoformat() if dataset.updated_at else None,
+    }
@@ -0,0 +1,57 @@
+# backend/embedding_codec.py
+import json
+import struct
+import numpy as np
+
+# Binary embedding layout (8-byte header, then the vector):
+#   magic    2 bytes  b"VE"
+#   version  uint8    currently 1
+#   dtype    uint8    0 = little-endian float32
+#   dim      uint32   little-endian number of components
+#   payload  dim * 4 bytes of little-endian float32
+# The header is 8 bytes so the payload stays 4-byte aligned for np.frombuffer.
+MAGIC = b"VE"
+VERSION = 1
+_DTYPE_F32 = 0
+_HEADER = struct.Struct("<2sBBI")
+HEADER_SIZE = _HEADER.size
+_F32 = np.dtype("<f4")
+
+
+def encode_embedding(vec) -> bytes:
+    """Serialize a 1-D vector (list or ndarray) to the binary format."""
+    arr = np.ascontiguousarray(np.asarray(vec, dtype=_F32).reshape(-1))
+    return _HEADER.pack(MAGIC, VERSION, _DTYPE_F32, arr.shape[0]) + arr.tobytes()
+
+
+def is_binary(blob) -> bool:
+    """True if `blob` is already in the binary format (not legacy JSON)."""
+    if not isinstance(blob, (bytes, bytearray, memoryview)):
+        return False
+    return len(blob) >= HEADER_SIZE and bytes(blob[:2]) == MAGIC
+
+
+def decode_embedding(blob) -> np.ndarray:
+    """
+    Return the stored vector as a float32 ndarray.
+
+    Binary blobs are read zero-copy with np.frombuffer (the result is a
+    read-only view). Legacy values are accepted too: UTF-8 JSON bytes, JSON
+    text, or an already-parsed list, as returned by a JSON column.
+    """
+    if blob is None:
+        return None
+    if is_binary(blob):
+        magic, version, dtype, dim = _HEADER.unpack_from(blob)
+        if version != VERSION or dtype != _DTYPE_F32:
+            raise ValueError(f"Unsupported embedding encoding v{version}/dtype {dtype}")
+        if len(blob) != HEADER_SIZE + dim * _F32.itemsize:
+            raise ValueError("Embedding blob length does not match its header")
+        return np.frombuffer(blob, dtype=_F32, count=dim, offset=HEADER_SIZE)
+
+    # legacy JSON formats
+    if isinstance(blob, (bytes, bytearray, memoryview)):
+        blob = bytes(blob).decode("utf-8")
+    if isinstance(blob, str):
+        blob = json.loads(blob)
+    return np.asarray(blob, dtype=_F32)
@@ -0,0 +1,84 @@
+# backend/flows.py
+import asyncio
+from functools import wraps
+from flask import g
+
+
+class Await:
+    """
+    A slow call a view flow waits on (model inference): `fn(*args)` when the
+    flow runs on a WSGI worker thread, `afn(*args)` awaited under ASGI.
+    """
+    __slots__ = ("fn", "afn", "args")
+
+    def __init__(self, fn, afn, *args):
+        self.fn = fn
+        self.afn = afn
+        self.args = args
+
+
+def flow_view(fn):
+    """
+    Turn a generator view into a Flask view. The generator yields Await(...)
+    for each inference call, receives its result (or has its exception raised
+    at the yield) and finally returns the response.
+
+    Run as a plain view, the flow is driven to completion on the request
+    thread. Under asgi.py (g.async_flow set), the view returns the generator
+    itself, after any decorators (jwt_required, roles_required) have run, and
+    the ASGI app awaits the inference steps without holding a thread.
+    """
+    @wraps(fn)
+    def view(*args, **kwargs):
+        flow = fn(*args, **kwargs)
+        if g.get("async_flow"):
+            return flow
+        return run_flow(flow)
+    view.is_flow = True
+    return view
+
+
+def _advance(flow, value, error):
+    # StopIteration cannot cross a Future, so it becomes (True, response) here
+    try:
+        return False, flow.throw(error) if error is not None else flow.send(value)
+    except StopIteration as done:
+        return True, done.value
+
+
+def run_flow(flow):
+    value, error = None, None
+    while True:
+        done, step = _advance(flow, value, error)
+        if done:
+            return step
+        try:
+            value, error = step.fn(*step.args), None
+        except Exception as e:
+            value, error = None, e
+
+
+def _advance_and_release(flow, value, error, release):
+    done, step = _advance(flow, value, error)
+    if not done and release is not None:
+        release()
+    return done, step
+
+
+async def run_flow_async(flow, release=None):
+    """
+    run_flow() for coroutines. The code between yields (request parsing, DB
+    queries) runs on the default thread pool, in the caller's contexts.
+    `release()` runs there too before each wait on inference; asgi.py uses it
+    to hand the request's DB connection back to the pool, so a flow must not
+    keep uncommitted changes across a yield.
+    """
+    value, error = None, None
+    while True:
+        done, step = await asyncio.to_thread(_advance_and_release, flow, value, error, release)
+        if done:
+            return step
+        try:
+            value, error = await step.afn(*step.args), None
+        except Exception as e:
+            value, error = None, e
@@ -0,0 +1,173 @@
+# backend/inference.py
+import asyncio
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+
+class Overloaded(Exception):
+    """Raised when a scheduler cannot take or finish a request in time (→ HTTP 503)."""
+
+
+class BatchScheduler:
+    """
+    Micro-batching front for a model that is not safe to call concurrently.
+
+    Callers `submit()` one item and block on the result; a single worker thread
+    drains the queue, groups up to `max_batch_size` items (waiting at most
+    `max_wait_ms` after the first one arrives) and runs `batch_fn` once for the
+    group. `batch_fn(items) -> results` must return one result per item, in order.
+
+    The queue is bounded: when it holds `max_queue` pending items, `submit`
+    raises `Overloaded` immediately instead of parking another request thread.
+    """
+
+    def __init__(self, name: str, batch_fn, max_batch_size: int = 8,
+                 max_wait_ms: float = 10, max_queue: int = 64,
+                 timeout: float = 30.0):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.timeout = timeout
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._worker = None
+        self._start_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._batch_sizes: Counter = Counter()
+        self._submitted = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._failed = 0
+        self._busy_seconds = 0.0
+
+    def _ensure_worker(self):
+        # started on first use so importing the module (or forking) spawns nothing
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._start_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._run, name=f"{self.name}-inference", daemon=True
+                )
+                self._worker.start()
+
+    def _enqueue(self, items: list) -> list[Future]:
+        """
+        Queue all `items` back to back and return their futures. All or
+        nothing: if the queue cannot take every item, the ones already queued
+        are cancelled and Overloaded is raised.
+        """
+        self._ensure_worker()
+        futs = []
+        for item in items:
+            fut: Future = Future()
+            try:
+                self._queue.put_nowait((item, fut))
+            except queue.Full:
+                for queued in futs:
+                    queued.cancel()
+                with self._stats_lock:
+                    self._rejected += len(items)
+                raise Overloaded(f"{self.name} queue is full")
+            futs.append(fut)
+        with self._stats_lock:
+            self._submitted += len(futs)
+        return futs
+
+    def _give_up(self, futs: list[Future]):
+        for fut in futs:
+            fut.cancel()
+        with self._stats_lock:
+            self._timed_out += len(futs)
+        return Overloaded(f"{self.name} did not answer in time")
+
+    def submit(self, item, timeout: float | None = None):
+        """Queue `item`, wait for its result and return it (or re-raise its error)."""
+        return self.submit_many([item], timeout)[0]
+
+    def submit_many(self, items: list, timeout: float | None = None) -> list:
+        """
+        Queue all `items` back to back so the worker can run them as one batch,
+        and return their results in order. Raises Overloaded when the queue
+        cannot take them all or they are not done within the timeout.
+        """
+        futs = self._enqueue(items)
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        try:
+            return [fut.result(timeout=max(0.0, deadline - time.monotonic())) for fut in futs]
+        except TimeoutError:
+            raise self._give_up(futs)
+
+    async def asubmit(self, item, timeout: float | None = None):
+        """submit() for coroutines: awaits the result without holding a thread."""
+        return (await self.asubmit_many([item], timeout))[0]
+
+    async def asubmit_many(self, items: list, timeout: float | None = None) -> list:
+        futs = self._enqueue(items)
+        try:
+            return await asyncio.wait_for(
+                asyncio.gather(*(asyncio.wrap_future(f) for f in futs)),
+                self.timeout if timeout is None else timeout,
+            )
+        except asyncio.TimeoutError:
+            raise self._give_up(futs)
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # drop items whose caller already gave up
+            batch = [(item, fut) for item, fut in batch if fut.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            started = time.monotonic()
+            try:
+                results = self.batch_fn([item for item, _ in batch])
+                for (_, fut), res in zip(batch, results):
+                    fut.set_result(res)
+            except Exception as e:
+                with self._stats_lock:
+                    self._failed += len(batch)
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+
+            with self._stats_lock:
+                self._batch_sizes[len(batch)] += 1
+                self._busy_seconds += time.monotonic() - started
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            batches = sum(self._batch_sizes.values())
+            items = sum(size * n for size, n in self._batch_sizes.items())
+            return {
+                'queue_depth':    self._queue.qsize(),
+                'queue_capacity': self._queue.maxsize,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms':    self.max_wait * 1000,
+                'submitted':      self._submitted,
+                'rejected':       self._rejected,
+                'timed_out':      self._timed_out,
+                'failed':         self._failed,
+                'batches':        batches,
+                'avg_batch_size': items / batches if batches else 0.0,
+                'batch_sizes':    {str(k): v for k, v in sorted(self._batch_sizes.items())},
+                'busy_seconds':   round(self._busy_seconds, 3),
+            }
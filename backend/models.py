@@ -1,14 +1,39 @@
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import check_password_hash
+from passwords import hash_password
 from datetime import datetime
 from sqlalchemy.dialects.postgresql import BYTEA
 from sqlalchemy import LargeBinary
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.dialects.postgresql import JSON
 from datetime import datetime
+from embedding_codec import encode_embedding, decode_embedding
 
 
 db = SQLAlchemy()
 
+
+class Embedding(TypeDecorator):
+    """
+    Speaker embedding stored in the compact binary format (see embedding_codec).
+    Binds lists or ndarrays; loads float32 ndarrays. Legacy JSON rows are still
+    readable until `flask migrate-embeddings` has rewritten them.
+    """
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return encode_embedding(value)
+
+    def result_processor(self, dialect, coltype):
+        # skip LargeBinary's bytes() coercion: un-migrated rows may come back
+        # as JSON text or an already-parsed list
+        def process(value):
+            return decode_embedding(value)
+        return process
+
 class User(db.Model):
     __tablename__ = 'users'
     id = db.Column(db.Integer, primary_key=True)
@@ -16,6 +41,7 @@ class User(db.Model):
     password_hash = db.Column(db.String(256), nullable=False)
     role = db.Column(db.String(20), nullable=False, default='viewer')
 
+    # averaged speaker embedding, binary float32 (see embedding_codec)
     voice_profile = db.Column(LargeBinary)
 
     voices = db.relationship(
@@ -25,7 +51,7 @@ class User(db.Model):
     )
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
@@ -34,10 +60,16 @@ class Voice(db.Model):
     __tablename__ = 'voices'
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    # raw audio blob (e.g. your base64‑decoded webm bytes)
-    audio_data = db.Column(LargeBinary, nullable=False)
+    # recording bytes live in the blob store (see blob_store), addressed by
+    # their SHA-256; audio_codec is the sniffed content type
+    audio_ref = db.Column(db.String(64), nullable=True, index=True)
+    audio_size = db.Column(db.Integer, nullable=True)
+    audio_codec = db.Column(db.String(64), nullable=True)
+    # legacy in-row audio, NULL once `flask migrate-voice-blobs` has moved it;
+    # deferred so that listings never select it
+    audio_data = db.deferred(db.Column(LargeBinary, nullable=True))
     # optional embedding vector (filled in later)
-    embedding = db.Column(JSON, nullable=True)
+    embedding = db.Column(Embedding, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
     # back‑ref to its owner
@@ -51,6 +83,14 @@ class VoicePhrase(db.Model):
 
 class AuditLog(db.Model):
     __tablename__ = 'audit_logs'
+    # keyset pagination walks (timestamp, id) newest-first, optionally per user/action
+    __table_args__ = (
+        db.Index('ix_audit_logs_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_audit_logs_user_timestamp_id', 'user_id', 'timestamp', 'id'),
+        db.Index('ix_audit_logs_action_timestamp_id', 'action', 'timestamp', 'id'),
+        # archived rows keep their ids; SQLite must not hand them out again
+        {'sqlite_autoincrement': True},
+    )
 
     id         = db.Column(db.Integer,   primary_key=True)
     user_id    = db.Column(db.Integer,   db.ForeignKey('users.id'), nullable=True)
@@ -59,3 +99,40 @@ class AuditLog(db.Model):
     details    = db.Column(JSON,         nullable=True)
 
     user = db.relationship('User', backref='audit_logs')
+
+class Dataset(db.Model):
+    __tablename__ = 'datasets'
+
+    id         = db.Column(db.Integer,     primary_key=True)
+    name       = db.Column(db.String(128), unique=True, nullable=False)
+    owner_id   = db.Column(db.Integer,     db.ForeignKey('users.id', ondelete='SET NULL'), nullable=True)
+    # bumped on every upload; used as the cache/version stamp for the dataset
+    version    = db.Column(db.Integer,     nullable=False, default=0)
+    row_count  = db.Column(db.BigInteger,  nullable=False, default=0)
+    size_bytes = db.Column(db.BigInteger,  nullable=False, default=0)
+    # unified schema: [{"name": ..., "type": <arrow type name>}, ...]
+    columns    = db.Column(JSON,           nullable=True)
+    # Parquet part files (relative to the dataset directory) of the live version
+    parts      = db.Column(JSON,           nullable=True)
+    created_at = db.Column(db.DateTime,    default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime,    default=datetime.utcnow, nullable=False)
+
+class DashboardTile(db.Model):
+    __tablename__ = 'dashboard_tiles'
+
+    id             = db.Column(db.Integer,     primary_key=True)
+    name           = db.Column(db.String(128), unique=True, nullable=False)
+    dataset_id     = db.Column(db.Integer,     db.ForeignKey('datasets.id', ondelete='CASCADE'), nullable=False)
+    # aggregate query spec (see query_engine.normalize_query)
+    spec           = db.Column(JSON,           nullable=False)
+    # materialized rows served by GET /dashboard
+    result         = db.Column(JSON,           nullable=True)
+    # mergeable partial aggregates + the parts they cover, for incremental refresh
+    state          = db.Column(JSON,           nullable=True)
+    source_parts   = db.Column(JSON,           nullable=True)
+    source_version = db.Column(db.Integer,     nullable=True)
+    refreshed_at   = db.Column(db.DateTime,    nullable=True)
+    refresh_ms     = db.Column(db.Float,       nullable=True)
+    created_at     = db.Column(db.DateTime,    default=datetime.utcnow, nullable=False)
+
+    dataset = db.relationship('Dataset', backref=db.backref('tiles', cascade='all, delete-orphan'))
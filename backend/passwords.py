@@ -0,0 +1,186 @@
+# backend/passwords.py
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from werkzeug.security import check_password_hash, generate_password_hash
+from inference import Overloaded
+
+# KDF for new and rehashed passwords, in werkzeug's "method:params" form
+# (e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000"); "" = werkzeug default
+_METHOD = os.getenv("PASSWORD_HASH_METHOD", "")
+_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+_QUEUE_MAX = int(os.getenv("PASSWORD_HASH_QUEUE", 16))
+_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", 5))
+
+
+def hash_password(password: str) -> str:
+    if _METHOD:
+        return generate_password_hash(password, method=_METHOD)
+    return generate_password_hash(password)
+
+
+_method_tag: str | None = None
+
+
+def needs_rehash(pwhash: str) -> bool:
+    """True when `pwhash` was made with other KDF parameters than hash_password uses."""
+    global _method_tag
+    if _method_tag is None:
+        # werkzeug fills in default parameters, so compare against a real hash
+        _method_tag = hash_password("").split("$", 1)[0]
+    return pwhash.split("$", 1)[0] != _method_tag
+
+
+class HashPool:
+    """
+    Runs password KDFs off the request threads. At most `workers` hashes run at
+    once (hashlib releases the GIL while hashing); at most `max_queue` requests
+    may wait or run. Beyond that, or when a result takes longer than `timeout`,
+    callers get inference.Overloaded (→ 503) instead of holding a worker.
+    """
+
+    def __init__(self, workers: int, max_queue: int, timeout: float):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_queue)
+        self._stats_lock = threading.Lock()
+        self._done = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._rehashed = 0
+        self._busy_seconds = 0.0
+
+    def _pool(self) -> ThreadPoolExecutor:
+        # created on first use so importing the module (or forking) spawns nothing
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="password-hash")
+        return self._executor
+
+    def _timed(self, fn, args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            with self._stats_lock:
+                self._done += 1
+                self._busy_seconds += time.perf_counter() - started
+            self._slots.release()
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._stats_lock:
+                self._rejected += 1
+            raise Overloaded("password hashing queue is full")
+        fut = self._pool().submit(self._timed, fn, args)
+        try:
+            return fut.result(timeout=self.timeout)
+        except TimeoutError:
+            # a queued job is dropped (and frees its slot); a running one finishes
+            if fut.cancel():
+                self._slots.release()
+            with self._stats_lock:
+                self._timed_out += 1
+            raise Overloaded("password hashing did not answer in time")
+
+    def verify(self, pwhash: str, password: str) -> tuple[bool, str | None]:
+        """
+        Check `password` against `pwhash`. Returns (ok, new_hash); new_hash is
+        set when the password was right but stored with outdated KDF parameters.
+        """
+        if not self.run(check_password_hash, pwhash, password):
+            return False, None
+        if not needs_rehash(pwhash):
+            return True, None
+        new_hash = self.run(hash_password, password)
+        with self._stats_lock:
+            self._rehashed += 1
+        return True, new_hash
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "workers":   self.workers,
+                "max_queue": self.max_queue,
+                "done":      self._done,
+                "rejected":  self._rejected,
+                "timed_out": self._timed_out,
+                "rehashed":  self._rehashed,
+                "avg_ms":    round(self._busy_seconds / self._done * 1000, 2) if self._done else None,
+            }
+
+
+class RateLimiter:
+    """
+    In-process token buckets keyed by any string: each key holds up to
+    `capacity` tokens, refilled at `capacity / period` per second. Idle keys
+    whose bucket is full again are dropped once `max_keys` is exceeded.
+    """
+
+    def __init__(self, capacity: int, period: float, max_keys: int = 10_000):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets: dict = {}      # key -> (tokens, updated_at)
+        self.rejected = 0
+
+    def _prune(self, now):
+        full = [k for k, (tokens, at) in self._buckets.items()
+                if tokens + (now - at) * self.rate >= self.capacity]
+        for k in full:
+            del self._buckets[k]
+
+    def hit(self, key: str) -> float:
+        """Take a token for `key`. Returns 0 if allowed, else seconds until one is free."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, at = self._buckets.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - at) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                self.rejected += 1
+                return (1 - tokens) / self.rate
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+            return 0.0
+
+    def refund(self, key: str):
+        """Give back the token a hit() took, e.g. for an attempt that succeeded."""
+        now = time.monotonic()
+        with self._lock:
+            if key in self._buckets:
+                tokens, at = self._buckets[key]
+                self._buckets[key] = (min(self.capacity, tokens + (now - at) * self.rate + 1), now)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"keys": len(self._buckets), "capacity": self.capacity,
+                    "per_second": self.rate, "rejected": self.rejected}
+
+
+def _limiter(env: str, default: str) -> RateLimiter:
+    # "<attempts>/<seconds>", e.g. "5/60"
+    attempts, seconds = os.getenv(env, default).split("/")
+    return RateLimiter(int(attempts), float(seconds))
+
+
+hash_pool = HashPool(_WORKERS, _QUEUE_MAX, _TIMEOUT)
+login_user_limiter = _limiter("LOGIN_RATE_PER_USER", "5/60")
+login_ip_limiter = _limiter("LOGIN_RATE_PER_IP", "30/60")
+
+
+def password_stats() -> dict:
+    return {
+        "hash_pool": hash_pool.stats(),
+        "rate_limit": {
+            "per_user": login_user_limiter.stats(),
+            "per_ip": login_ip_limiter.stats(),
+        },
+    }
@@ -0,0 +1,262 @@
+# backend/query_engine.py
+import json
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+_MAX_LIMIT = 10_000
+_DEFAULT_LIMIT = 100
+
+_FILTER_OPS = {
+    "=", "!=", "<", "<=", ">", ">=",
+    "in", "not_in", "between", "contains", "is_null", "not_null",
+}
+_OP_ALIASES = {"==": "=", "eq": "=", "ne": "!=", "lt": "<", "le": "<=", "gt": ">", "ge": ">="}
+
+# query fn → pyarrow hash-aggregate function
+_AGGREGATES = {
+    "count": "count", "count_all": "count_all", "count_distinct": "count_distinct",
+    "sum": "sum", "mean": "mean", "avg": "mean", "min": "min", "max": "max",
+    "stddev": "stddev", "variance": "variance",
+}
+
+
+class QueryError(ValueError):
+    """Invalid query spec (→ HTTP 400)."""
+
+
+def _columns_list(value, field) -> list[str]:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list) or not all(isinstance(c, str) for c in value):
+        raise QueryError(f"'{field}' must be a list of column names")
+    return value
+
+
+def normalize_query(spec: dict, columns: list[str]) -> dict:
+    """
+    Validate a JSON query spec against the dataset's columns and return it in
+    canonical form (aliases resolved, defaults filled, keys fixed):
+
+      {
+        "select":     ["col", ...],                       # ignored with aggregates
+        "filter":     [{"column", "op", "value"}, ...],   # AND-ed
+        "group_by":   ["col", ...],
+        "aggregates": [{"fn", "column", "as"}, ...],
+        "order_by":   [{"column", "desc"}, ...],
+        "limit": int, "offset": int
+      }
+    """
+    if not isinstance(spec, dict):
+        raise QueryError("query must be a JSON object")
+    known = set(columns)
+
+    def check(col):
+        if col not in known:
+            raise QueryError(f"Unknown column: {col}")
+        return col
+
+    select = [check(c) for c in _columns_list(spec.get("select"), "select")]
+    group_by = [check(c) for c in _columns_list(spec.get("group_by"), "group_by")]
+
+    filters = []
+    raw_filters = spec.get("filter") or []
+    if isinstance(raw_filters, dict):
+        raw_filters = [raw_filters]
+    for f in raw_filters:
+        if not isinstance(f, dict):
+            raise QueryError("each filter must be an object")
+        op = str(f.get("op", "=")).lower()
+        op = _OP_ALIASES.get(op, op)
+        if op not in _FILTER_OPS:
+            raise QueryError(f"Unsupported filter op: {op}")
+        value = f.get("value")
+        if op in ("in", "not_in", "between") and not isinstance(value, list):
+            raise QueryError(f"'{op}' needs a list value")
+        if op == "between" and len(value) != 2:
+            raise QueryError("'between' needs [low, high]")
+        filters.append({"column": check(f.get("column")), "op": op, "value": value})
+
+    aggregates = []
+    for a in spec.get("aggregates") or []:
+        if not isinstance(a, dict):
+            raise QueryError("each aggregate must be an object")
+        fn = str(a.get("fn", "")).lower()
+        if fn not in _AGGREGATES:
+            raise QueryError(f"Unsupported aggregate: {fn}")
+        col = a.get("column")
+        if fn == "count" and col is None:
+            fn = "count_all"
+        if fn != "count_all":
+            check(col)
+        else:
+            col = None
+        alias = a.get("as") or (f"{fn}_{col}" if col else "count")
+        aggregates.append({"fn": _AGGREGATES[fn], "column": col, "as": alias})
+
+    if group_by and not aggregates:
+        aggregates.append({"fn": "count_all", "column": None, "as": "count"})
+
+    output = (group_by + [a["as"] for a in aggregates]) if aggregates else (select or list(columns))
+    order_by = []
+    for o in spec.get("order_by") or []:
+        if isinstance(o, str):
+            o = {"column": o.lstrip("-"), "desc": o.startswith("-")}
+        if o.get("column") not in output:
+            raise QueryError(f"Cannot order by {o.get('column')}: not in the result")
+        order_by.append({"column": o["column"], "desc": bool(o.get("desc", False))})
+
+    try:
+        limit = int(spec.get("limit", _DEFAULT_LIMIT))
+        offset = int(spec.get("offset", 0))
+    except (TypeError, ValueError):
+        raise QueryError("limit and offset must be integers")
+    if limit < 1 or offset < 0:
+        raise QueryError("limit must be positive and offset non-negative")
+
+    return {
+        "select":     select if not aggregates else [],
+        "filter":     filters,
+        "group_by":   group_by,
+        "aggregates": aggregates,
+        "order_by":   order_by,
+        "limit":      min(limit, _MAX_LIMIT),
+        "offset":     offset,
+    }
+
+
+def query_key(query: dict) -> str:
+    """Stable text form of a normalized query (for cache keys)."""
+    return json.dumps(query, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def _expression(filters: list[dict]):
+    expr = None
+    for f in filters:
+        field, op, value = ds.field(f["column"]), f["op"], f["value"]
+        if op == "=":
+            e = field == value
+        elif op == "!=":
+            e = field != value
+        elif op == "<":
+            e = field < value
+        elif op == "<=":
+            e = field <= value
+        elif op == ">":
+            e = field > value
+        elif op == ">=":
+            e = field >= value
+        elif op == "in":
+            e = field.isin(value)
+        elif op == "not_in":
+            e = ~field.isin(value)
+        elif op == "between":
+            e = (field >= value[0]) & (field <= value[1])
+        elif op == "contains":
+            e = pc.match_substring(field, str(value))
+        elif op == "is_null":
+            e = field.is_null()
+        else:
+            e = field.is_valid()
+        expr = e if expr is None else expr & e
+    return expr
+
+
+def open_dataset(files: list[str], schema: pa.Schema) -> ds.Dataset:
+    # the registry schema makes older, narrower parts cast on read
+    return ds.dataset(files, schema=schema, format="parquet")
+
+
+def _needed_columns(query: dict, schema: pa.Schema) -> list[str]:
+    """Column pushdown: only what the query projects, groups or aggregates."""
+    if query["aggregates"]:
+        cols = list(query["group_by"])
+        cols += [a["column"] for a in query["aggregates"] if a["column"]]
+    else:
+        cols = query["select"] or schema.names
+    return list(dict.fromkeys(cols))
+
+
+def group_aggregate(table: pa.Table, keys: list[str], specs: list) -> tuple[list, list]:
+    """
+    Hash-aggregate `table` by `keys` with pyarrow (col, fn) `specs`; returns
+    (key columns, aggregate columns in spec order). Picked apart by position,
+    since pyarrow names outputs "<col>_<fn>" (which can repeat) and puts keys
+    first or last depending on its version.
+    """
+    result = table.group_by(keys).aggregate(specs)
+    cols = result.columns
+    if result.column_names[:len(keys)] == keys:
+        return cols[:len(keys)], cols[len(keys):]
+    return cols[len(specs):], cols[:len(specs)]
+
+
+def aggregate(table: pa.Table, query: dict) -> pa.Table:
+    specs = [([] if a["fn"] == "count_all" else a["column"], a["fn"]) for a in query["aggregates"]]
+    key_cols, agg_cols = group_aggregate(table, query["group_by"], specs)
+    return pa.Table.from_arrays(
+        list(key_cols) + list(agg_cols),
+        names=query["group_by"] + [a["as"] for a in query["aggregates"]]
+    )
+
+
+def scanner(dataset: ds.Dataset, query: dict, batch_size: int = 64_000) -> ds.Scanner:
+    return dataset.scanner(
+        columns=_needed_columns(query, dataset.schema),
+        filter=_expression(query["filter"]),
+        batch_size=batch_size,
+    )
+
+
+def execute(dataset: ds.Dataset, query: dict) -> dict:
+    """
+    Run a normalized query. Filters and the needed column set are pushed into
+    the Parquet scan (row groups are skipped by their statistics), so only the
+    referenced columns of matching row groups are read. Returns one page.
+    """
+    scan = scanner(dataset, query)
+
+    if query["aggregates"]:
+        table = aggregate(scan.to_table(), query)
+        total = table.num_rows
+    elif query["order_by"]:
+        table = scan.to_table()
+        total = table.num_rows
+    else:
+        # plain projection: stop reading once the page (+1 row) is filled
+        table = scan.head(query["offset"] + query["limit"] + 1)
+        total = None
+
+    return page_result(table, query, total)
+
+
+def page_result(table: pa.Table, query: dict, total=None) -> dict:
+    """Apply order_by and the limit/offset window to a result table."""
+    limit, offset = query["limit"], query["offset"]
+    if query["order_by"]:
+        table = table.sort_by([(o["column"], "descending" if o["desc"] else "ascending")
+                               for o in query["order_by"]])
+
+    page = table.slice(offset, limit)
+    has_more = offset + page.num_rows < table.num_rows
+    return {
+        "columns":     page.column_names,
+        "rows":        page.to_pylist(),
+        "row_count":   page.num_rows,
+        "total":       total,
+        "offset":      offset,
+        "limit":       limit,
+        "next_offset": offset + page.num_rows if has_more else None,
+    }
+
+
+def stream_rows(dataset: ds.Dataset, query: dict):
+    """
+    Yield NDJSON lines for every matching row of a plain projection query,
+    one record batch at a time (constant memory, no limit/offset).
+    """
+    for batch in scanner(dataset, query).to_batches():
+        for row in batch.to_pylist():
+            yield json.dumps(row, default=str) + "\n"
@@ -1,17 +1,59 @@
+import re
+from functools import lru_cache, wraps
 from flask import jsonify
 from flask_jwt_extended import verify_jwt_in_request, get_jwt
-from functools import wraps
+
+# canonical role names, as stored in users.role and put in the JWT "role" claim
+ROLES = ("admin", "data analyst", "business user", "viewer")
+
+
+@lru_cache(maxsize=64)
+def normalize_role(role) -> str:
+    """'Data_Analyst', 'data-analyst' and 'data analyst' all become 'data analyst'."""
+    return re.sub(r"[\s_-]+", " ", str(role or "")).strip().lower()
+
+
+def _compile(allowed_roles) -> frozenset:
+    roles = frozenset(normalize_role(r) for r in allowed_roles)
+    unknown = roles.difference(ROLES)
+    if unknown:
+        raise ValueError(f"Unknown role(s) in roles_required: {sorted(unknown)}")
+    return roles
+
 
 def roles_required(*allowed_roles):
+    """
+    Allow the view only for the given roles. The role set is normalized and
+    frozen once, when the decorator is applied; per request this is one set
+    lookup. The token is verified only if @jwt_required() has not done it yet.
+    """
+    allowed = _compile(allowed_roles)
+
     def wrapper(fn):
         @wraps(fn)
         def decorator(*args, **kwargs):
-            verify_jwt_in_request()
-            claims = get_jwt()
-            user_role = claims.get("role", "").lower()
-            allowed = [r.lower() for r in allowed_roles]
-            if user_role not in allowed:
+            try:
+                claims = get_jwt()
+            except RuntimeError:          # no @jwt_required() in front of us
+                verify_jwt_in_request()
+                claims = get_jwt()
+            if normalize_role(claims.get("role")) not in allowed:
                 return jsonify({"msg": "Access denied"}), 403
             return fn(*args, **kwargs)
+        decorator.allowed_roles = allowed
         return decorator
-    return wrapper
\ No newline at end of file
+    return wrapper
+
+
+def init_rbac(app) -> dict:
+    """
+    Collect the policy table {endpoint: frozenset of roles} from the registered
+    views into app.extensions["rbac"]. Call after all blueprints are registered.
+    """
+    policy = {
+        endpoint: view.allowed_roles
+        for endpoint, view in app.view_functions.items()
+        if hasattr(view, "allowed_roles")
+    }
+    app.extensions["rbac"] = policy
+    return policy
@@ -0,0 +1,177 @@
+# backend/result_cache.py
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryCacheBackend:
+    """
+    In-process LRU cache of serialized results, bounded by total bytes, with a
+    per-entry TTL. Keys are "<namespace>:<rest>" so a namespace (a dataset) can
+    be dropped in one call.
+    """
+    name = "memory"
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()   # key -> (expires_at, payload)
+        self._bytes = 0
+        self.evictions = 0
+
+    def _drop(self, key):
+        _, payload = self._entries.pop(key)
+        self._bytes -= len(payload)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, payload: bytes):
+        if len(payload) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, payload)
+            self._bytes += len(payload)
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, namespace: str) -> int:
+        prefix = f"{namespace}:"
+        with self._lock:
+            stale = [k for k in self._entries if k.startswith(prefix)]
+            for k in stale:
+                self._drop(k)
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries":   len(self._entries),
+                "bytes":     self._bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+            }
+
+
+class RedisCacheBackend:
+    """
+    Shared cache for multi-worker deployments. Any Redis-protocol server works
+    (a local redis-server, KeyDB, ...); eviction is left to its maxmemory
+    policy and entries expire after `ttl`.
+    """
+    name = "redis"
+
+    def __init__(self, url: str, ttl: float, prefix: str = "ttd:query:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("QUERY_CACHE_BACKEND=redis needs the 'redis' package") from e
+        self._client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        return self._client.get(self.prefix + key)
+
+    def set(self, key, payload: bytes):
+        self._client.set(self.prefix + key, payload, ex=max(1, int(self.ttl)))
+
+    def invalidate(self, namespace: str) -> int:
+        keys = list(self._client.scan_iter(match=f"{self.prefix}{namespace}:*", count=500))
+        if keys:
+            self._client.delete(*keys)
+        return len(keys)
+
+    def clear(self):
+        self.invalidate("*")
+
+    def stats(self) -> dict:
+        info = self._client.info("memory")
+        return {"server_used_memory": info.get("used_memory")}
+
+
+class QueryCache:
+    """Result cache keyed on (dataset id, dataset version, normalized query)."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(dataset_id, version, query_text: str) -> str:
+        digest = hashlib.sha1(query_text.encode("utf-8")).hexdigest()
+        return f"{dataset_id}:{version}:{digest}"
+
+    def get(self, dataset_id, version, query_text: str):
+        payload = self.backend.get(self.key(dataset_id, version, query_text))
+        with self._lock:
+            if payload is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(payload)
+
+    def set(self, dataset_id, version, query_text: str, result: dict):
+        payload = json.dumps(result, default=str).encode("utf-8")
+        self.backend.set(self.key(dataset_id, version, query_text), payload)
+
+    def invalidate(self, dataset_id):
+        """Drop every cached result for a dataset (called when it is re-uploaded)."""
+        dropped = self.backend.invalidate(str(dataset_id))
+        with self._lock:
+            self.invalidations += dropped
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "backend":       self.backend.name,
+                "hits":          self.hits,
+                "misses":        self.misses,
+                "hit_rate":      self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }
+        stats.update(self.backend.stats())
+        return stats
+
+
+def _make_cache() -> QueryCache | None:
+    kind = os.getenv("QUERY_CACHE_BACKEND", "memory").lower()
+    ttl = float(os.getenv("QUERY_CACHE_TTL", 300))
+    if kind == "none":
+        return None
+    if kind == "redis":
+        url = os.getenv("QUERY_CACHE_URL", "redis://localhost:6379/0")
+        return QueryCache(RedisCacheBackend(url, ttl))
+    max_bytes = int(os.getenv("QUERY_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+    return QueryCache(MemoryCacheBackend(max_bytes, ttl))
+
+
+# process-wide cache used by /query; None when QUERY_CACHE_BACKEND=none
+query_cache = _make_cache()
@@ -1,11 +1,23 @@
-from flask import Blueprint, request, jsonify
+import base64
+import json
+from datetime import datetime
+from flask import Blueprint, current_app, request, jsonify
+from sqlalchemy import and_, or_, select
 from flask_jwt_extended import jwt_required
-from models import AuditLog, User, db
-from rbac import roles_required
+from models import AuditLog, User, Voice, db
+from rbac import ROLES, normalize_role, roles_required
+from speaker_index import speaker_index
+from voice_service import inference_stats, warm_up
+from result_cache import query_cache
+from dashboards import dashboard_stats
+from audit import audit_stats
+from audit_archive import has_archive, scan_archive
+from blob_store import collect_garbage
+from passwords import password_stats
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
-ALLOWED_ROLES = ['admin', 'data analyst', 'business user', 'viewer']
+ALLOWED_ROLES = list(ROLES)
 
 @admin_bp.route('/users', methods=['GET'])
 @jwt_required()
@@ -32,7 +44,7 @@ def list_users():
         query = query.filter(User.username.ilike(f"%{filters['username']}%"))
 
     if filters['role']:
-        query = query.filter(User.role == filters['role'])
+        query = query.filter(User.role == normalize_role(filters['role']))
 
     query = query.order_by(User.id)
     paged = query.paginate(page=page, per_page=per_page, error_out=False)
@@ -54,7 +66,7 @@ def list_users():
 @roles_required('admin')
 def update_user_role(user_id):
     data = request.get_json() or {}
-    new_role = data.get('role')
+    new_role = normalize_role(data.get('role'))
     if not new_role:
         return jsonify({'msg': 'Missing role field'}), 400
 
@@ -85,18 +97,86 @@ def delete_user(user_id):
     if not user:
         return jsonify({'msg': 'User not found'}), 404
 
+    refs = [r for (r,) in db.session.query(Voice.audio_ref).filter(Voice.user_id == user_id)]
     db.session.delete(user)
     db.session.commit()
+    speaker_index.remove(user_id)
+    # recordings went with the user; drop their blobs unless shared
+    collect_garbage(refs)
 
     return jsonify({'msg': f'User {user.username} deleted'}), 200
 
+# actions written by the auth/voice blueprints; an exact match can use the
+# (action, timestamp, id) index instead of a substring scan
+AUDIT_ACTIONS = {'login', 'login_voice', 'phrase_verify', 'voice_identify', 'voice_enroll'}
+
+# approximate totals stop counting here on databases without planner estimates
+_APPROX_COUNT_CAP = 10000
+
+
+def _encode_cursor(ts, log_id):
+    raw = json.dumps([ts.isoformat(), log_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    ts, log_id = json.loads(base64.urlsafe_b64decode(padded))
+    return datetime.fromisoformat(ts), int(log_id)
+
+
+def _approx_total(query):
+    """Planner row estimate on Postgres; elsewhere a count capped at _APPROX_COUNT_CAP."""
+    if db.engine.dialect.name == 'postgresql':
+        # ordinary bind parameters: filter values never become SQL text
+        compiled = query.statement.compile(dialect=db.engine.dialect)
+        plan = db.session.connection().exec_driver_sql(
+            "EXPLAIN (FORMAT JSON) " + str(compiled), compiled.params).scalar()
+        return int(plan[0]['Plan']['Plan Rows']), True
+    capped = query.limit(_APPROX_COUNT_CAP + 1).count()
+    return min(capped, _APPROX_COUNT_CAP), capped > _APPROX_COUNT_CAP
+
+
+def _archive_matcher(filters):
+    """The list_audit_logs filters as a predicate over archived records."""
+    log_id = int(filters['id']) if filters['id'] else None
+    user_id = int(filters['user_id']) if filters['user_id'] else None
+    username = filters['username'].lower()
+    action = filters['action']
+
+    def match(rec):
+        if log_id is not None and rec['id'] != log_id:
+            return False
+        if user_id is not None and rec['user_id'] != user_id:
+            return False
+        if username and username not in (rec.get('username') or '').lower():
+            return False
+        if action:
+            if action in AUDIT_ACTIONS:
+                return rec['action'] == action
+            return action.lower() in (rec['action'] or '').lower()
+        return True
+    return match
+
 @admin_bp.route('/audit-logs', methods=['GET'])
 @jwt_required()
 @roles_required('admin')
 def list_audit_logs():
-    # pagination params
-    page = int(request.args.get('page', 1))
-    per_page = int(request.args.get('per_page', 50))
+    """
+    Newest-first audit logs with keyset pagination on (timestamp, id).
+    Pass the returned `next_cursor` as `cursor` to get the following page;
+    `total=approx|exact` adds a row count (approx is cheap, exact is COUNT(*))
+    of the rows still in the database.
+
+    Once the database rows run out, paging continues into the compressed
+    archive of expired months (see audit_archive); `archived=0` stops there.
+    """
+    try:
+        per_page = min(max(int(request.args.get('per_page', 50)), 1), 500)
+        cursor = request.args.get('cursor')
+        after = _decode_cursor(cursor) if cursor else None
+    except (ValueError, TypeError):
+        return jsonify({'msg': 'Invalid per_page or cursor'}), 400
 
     filters = {
         'id':       request.args.get('id', '').strip(),
@@ -105,35 +185,123 @@ def list_audit_logs():
         'action':   request.args.get('action', '').strip(),
     }
 
-    query = AuditLog.query
-    # Exact ID
-    if filters['id']:
-        query = query.filter(AuditLog.id == int(filters['id']))
-    # Exact user_id
-    if filters['user_id']:
-        query = query.filter(AuditLog.user_id == int(filters['user_id']))
-    # Partial username (case-insensitive)
+    # usernames come from the same query (no lazy a.user load per row)
+    query = db.session.query(AuditLog, User.username)\
+        .outerjoin(User, AuditLog.user_id == User.id)
+    try:
+        # Exact ID
+        if filters['id']:
+            query = query.filter(AuditLog.id == int(filters['id']))
+        # Exact user_id
+        if filters['user_id']:
+            query = query.filter(AuditLog.user_id == int(filters['user_id']))
+    except ValueError:
+        return jsonify({'msg': 'Invalid id or user_id parameter'}), 400
+    # Partial username (case-insensitive): resolve against the small users
+    # table, then walk the (user_id, timestamp, id) index
     if filters['username']:
-        query = query.join(User).filter(User.username.ilike(f"%{filters['username']}%"))
-    # Partial action
+        matching = select(User.id).where(User.username.ilike(f"%{filters['username']}%"))
+        query = query.filter(AuditLog.user_id.in_(matching))
+    # Exact action when it is a known one, partial otherwise
     if filters['action']:
-        query = query.filter(AuditLog.action.ilike(f"%{filters['action']}%"))
-    # Then apply ordering & pagination
-    query = query.order_by(AuditLog.timestamp.desc())
-    paged = query.paginate(page=page, per_page=per_page, error_out=False)
+        if filters['action'] in AUDIT_ACTIONS:
+            query = query.filter(AuditLog.action == filters['action'])
+        else:
+            query = query.filter(AuditLog.action.ilike(f"%{filters['action']}%"))
+
+    total, total_is_estimate = None, False
+    if request.args.get('total') == 'exact':
+        total = query.order_by(None).count()
+    elif request.args.get('total') == 'approx':
+        total, total_is_estimate = _approx_total(query.order_by(None))
+
+    if after:
+        ts, log_id = after
+        query = query.filter(or_(
+            AuditLog.timestamp < ts,
+            and_(AuditLog.timestamp == ts, AuditLog.id < log_id)
+        ))
+    rows = query\
+        .order_by(AuditLog.timestamp.desc(), AuditLog.id.desc())\
+        .limit(per_page + 1)\
+        .all()
 
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
     items = [{
         'id': a.id,
         'user_id': a.user_id,
-        'username': a.user.username if a.user else None,
+        'username': username,
         'action': a.action,
         'timestamp': a.timestamp.isoformat(),
-        'details': a.details
-    } for a in paged.items]
+        'details': a.details,
+        'archived': False
+    } for a, username in rows]
+    next_key = (rows[-1][0].timestamp, rows[-1][0].id) if rows else None
+
+    # archived months are all older than what is left in the table, so the
+    # same (timestamp, id) cursor carries on into them
+    if not has_more and request.args.get('archived') != '0' and has_archive(current_app):
+        need = per_page - len(items)
+        archived, resume = scan_archive(
+            current_app, next_key or after, _archive_matcher(filters), limit=need + 1
+        )
+        if len(archived) > need:
+            has_more = True
+            archived = archived[:need]
+        elif resume is not None:
+            # hit the per-request file budget; resume below what was scanned
+            has_more = True
+        for rec in archived:
+            items.append({**rec, 'timestamp': rec['timestamp'].isoformat(), 'archived': True})
+        if archived:
+            next_key = (archived[-1]['timestamp'], archived[-1]['id'])
+        if resume is not None and len(archived) < need:
+            next_key = resume
 
     return jsonify({
         'logs': items,
-        'total': paged.total,
-        'page': paged.page,
-        'pages': paged.pages
+        'next_cursor': _encode_cursor(*next_key) if has_more and next_key else None,
+        'has_more': has_more,
+        'per_page': per_page,
+        'total': total,
+        'total_is_estimate': total_is_estimate
     }), 200
+
+@admin_bp.route('/metrics', methods=['GET'])
+@jwt_required()
+@roles_required('admin')
+def metrics():
+    return jsonify({
+        'inference': inference_stats(),
+        'speaker_index': speaker_index.stats(),
+        'dashboard': dashboard_stats(),
+        'audit': audit_stats(),
+        'login': password_stats(),
+    }), 200
+
+@admin_bp.route('/query-cache', methods=['GET'])
+@jwt_required()
+@roles_required('admin')
+def query_cache_stats():
+    if query_cache is None:
+        return jsonify({'enabled': False}), 200
+    return jsonify({'enabled': True, **query_cache.stats()}), 200
+
+@admin_bp.route('/query-cache', methods=['DELETE'])
+@jwt_required()
+@roles_required('admin')
+def clear_query_cache():
+    if query_cache is not None:
+        query_cache.clear()
+    return '', 204
+
+@admin_bp.route('/warm-up', methods=['POST'])
+@jwt_required()
+@roles_required('admin')
+def warm_up_models():
+    """Load the enabled speech models now (or {"models": [...]}); slow on a cold worker."""
+    models = (request.get_json(silent=True) or {}).get('models')
+    if models is not None and not isinstance(models, list):
+        return jsonify({'msg': 'models must be a list'}), 400
+    return jsonify({'loaded': warm_up(models or None)}), 200
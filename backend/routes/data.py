@@ -1,14 +1,23 @@
-from flask import Blueprint, jsonify, request
-from flask_jwt_extended import jwt_required
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from flask_jwt_extended import jwt_required, get_jwt_identity
 from rbac import roles_required
+from sqlalchemy.orm import joinedload
+from models import Dataset, DashboardTile, db
+from datasets import PublishConflict, ingest_csv, dataset_info, dataset_files, dataset_schema
+from query_engine import QueryError, normalize_query, query_key, open_dataset, execute, stream_rows
+from result_cache import query_cache
+from dashboards import refresh_tile, refresh_dataset_tiles, tile_info, record_render
+import os
+import time
 import pandas  as pd
+import pyarrow as pa
 
 
 data_bp = Blueprint("data", __name__)
 
 @data_bp.route("/upload", methods=["POST"])
 @jwt_required()
-@roles_required("admin", "data_analyst")
+@roles_required("admin", "data analyst")
 def upload_data():
     if 'file' not in request.files:
         return jsonify(msg="No file uploaded"), 400
@@ -18,24 +27,148 @@ def upload_data():
     if not filename.endswith('.csv'):
         return jsonify(msg="Only CSV files allowed"), 400
 
-    import pandas as pd
-    df = pd.read_csv(file)
+    name = (request.form.get('name') or os.path.splitext(filename)[0]).strip()
+    mode = request.form.get('mode', 'replace')
+    if mode not in ('replace', 'append'):
+        return jsonify(msg="mode must be 'replace' or 'append'"), 400
 
-    # df.to_csv(f"uploads/{filename}", index=False)
+    # werkzeug spools large uploads to disk; read them back in bounded chunks
+    try:
+        dataset, stats = ingest_csv(file.stream, name, owner_id=get_jwt_identity(), mode=mode)
+    except pd.errors.EmptyDataError:
+        return jsonify(msg="CSV file is empty"), 400
+    except (pd.errors.ParserError, UnicodeDecodeError) as e:
+        return jsonify(msg="Could not parse CSV", error=str(e)), 400
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+        # e.g. an object column mixing numbers and text
+        return jsonify(msg="Could not convert CSV columns", error=str(e)), 400
+    except PublishConflict as e:
+        return jsonify(msg=str(e)), 409
 
-    return jsonify(msg=f"Uploaded {filename} with {len(df)} rows"), 200
+    # results for older versions can never be hit again; free them now
+    if query_cache is not None:
+        query_cache.invalidate(dataset.id)
+    # re-materialize dashboard tiles over this dataset (incremental on append)
+    refresh_dataset_tiles(dataset)
+
+    return jsonify(
+        msg=f"Uploaded {filename} with {stats['rows']} rows",
+        dataset=dataset_info(dataset),
+        ingest=stats
+    ), 200
 
 @data_bp.route("/query", methods=["POST"])
 @jwt_required()
-@roles_required("admin", "data_analyst", "business_user")
+@roles_required("admin", "data analyst", "business user")
 def query_data():
-    return jsonify(result="Query executed.")
+    """
+    Run a structured query over an uploaded dataset. Body:
+      { "dataset": "<name>", "select": [...], "filter": [...], "group_by": [...],
+        "aggregates": [...], "order_by": [...], "limit": 100, "offset": 0 }
+    See query_engine.normalize_query for the full spec. Add "stream": true to a
+    plain (non-aggregate) query to get every matching row as NDJSON.
+    """
+    spec = request.get_json(silent=True)
+    if not isinstance(spec, dict) or not spec.get('dataset'):
+        return jsonify(msg="dataset is required"), 400
+
+    dataset = Dataset.query.filter_by(name=spec['dataset']).first()
+    if not dataset:
+        return jsonify(msg=f"Dataset {spec['dataset']} not found"), 404
+
+    try:
+        query = normalize_query(spec, [c['name'] for c in dataset.columns or []])
+    except QueryError as e:
+        return jsonify(msg=str(e)), 400
+
+    if spec.get('stream'):
+        if query['aggregates']:
+            return jsonify(msg="stream is only supported for non-aggregate queries"), 400
+        arrow_ds = open_dataset(dataset_files(dataset), dataset_schema(dataset))
+        return Response(
+            stream_with_context(stream_rows(arrow_ds, query)),
+            mimetype='application/x-ndjson'
+        )
+
+    started = time.perf_counter()
+    cache_key = query_key(query)
+    result = query_cache.get(dataset.id, dataset.version, cache_key) if query_cache is not None else None
+    cached = result is not None
+    if not cached:
+        try:
+            arrow_ds = open_dataset(dataset_files(dataset), dataset_schema(dataset))
+            result = execute(arrow_ds, query)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError) as e:
+            return jsonify(msg="Query failed", error=str(e)), 400
+        if query_cache is not None:
+            query_cache.set(dataset.id, dataset.version, cache_key, result)
+
+    result['cached'] = cached
+    result['dataset'] = {'name': dataset.name, 'version': dataset.version}
+    result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return jsonify(result), 200
 
 @data_bp.route("/dashboard", methods=["GET"])
 @jwt_required()
-@roles_required("admin", "data_analyst", "business_user", "viewer")
+@roles_required("admin", "data analyst", "business user", "viewer")
 def view_dashboard():
-    return jsonify(dashboard="Dashboard content.")
+    """Serve the precomputed tiles; nothing is scanned on a page view."""
+    started = time.perf_counter()
+    tiles = DashboardTile.query\
+        .options(joinedload(DashboardTile.dataset))\
+        .order_by(DashboardTile.id)\
+        .all()
+    payload = [tile_info(t, t.dataset) for t in tiles]
+    render_ms = round((time.perf_counter() - started) * 1000, 2)
+    record_render(render_ms)
+    return jsonify(dashboard=payload, render_ms=render_ms), 200
+
+@data_bp.route("/dashboard/tiles", methods=["POST"])
+@jwt_required()
+@roles_required("admin", "data analyst")
+def create_dashboard_tile():
+    """
+    Define a tile as a named aggregate query and materialize it now:
+      { "name": "...", "dataset": "<name>", "query": { group_by, aggregates, ... } }
+    """
+    data = request.get_json(silent=True) or {}
+    name, ds_name, spec = data.get('name'), data.get('dataset'), data.get('query')
+    if not name or not ds_name or not isinstance(spec, dict):
+        return jsonify(msg="name, dataset and query are required"), 400
+
+    dataset = Dataset.query.filter_by(name=ds_name).first()
+    if not dataset:
+        return jsonify(msg=f"Dataset {ds_name} not found"), 404
+    if DashboardTile.query.filter_by(name=name).first():
+        return jsonify(msg="Tile already exists"), 409
+
+    try:
+        query = normalize_query(spec, [c['name'] for c in dataset.columns or []])
+    except QueryError as e:
+        return jsonify(msg=str(e)), 400
+    if not query['aggregates']:
+        return jsonify(msg="Dashboard tiles must aggregate (group_by and/or aggregates)"), 400
+
+    tile = DashboardTile(name=name, dataset_id=dataset.id, spec=spec)
+    db.session.add(tile)
+    try:
+        refresh_tile(tile, dataset)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError) as e:
+        db.session.rollback()
+        return jsonify(msg="Query failed", error=str(e)), 400
+    db.session.commit()
+    return jsonify(tile_info(tile, dataset)), 201
+
+@data_bp.route("/dashboard/tiles/<int:tile_id>", methods=["DELETE"])
+@jwt_required()
+@roles_required("admin", "data analyst")
+def delete_dashboard_tile(tile_id):
+    tile = DashboardTile.query.get(tile_id)
+    if not tile:
+        return jsonify(msg="Tile not found"), 404
+    db.session.delete(tile)
+    db.session.commit()
+    return '', 204
 
 @data_bp.route("/admin/settings", methods=["GET"])
 @jwt_required()
@@ -45,6 +178,6 @@ def admin_settings():
 
 @data_bp.route("/logs", methods=["GET"])
 @jwt_required()
-@roles_required("admin", "data_analyst")
+@roles_required("admin", "data analyst")
 def view_logs():
     return jsonify(logs="Audit logs go here.")
\ No newline at end of file
@@ -1,17 +1,46 @@
-import base64
-import json
-import math
+import os
 import traceback
-from flask import Blueprint, request, jsonify, abort
-from models import AuditLog, User, Voice, VoicePhrase, db
+from flask import Blueprint, Response, request, jsonify, abort, stream_with_context
+from sqlalchemy import func
+from werkzeug.datastructures import ContentRange
+from models import User, Voice, VoicePhrase, db
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt, create_access_token
-from voice_service import extract_embedding, transcribe_and_match
-from rbac import roles_required
-import numpy as np
+from voice_service import (
+    extract_embedding, extract_embedding_async, extract_embeddings, extract_embeddings_async,
+    transcribe_and_match, transcribe_and_match_async, decode_many_async,
+    decode_many, clip_quality, average_embeddings,
+)
+from speaker_index import speaker_index
+from inference import Overloaded
+from embedding_codec import encode_embedding
+from blob_store import audio_content_type, blob_store, collect_garbage
+from rbac import normalize_role, roles_required
+from flows import Await, flow_view
+from audio_upload import UploadError, read_audio, read_recordings
+from auth import VOICE_LOGIN_MIN_CONFIDENCE
+import audit
 import datetime
 
 voice_bp = Blueprint('voice', __name__)
 
+
+@voice_bp.errorhandler(UploadError)
+def _upload_error(e):
+    return jsonify({'message': str(e)}), e.status
+
+# recordings accepted per enrollment
+_ENROLL_MIN = int(os.getenv("ENROLL_MIN_RECORDINGS", 3))
+_ENROLL_MAX = int(os.getenv("ENROLL_MAX_RECORDINGS", 10))
+
+# bytes read per chunk when streaming a recording
+_AUDIO_CHUNK = 256 * 1024
+
+
+def _store_audio(raw: bytes) -> dict:
+    """Put a recording in the blob store; returns the Voice column values."""
+    ref, size = blob_store().put(raw)
+    return {'audio_ref': ref, 'audio_size': size, 'audio_codec': audio_content_type(raw[:16])}
+
 # List all users in the dropdown list
 @voice_bp.route('/users', methods=['GET'])
 @jwt_required()
@@ -29,32 +58,28 @@ def list_users():
 def add_voice():
     """
     Free‐form: allow a user to upload one arbitrary recording (no phrase matching).
+    Audio as a raw audio/webm body, a multipart `audio` file or base64 JSON.
     """
-    data = request.get_json() or {}
-    audio_b64 = data.get('audio')
-    if not audio_b64:
+    _, raw = read_audio()
+    if not raw:
         return jsonify({'message': 'audio field is required'}), 400
 
-    # decode base64
-    try:
-        raw = base64.b64decode(audio_b64)
-    except Exception:
-        return jsonify({'message': 'Invalid base64 audio'}), 400
-
     # extract embedding
     try:
         emb = extract_embedding(raw)
+    except Overloaded:
+        return jsonify({'message': 'Voice service busy, try again'}), 503
     except Exception:
         traceback.print_exc()
         return jsonify({'message': 'Error extracting embedding'}), 500
 
-    # save to DB
+    # save to DB; the bytes go to the blob store
     current = get_jwt_identity()
     v = Voice(
         user_id     = current,
-        audio_data  = raw,
         embedding   = emb,
-        created_at  = datetime.datetime.utcnow()
+        created_at  = datetime.datetime.utcnow(),
+        **_store_audio(raw)
     )
     db.session.add(v)
     db.session.commit()
@@ -81,15 +106,110 @@ def get_user_voices(user_id):
     if claims.get("role") != "admin" and current != user_id:
         abort(403, description="Access denied")
 
-    vs = Voice.query\
-        .filter_by(user_id=user_id)\
+    # metadata only: the audio stays in the blob store (or the legacy
+    # audio_data column) and is served by get_voice_audio
+    size = func.coalesce(Voice.audio_size, func.length(Voice.audio_data))
+    vs = db.session.query(Voice.id, Voice.created_at, size)\
+        .filter(Voice.user_id == user_id)\
         .order_by(Voice.created_at.desc())\
         .all()
     return jsonify([{
-        'id': v.id,
-        'created_at': v.created_at.isoformat(),
-        'audio': base64.b64encode(v.audio_data).decode('utf-8')
-    } for v in vs]), 200
+        'id': vid,
+        'created_at': created_at.isoformat(),
+        'size': size,
+        'audio_url': f'/voice/voices/{vid}/audio'
+    } for vid, created_at, size in vs]), 200
+
+# Stream one recording's bytes
+@voice_bp.route('/voices/<int:voice_id>/audio', methods=['GET'])
+@jwt_required()
+@roles_required('admin', 'data analyst', 'business user', 'viewer')
+def get_voice_audio(voice_id):
+    """
+    Serve a recording with its sniffed audio content type. Supports single
+    byte ranges (206 / 416; several ranges get the whole body), If-Range,
+    and a strong ETag with If-None-Match (recordings never change). Bytes are read from the blob store (or, for
+    rows not migrated yet, from the database) in _AUDIO_CHUNK slices, so only
+    the requested range is ever in memory.
+    """
+    v = Voice.query.get(voice_id)
+    if not v:
+        abort(404, description="Recording not found")
+
+    claims  = get_jwt()
+    current = get_jwt_identity()
+    # non-admins can only listen to their own recordings
+    if claims.get("role") != "admin" and str(v.user_id) != str(current):
+        abort(403, description="Access denied")
+
+    if v.audio_ref:
+        size, mimetype = v.audio_size, v.audio_codec
+        # content-addressed, so the key is a strong validator
+        etag = v.audio_ref
+    else:
+        # not yet moved by `flask migrate-voice-blobs`: slice the column
+        size, head = db.session.query(
+            func.length(Voice.audio_data), func.substr(Voice.audio_data, 1, 16)
+        ).filter(Voice.id == voice_id).one()
+        mimetype = audio_content_type(bytes(head or b''))
+        etag = f'voice-{voice_id}-{size}'
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+        resp.set_etag(etag)
+        return resp
+
+    start, stop, status = 0, size, 200
+    byte_range = request.range
+    # a stale If-Range (other ETag, or a date) gets the full body instead, and
+    # so does a multi-range request (no multipart/byteranges responses)
+    fresh = 'If-Range' not in request.headers or request.if_range.etag == etag
+    if byte_range is not None and fresh and len(byte_range.ranges) == 1:
+        bounds = byte_range.range_for_length(size)
+        if bounds is None:
+            resp = Response(status=416)
+            resp.headers['Content-Range'] = f'bytes */{size}'
+            return resp
+        start, stop = bounds
+        status = 206
+
+    def generate_from_store(f):
+        with f:
+            f.seek(start)
+            remaining = stop - start
+            while remaining > 0:
+                chunk = f.read(min(_AUDIO_CHUNK, remaining))
+                if not chunk:
+                    return
+                yield chunk
+                remaining -= len(chunk)
+
+    def generate_from_row():
+        offset = start
+        while offset < stop:
+            length = min(_AUDIO_CHUNK, stop - offset)
+            chunk = db.session.query(func.substr(Voice.audio_data, offset + 1, length))\
+                .filter(Voice.id == voice_id).scalar()
+            if not chunk:
+                return
+            yield bytes(chunk)
+            offset += len(chunk)
+
+    if v.audio_ref:
+        try:
+            body = generate_from_store(blob_store().open(v.audio_ref))
+        except FileNotFoundError:
+            abort(404, description="Recording data missing")
+    else:
+        body = stream_with_context(generate_from_row())
+    resp = Response(body, status=status, mimetype=mimetype)
+    resp.content_length = stop - start
+    resp.accept_ranges = 'bytes'
+    if status == 206:
+        resp.content_range = ContentRange('bytes', start, stop, size)
+    resp.set_etag(etag)
+    resp.cache_control.private = True
+    resp.cache_control.max_age = 3600
+    return resp
 
 # Delete one voice from the database
 @voice_bp.route('/voices/<int:voice_id>', methods=['DELETE'])
@@ -106,57 +226,86 @@ def delete_voice(voice_id):
     if claims.get("role") != "admin" and v.user_id != current:
         abort(403, description="Access denied")
 
+    ref = v.audio_ref
     db.session.delete(v)
     db.session.commit()
+    # drop the blob unless another recording has the same bytes
+    collect_garbage([ref])
     return '', 204
 
 @voice_bp.route('/enroll', methods=['POST'])
 @jwt_required()
 @roles_required("admin", "data analyst", "business user")
+@flow_view
 def enroll_voice():
     """
-    Enroll the **current** logged‑in user. Expects 3 recordings:
+    Enroll the **current** logged‑in user. Expects N recordings
+    (ENROLL_MIN_RECORDINGS..ENROLL_MAX_RECORDINGS, default 3..10):
       { recordings: [ { phrase_id, audio }, … ] }
+    or multipart/form-data with repeated phrase_id fields and audio files.
+    All clips are decoded in parallel and embedded in one batch; the profile
+    is their quality-weighted, L2-normalized mean.
     """
     current_user_id = get_jwt_identity()
     user = User.query.get(current_user_id)
     if not user:
         return jsonify({"message": "User not found"}), 404
 
-    data = request.get_json() or {}
-    recs = data.get('recordings')
-    if not isinstance(recs, list) or len(recs) != 3:
-        return jsonify({'message': 'Exactly 3 recordings required'}), 400
+    recs = read_recordings(_ENROLL_MAX)
+    if recs is None or not _ENROLL_MIN <= len(recs) <= _ENROLL_MAX:
+        return jsonify({'message': f'Between {_ENROLL_MIN} and {_ENROLL_MAX} recordings required'}), 400
 
-    embeddings = []
+    # lists, objects etc. would otherwise reach the IN query / set lookup
     for rec in recs:
-        phrase = VoicePhrase.query.get(rec.get('phrase_id'))
-        if not phrase:
+        pid = rec.get('phrase_id')
+        if not isinstance(pid, int) or isinstance(pid, bool):
+            return jsonify({'message': f'Phrase {pid} invalid'}), 400
+
+    # one query for every phrase instead of one per recording
+    phrase_ids = {p.id for p in VoicePhrase.query.filter(
+        VoicePhrase.id.in_([rec.get('phrase_id') for rec in recs])
+    )}
+    raws = []
+    for rec in recs:
+        if rec.get('phrase_id') not in phrase_ids:
             return jsonify({'message': f'Phrase {rec.get("phrase_id")} invalid'}), 400
-
-        audio_b64 = rec.get('audio')
-        if not audio_b64:
+        if not rec['audio']:
             return jsonify({'message': 'Missing audio for a phrase'}), 400
+        raws.append(rec['audio'])
 
-        raw = base64.b64decode(audio_b64)
-        emb = extract_embedding(raw)
-        voice = Voice(user_id=user.id, audio_data=raw, embedding=emb)
-        db.session.add(voice)
-        embeddings.append(emb)
+    try:
+        wavs = yield Await(decode_many, decode_many_async, raws)
+        embeddings = yield Await(extract_embeddings, extract_embeddings_async, wavs)
+    except Overloaded:
+        return jsonify({'message': 'Voice service busy, try again'}), 503
+    except Exception:
+        traceback.print_exc()
+        return jsonify({'message': 'Error extracting embedding'}), 500
+
+    weights = [clip_quality(w) for w in wavs]
+    if max(weights) <= 0:
+        return jsonify({'message': 'Recordings are silent or too short'}), 400
+    avg_emb = average_embeddings(embeddings, weights)
 
-    # average the embeddings
-    avg_emb = [sum(vals)/len(vals) for vals in zip(*embeddings)]
-    user.voice_profile = json.dumps(avg_emb).encode('utf-8')
+    db.session.add_all([
+        Voice(user_id=user.id, embedding=emb, **_store_audio(raw))
+        for raw, emb in zip(raws, embeddings)
+    ])
+    user.voice_profile = encode_embedding(avg_emb)
 
     db.session.commit()
-    log = AuditLog(
+    audit.record(
         user_id=current_user_id,
         action='voice_enroll',
-        details={'recordings_count': len(recs)}
+        details={'recordings_count': len(recs), 'weights': [round(w, 3) for w in weights]}
     )
-    db.session.add(log)
-    db.session.commit()
-    return jsonify({'message': 'Enrollment complete'}), 201
+
+    speaker_index.upsert(user.id, avg_emb)
+    return jsonify({
+        'message': 'Enrollment complete',
+        'recordings': len(recs),
+        'weights': [round(w, 3) for w in weights]
+    }), 201
 
 @voice_bp.route('/phrases', methods=['GET'])
 def list_voice_phrases():
@@ -167,18 +316,19 @@ def list_voice_phrases():
     ]), 200
 
 @voice_bp.route('/verify', methods=['POST'])
+@flow_view
 def verify_voice_phrase():
     """
     Verify that the recording matches the target phrase.
     Expects:
       { "phrase_id": 1, "audio": "<base64‑webm>" }
+      or a raw audio/webm body with ?phrase_id=1, or multipart phrase_id + audio
     Returns:
       { transcript: string, score: number (0–1), match: boolean }
     """
-    data = request.get_json() or {}
+    data, raw = read_audio()
     pid = data.get('phrase_id')
-    audio_b64 = data.get('audio')
-    if pid is None or audio_b64 is None:
+    if pid is None or not raw:
         return jsonify({'message': 'phrase_id and audio are required'}), 400
 
     phrase = VoicePhrase.query.get(pid)
@@ -186,23 +336,19 @@ def verify_voice_phrase():
         return jsonify({'message': f'Phrase {pid} not found'}), 404
 
     try:
-        raw = base64.b64decode(audio_b64)
-    except Exception:
-        return jsonify({'message': 'Invalid base64 audio'}), 400
-
-    try:
-        transcript, score, match = transcribe_and_match(raw, phrase.text)
+        transcript, score, match = yield Await(
+            transcribe_and_match, transcribe_and_match_async, raw, phrase.text)
+    except Overloaded:
+        return jsonify({'message': 'Voice service busy, try again'}), 503
     except Exception:
         traceback.print_exc()
         return jsonify({'message': 'Error during verification'}), 500
 
-    log = AuditLog(
+    audit.record(
         user_id=None,  # unknown until login, or you could require jwt here
         action='phrase_verify',
         details={'phrase_id': pid, 'score': score, 'match': match}
     )
-    db.session.add(log)
-    db.session.commit()
 
     return jsonify({
         'transcript': transcript,
@@ -212,68 +358,54 @@ def verify_voice_phrase():
 
 @voice_bp.route('/identify', methods=['POST'])
 @jwt_required()
+@flow_view
 def identify_voice():
     """
     Identify which enrolled user best matches the submitted audio.
-    Expects JSON: { "audio": "<base64‑webm>" }
+    Expects JSON: { "audio": "<base64‑webm>" }, a raw audio/webm body or a
+    multipart `audio` file.
     Returns 200:
       { user: { id, username, role }, confidence: float }
     401 if no match above threshold.
     """
-    data = request.get_json() or {}
-    audio_b64 = data.get('audio')
-    if not audio_b64:
+    _, raw = read_audio()
+    if not raw:
         return jsonify({'message': 'audio field is required'}), 400
 
-    # decode
-    try:
-        raw = base64.b64decode(audio_b64)
-    except Exception:
-        return jsonify({'message': 'Invalid base64 audio'}), 400
-
     # get embedding for the probe
     try:
-        probe_emb = extract_embedding(raw)
+        probe_emb = yield Await(extract_embedding, extract_embedding_async, raw)
+    except Overloaded:
+        return jsonify({'message': 'Voice service busy, try again'}), 503
     except Exception:
         traceback.print_exc()
         return jsonify({'message': 'Error extracting embedding'}), 500
 
-    # find best match via cosine similarity
-    best_user = None
-    best_conf = -1.0
-    probe_arr = np.array(probe_emb, dtype=float)
-    probe_norm = np.linalg.norm(probe_arr) + 1e-8
-    for user in User.query.filter(User.voice_profile.isnot(None)).all():
-        try:
-            profile = np.array(json.loads(user.voice_profile.decode('utf-8')), dtype=float)
-        except Exception:
-            continue
+    # find best match via cosine similarity against the in-memory speaker index
+    matches = speaker_index.search(probe_emb, k=1)
+    if not matches:
+        return jsonify({'message': 'No enrolled users found'}), 404
+    best_user_id, best_conf = matches[0]
 
-        # cosine similarity = dot / (||a|| * ||b||)
-        cos_sim = float(np.dot(probe_arr, profile) / (probe_norm * (np.linalg.norm(profile) + 1e-8)))
-        if cos_sim > best_conf:
-            best_conf, best_user = cos_sim, user
+    if best_conf < VOICE_LOGIN_MIN_CONFIDENCE:
+        return jsonify({'message': 'No matching user', 'confidence': best_conf}), 401
 
+    # current role/username from the database (the index only holds vectors)
+    best_user = User.query.get(best_user_id)
     if best_user is None:
-        return jsonify({'message': 'No enrolled users found'}), 404
-
-    if best_conf < 0.5:
         return jsonify({'message': 'No matching user', 'confidence': best_conf}), 401
 
-    log = AuditLog(
-        user_id=best_user.id,
+    audit.record(
+        user_id=best_user_id,
         action='voice_identify',
         details={'confidence': best_conf}
     )
-    
-    db.session.add(log)
-    db.session.commit()
 
     now_iso = datetime.datetime.utcnow().isoformat()
     token = create_access_token(
-        identity=str(best_user.id),
+        identity=str(best_user_id),
         additional_claims={
-            'role': best_user.role.lower(),
+            'role': normalize_role(best_user.role),
             'username': best_user.username,
             'voice_verified_at': now_iso
         }
@@ -281,7 +413,7 @@ def identify_voice():
     return jsonify({
         'access_token': token,
         'user': {
-            'id':       best_user.id,
+            'id':       best_user_id,
             'username': best_user.username,
             'role':     best_user.role
         },
@@ -0,0 +1,666 @@
+# backend/speaker_index.py
+import json
+import os
+import struct
+import threading
+import uuid
+import numpy as np
+from ann_index import make_ann
+from embedding_codec import decode_embedding
+
+# initial row capacity; the matrix doubles when it fills up
+_INITIAL_CAPACITY = 64
+
+# below this many profiles search is exact; at or above it the ANN is used
+_ANN_MIN = int(os.getenv("SPEAKER_INDEX_ANN_MIN", 20_000))
+
+_MAGIC = b"SPKIDX01"
+_ALIGN = 64
+
+# journal of profile changes since the base file was written (<path>.delta):
+# magic + base_id, then records (user_id, stamp count, stamp newest, dim)
+# each followed by `dim` float32s; dim 0 is a removal
+_DELTA_MAGIC = b"SPKDLT01"
+_RECORD = struct.Struct("<qqqi")
+
+# fold the journal into a new base file once it holds this many records
+_COMPACT_AFTER = int(os.getenv("SPEAKER_INDEX_COMPACT_AFTER", 512))
+
+
+class SpeakerIndex:
+    """
+    Process-wide, in-memory index of enrolled voice profiles.
+
+    Profiles are stored L2-normalized as rows of one float32 matrix, so an
+    exact cosine-similarity search over every user is a single matrix-vector
+    product. Once the index holds `ann_min` profiles and its ANN structure
+    (see ann_index) is trained, a search only scores the candidate rows the
+    ANN proposes. The whole index can be saved to one file and opened again
+    memory-mapped, so a worker starts without re-reading every profile.
+    """
+
+    def __init__(self, dim: int | None = None, ann="default", ann_min: int = _ANN_MIN):
+        self._lock = threading.RLock()
+        self._dim = dim
+        self._matrix = np.empty((0, dim or 0), dtype=np.float32)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._size = 0
+        self._rows: dict[int, int] | None = {}
+        self._ann = make_ann() if ann == "default" else ann
+        self.ann_min = ann_min
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def dim(self) -> int | None:
+        return self._dim
+
+    def __contains__(self, user_id) -> bool:
+        if self._rows is None:
+            return bool(np.any(self._ids[:self._size] == int(user_id)))
+        return int(user_id) in self._rows
+
+    def _row_map(self) -> dict:
+        # built on first write; a read-only mapped index never needs it
+        if self._rows is None:
+            self._rows = dict(zip(self._ids[:self._size].tolist(), range(self._size)))
+        return self._rows
+
+    @staticmethod
+    def _normalize(vec) -> np.ndarray:
+        arr = np.asarray(vec, dtype=np.float32).reshape(-1)
+        return arr / (np.linalg.norm(arr) + 1e-8)
+
+    def _grow(self, needed: int):
+        capacity = self._matrix.shape[0]
+        if needed <= capacity:
+            return
+        new_cap = max(_INITIAL_CAPACITY, capacity * 2, needed)
+        matrix = np.empty((new_cap, self._dim), dtype=np.float32)
+        ids = np.empty(new_cap, dtype=np.int64)
+        matrix[:self._size] = self._matrix[:self._size]
+        ids[:self._size] = self._ids[:self._size]
+        self._matrix, self._ids = matrix, ids
+        if self._ann is not None:
+            self._ann.resize(new_cap, self._size)
+
+    def clear(self):
+        with self._lock:
+            self._size = 0
+            self._rows = {}
+            if self._ann is not None:
+                self._ann = type(self._ann)(nlist=self._ann.nlist, nprobe=self._ann.nprobe)
+
+    def build(self, entries):
+        """
+        Replace the whole index. `entries` yields (user_id, embedding) pairs.
+        The ANN is (re)trained when the result is large enough.
+        """
+        with self._lock:
+            self.clear()
+            for user_id, emb in entries:
+                self.upsert(user_id, emb)
+            self.train()
+
+    def train(self):
+        """Fit the ANN on the current profiles (no-op below ann_min or without one)."""
+        with self._lock:
+            if self._ann is not None and self._size >= self.ann_min:
+                self._ann.train(self._matrix, self._size)
+
+    def needs_training(self) -> bool:
+        """Whether train() would (re)fit the ANN: enough profiles, and no or drifted centroids."""
+        with self._lock:
+            return (self._ann is not None and self._size >= self.ann_min
+                    and self._ann.stale(self._size))
+
+    def upsert(self, user_id, embedding):
+        """Add a profile or replace the existing one for `user_id`."""
+        user_id = int(user_id)
+        vec = self._normalize(embedding)
+        with self._lock:
+            if self._dim is None or self._size == 0 and self._dim != vec.shape[0]:
+                self._dim = vec.shape[0]
+                self._matrix = np.empty((0, self._dim), dtype=np.float32)
+                self._ids = np.empty(0, dtype=np.int64)
+            if vec.shape[0] != self._dim:
+                raise ValueError(
+                    f"Embedding has {vec.shape[0]} dims, index expects {self._dim}"
+                )
+
+            rows = self._row_map()
+            row = rows.get(user_id)
+            if row is None:
+                self._grow(self._size + 1)
+                row = self._size
+                self._size += 1
+                rows[user_id] = row
+                self._ids[row] = user_id
+            self._matrix[row] = vec
+            if self._ann is not None:
+                self._ann.set(row, vec)
+
+    def remove(self, user_id):
+        """Drop a user's profile; the last row is moved into the freed slot."""
+        user_id = int(user_id)
+        with self._lock:
+            rows = self._row_map()
+            row = rows.pop(user_id, None)
+            if row is None:
+                return
+            last = self._size - 1
+            if row != last:
+                moved_id = int(self._ids[last])
+                self._matrix[row] = self._matrix[last]
+                self._ids[row] = moved_id
+                rows[moved_id] = row
+                if self._ann is not None and self._ann.trained:
+                    self._ann.move(row, last)
+            self._size = last
+
+    def search(self, probe, k: int = 1, exact: bool = False) -> list[tuple[int, float]]:
+        """
+        Return up to `k` (user_id, cosine_similarity) pairs, best match first.
+        `exact=True` scores every profile even when the ANN is available.
+        """
+        vec = self._normalize(probe)
+        with self._lock:
+            n = self._size
+            if n == 0:
+                return []
+            if vec.shape[0] != self._dim:
+                raise ValueError(
+                    f"Probe has {vec.shape[0]} dims, index expects {self._dim}"
+                )
+            rows = None
+            if not exact and n >= self.ann_min and self._ann is not None and self._ann.trained:
+                rows = self._ann.candidates(vec, n)
+            if rows is None or len(rows) == 0:
+                rows = np.arange(n)
+                scores = self._matrix[:n] @ vec
+            else:
+                scores = self._matrix[rows] @ vec
+
+            k = min(k, len(rows))
+            if k == 1:
+                top = np.array([int(np.argmax(scores))])
+            else:
+                top = np.argpartition(-scores, k - 1)[:k]
+                top = top[np.argsort(-scores[top])]
+            return [(int(self._ids[rows[i]]), float(scores[i])) for i in top]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "profiles":    self._size,
+                "dim":         self._dim,
+                "ann":         self._ann.name if self._ann is not None else None,
+                "ann_trained": bool(self._ann is not None and self._ann.trained),
+                "ann_active":  bool(self._ann is not None and self._ann.trained
+                                    and self._size >= self.ann_min),
+            }
+
+    def save(self, path: str, stamp=None, generation: int = 0, base_id: str | None = None):
+        """Write the index to `path` atomically (temp file + rename)."""
+        with self._lock:
+            n = self._size
+            arrays = {"ids": self._ids[:n], "matrix": self._matrix[:n]}
+            ann = None
+            if self._ann is not None and self._ann.trained:
+                ann = self._ann.name
+                arrays.update({f"ann_{k}": (v[:n] if k == "assign" else v)
+                               for k, v in self._ann.arrays().items()})
+            _write_index_file(path, {"dim": self._dim, "size": n, "ann": ann, "stamp": stamp,
+                                     "generation": generation, "base_id": base_id}, arrays)
+
+    def load(self, path: str, mode: str | None = "c") -> dict:
+        """
+        Replace the index with the contents of a saved file. `mode` is the
+        np.memmap mode: "r" maps read-only, "c" copy-on-write (pages stay
+        shared with the file and other processes until modified), None reads
+        private in-memory copies. Returns the file header.
+        """
+        header, arrays = _read_index_file(path, mode)
+        with self._lock:
+            self._dim = header["dim"]
+            self._size = header["size"]
+            self._ids = arrays["ids"]
+            self._matrix = arrays["matrix"]
+            self._rows = None
+            if self._ann is not None and header.get("ann") == self._ann.name:
+                self._ann.load_arrays({k[4:]: v for k, v in arrays.items() if k.startswith("ann_")})
+            elif self._ann is not None:
+                self._ann = type(self._ann)(nlist=self._ann.nlist, nprobe=self._ann.nprobe)
+        return header
+
+
+def _write_index_file(path: str, header: dict, arrays: dict):
+    layout, offset = [], 0
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        layout.append({"name": name, "dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset})
+        offset += -(-arr.nbytes // _ALIGN) * _ALIGN
+    raw = json.dumps({**header, "arrays": layout}).encode("utf-8")
+    data_start = -(-(len(_MAGIC) + 8 + len(raw)) // _ALIGN) * _ALIGN
+
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(_MAGIC)
+            f.write(len(raw).to_bytes(8, "little"))
+            f.write(raw)
+            for entry, arr in zip(layout, arrays.values()):
+                f.seek(data_start + entry["offset"])
+                f.write(np.ascontiguousarray(arr).tobytes())
+            f.truncate(data_start + offset)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def _read_header(f) -> tuple[dict, int]:
+    if f.read(len(_MAGIC)) != _MAGIC:
+        raise ValueError("not a speaker index file")
+    length = int.from_bytes(f.read(8), "little")
+    header = json.loads(f.read(length))
+    return header, -(-(len(_MAGIC) + 8 + length) // _ALIGN) * _ALIGN
+
+
+def read_index_header(path: str) -> dict:
+    with open(path, "rb") as f:
+        return _read_header(f)[0]
+
+
+def _read_index_file(path: str, mode: str | None) -> tuple[dict, dict]:
+    with open(path, "rb") as f:
+        header, data_start = _read_header(f)
+
+    arrays = {}
+    for entry in header["arrays"]:
+        dtype, shape = np.dtype(entry["dtype"]), tuple(entry["shape"])
+        offset = data_start + entry["offset"]
+        if int(np.prod(shape)) == 0:
+            arrays[entry["name"]] = np.empty(shape, dtype=dtype)
+        elif mode:
+            arrays[entry["name"]] = np.memmap(path, dtype=dtype, mode=mode, offset=offset, shape=shape)
+        else:
+            arrays[entry["name"]] = np.fromfile(path, dtype=dtype, count=int(np.prod(shape)),
+                                                offset=offset).reshape(shape)
+    return header, arrays
+
+
+def _encode_record(user_id: int, stamp, vec) -> bytes:
+    count, newest = stamp
+    if vec is None:
+        return _RECORD.pack(user_id, count, newest, 0)
+    return _RECORD.pack(user_id, count, newest, len(vec)) + np.asarray(vec, dtype="<f4").tobytes()
+
+
+def _read_delta(path: str, base_id: str, offset: int = 0):
+    """
+    Complete journal records from byte `offset` on, as ([(user_id, stamp,
+    vec | None), ...], next offset); (None, offset) when the journal belongs
+    to another base file. A record still being appended is left for later.
+    """
+    head = _DELTA_MAGIC + base_id.encode("ascii")
+    try:
+        with open(path, "rb") as f:
+            if f.read(len(head)) != head:
+                return None, offset
+            offset = max(offset, len(head))
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return None, offset
+    records, pos = [], 0
+    while pos + _RECORD.size <= len(data):
+        user_id, count, newest, dim = _RECORD.unpack_from(data, pos)
+        end = pos + _RECORD.size + 4 * dim
+        if end > len(data):
+            break
+        vec = np.frombuffer(data, dtype="<f4", count=dim, offset=pos + _RECORD.size).copy() if dim else None
+        records.append((user_id, [count, newest], vec))
+        pos = end
+    return records, offset + pos
+
+
+def _write_delta(path: str, base_id: str, records=()):
+    """Start the journal of base `base_id` atomically, holding `records`."""
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_DELTA_MAGIC + base_id.encode("ascii"))
+        for user_id, stamp, vec in records:
+            f.write(_encode_record(user_id, stamp, vec))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class _FileLock:
+    """Blocking cross-process lock (flock) around index writes; no-op without fcntl."""
+
+    def __init__(self, path):
+        self.path = path
+        self.f = None
+
+    def __enter__(self):
+        try:
+            import fcntl
+        except ImportError:
+            return self
+        self.f = open(self.path, "a")
+        fcntl.flock(self.f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+class SharedSpeakerIndex:
+    """
+    The speaker index as files shared by every worker process.
+
+    Each process maps the base index file read-only, so the profile matrix
+    sits in the page cache once however many workers run. Writers (enroll,
+    delete) only append one record, the new profile or a removal, to a
+    journal next to it (<path>.delta) under a file lock, then bump a
+    generation counter kept in a small side file (<path>.gen). Readers keep
+    that side file mapped too; each search compares the 8-byte counter with
+    the generation they have loaded and reads just the new journal records
+    into a small in-memory overlay that shadows the base rows.
+
+    Once the journal holds SPEAKER_INDEX_COMPACT_AFTER records, a background
+    thread folds it into a new base file. The lock is only held for the final
+    renames, so enrollments never wait for a full rewrite.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._index = SpeakerIndex()
+        self._overlay = SpeakerIndex(ann=None)
+        self._masked: set[int] = set()     # base rows shadowed by the overlay
+        self._base_id = None
+        self._delta_offset = 0
+        self._pending = 0                  # journal records applied on top of the base
+        self._path = None
+        self._gen_map = None
+        self._generation = -1
+        self._compactor = None
+        self.reloads = 0
+        self.compactions = 0
+
+    # -- generation counter ------------------------------------------------
+    def _gen_path(self) -> str:
+        return self._path + ".gen"
+
+    def _delta_path(self) -> str:
+        return self._path + ".delta"
+
+    def _lock_path(self) -> str:
+        return self._path + ".lock"
+
+    def _current_generation(self) -> int:
+        return int.from_bytes(self._gen_map[:8], "little") if self._gen_map is not None else 0
+
+    def _map_generation(self):
+        import mmap
+        gen_path = self._gen_path()
+        if not os.path.exists(gen_path) or os.path.getsize(gen_path) < 8:
+            with open(gen_path, "ab") as f:
+                f.truncate(8)
+        with open(gen_path, "rb") as f:
+            self._gen_map = mmap.mmap(f.fileno(), 8, access=mmap.ACCESS_READ)
+
+    def _bump_generation(self) -> int:
+        generation = self._current_generation() + 1
+        fd = os.open(self._gen_path(), os.O_WRONLY)
+        try:
+            os.pwrite(fd, generation.to_bytes(8, "little"), 0)
+        finally:
+            os.close(fd)
+        return generation
+
+    # -- loading -----------------------------------------------------------
+    def _apply(self, records):
+        for user_id, _, vec in records:
+            if user_id in self._index:
+                self._masked.add(user_id)
+            if vec is None:
+                self._overlay.remove(user_id)
+            else:
+                self._overlay.upsert(user_id, vec)
+        self._pending += len(records)
+
+    def _remap(self):
+        # read the counter first: if a writer publishes meanwhile, the next
+        # refresh sees a newer value and reads again
+        generation = self._current_generation()
+        index = SpeakerIndex()
+        header = index.load(self._path, mode="r")
+        with self._lock:
+            self._index = index
+            self._overlay = SpeakerIndex(ann=None)
+            self._masked = set()
+            self._base_id = header.get("base_id") or ""
+            self._pending = 0
+            records, self._delta_offset = _read_delta(self._delta_path(), self._base_id)
+            self._apply(records or [])
+            self._generation = generation
+            self.reloads += 1
+
+    def _catch_up(self):
+        generation = self._current_generation()
+        if (read_index_header(self._path).get("base_id") or "") != self._base_id:
+            self._remap()                       # compacted or rebuilt
+            return
+        records, offset = _read_delta(self._delta_path(), self._base_id, self._delta_offset)
+        if records is None:
+            self._remap()
+            return
+        self._apply(records)
+        self._delta_offset = offset
+        self._generation = generation
+
+    def refresh(self):
+        """Apply whatever another process published since the last call (cheap)."""
+        if self._path is not None and self._current_generation() != self._generation:
+            with self._lock:
+                if self._current_generation() != self._generation:
+                    self._catch_up()
+
+    def open(self, path: str, force: bool = False):
+        """
+        Attach to the index file at `path`, rebuilding it from the database
+        first if it is missing, stale (stamp mismatch) or `force` is set.
+        Must be called inside an application context.
+        """
+        self._path = path
+        with _FileLock(self._lock_path()):
+            self._map_generation()
+            stamp = db_stamp()
+            current = False
+            if not force and os.path.exists(path):
+                try:
+                    header = read_index_header(path)
+                    records, _ = _read_delta(self._delta_path(), header.get("base_id") or "")
+                    if header.get("base_id") and records is not None:
+                        current = (records[-1][1] if records else header.get("stamp")) == stamp
+                except (OSError, ValueError):
+                    current = False
+            if not current:
+                base_id = uuid.uuid4().hex
+                index = SpeakerIndex()
+                index.build(_profiles_from_db())
+                index.save(path, stamp, generation=self._current_generation() + 1, base_id=base_id)
+                _write_delta(self._delta_path(), base_id)
+                self._bump_generation()
+        self._remap()
+
+    # -- writing -----------------------------------------------------------
+    def _publish(self, user_id: int, vec):
+        """Append one change to the journal and make it visible to every worker."""
+        record = _encode_record(user_id, db_stamp(), vec)
+        with _FileLock(self._lock_path()):
+            base_id = read_index_header(self._path).get("base_id") or ""
+            if _read_delta(self._delta_path(), base_id)[0] is None:
+                _write_delta(self._delta_path(), base_id)
+            with open(self._delta_path(), "ab") as f:
+                f.write(record)
+                f.flush()
+                os.fsync(f.fileno())
+            self._bump_generation()
+        self.refresh()
+        if self._pending >= _COMPACT_AFTER:
+            self._compact_soon()
+
+    def _compact_soon(self):
+        with self._lock:
+            if self._compactor is None or not self._compactor.is_alive():
+                self._compactor = threading.Thread(target=self.compact, name="speaker-index-compact",
+                                                   daemon=True)
+                self._compactor.start()
+
+    def compact(self):
+        """
+        Fold the journal into a new base file, (re)training the ANN when it
+        is due. The copy is built and written without the file lock; records appended meanwhile are carried over
+        into the new journal when the files are swapped.
+        """
+        try:
+            header = read_index_header(self._path)
+            base_id = header.get("base_id") or ""
+            records, offset = _read_delta(self._delta_path(), base_id)
+            if not records:
+                return
+            index = SpeakerIndex()
+            index.load(self._path, mode=None)
+            for user_id, _, vec in records:
+                if vec is None:
+                    index.remove(user_id)
+                else:
+                    index.upsert(user_id, vec)
+            # enrollments only assign rows to existing cells; fit the ANN once
+            # the index outgrows ann_min, and refit it when the cells drift
+            if index.needs_training():
+                index.train()
+                print(f"Speaker index: trained {index.stats()['ann']} ANN on {len(index)} profiles")
+            new_id = uuid.uuid4().hex
+            staged = f"{self._path}.{new_id}.next"
+            index.save(staged, records[-1][1], generation=self._current_generation() + 1, base_id=new_id)
+            try:
+                with _FileLock(self._lock_path()):
+                    if (read_index_header(self._path).get("base_id") or "") != base_id:
+                        return                  # another process compacted first
+                    tail, _ = _read_delta(self._delta_path(), base_id, offset)
+                    os.replace(staged, self._path)
+                    _write_delta(self._delta_path(), new_id, tail or [])
+                    self._bump_generation()
+            finally:
+                if os.path.exists(staged):
+                    os.unlink(staged)
+            self.compactions += 1
+            self.refresh()
+        except Exception:
+            import traceback
+            traceback.print_exc()
+
+    # -- SpeakerIndex interface -------------------------------------------
+    def upsert(self, user_id, embedding):
+        vec = SpeakerIndex._normalize(embedding)
+        self.refresh()
+        dim = self._index.dim if len(self._index) else self._overlay.dim
+        if dim is not None and vec.shape[0] != dim:
+            raise ValueError(f"Embedding has {vec.shape[0]} dims, index expects {dim}")
+        self._publish(int(user_id), vec)
+
+    def remove(self, user_id):
+        if user_id in self:
+            self._publish(int(user_id), None)
+
+    def search(self, probe, k: int = 1, exact: bool = False):
+        self.refresh()
+        with self._lock:
+            index, overlay, masked = self._index, self._overlay, self._masked
+            # ask the base for enough extra hits to make up for shadowed rows
+            hits = [h for h in index.search(probe, k=k + len(masked), exact=exact) if h[0] not in masked]
+            hits += overlay.search(probe, k=k, exact=True)
+        hits.sort(key=lambda h: -h[1])
+        return hits[:k]
+
+    def __len__(self) -> int:
+        self.refresh()
+        with self._lock:
+            return len(self._index) - len(self._masked) + len(self._overlay)
+
+    def __contains__(self, user_id) -> bool:
+        self.refresh()
+        user_id = int(user_id)
+        with self._lock:
+            return user_id in self._overlay or (user_id in self._index and user_id not in self._masked)
+
+    def stats(self) -> dict:
+        self.refresh()
+        with self._lock:
+            return {
+                **self._index.stats(),
+                "profiles":    len(self._index) - len(self._masked) + len(self._overlay),
+                "path":        self._path,
+                "generation":  self._generation,
+                "reloads":     self.reloads,
+                "pending":     self._pending,
+                "compactions": self.compactions,
+            }
+
+
+# the process-wide index used by the auth and voice blueprints
+speaker_index = SharedSpeakerIndex()
+
+
+def index_path() -> str:
+    """SPEAKER_INDEX_PATH, default <instance>/speaker-index.bin."""
+    from flask import current_app
+    path = os.getenv("SPEAKER_INDEX_PATH") or os.path.join(current_app.instance_path, "speaker-index.bin")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def db_stamp() -> list:
+    """
+    Cheap fingerprint of the enrolled profiles: (profiles, newest voice id).
+    Every enrollment inserts Voice rows and every profile removal changes the
+    count, so a saved index whose stamp matches is current.
+    """
+    from models import db, User, Voice
+    count = db.session.query(db.func.count(User.id)).filter(User.voice_profile.isnot(None)).scalar()
+    newest = db.session.query(db.func.max(Voice.id)).scalar()
+    return [int(count or 0), int(newest or 0)]
+
+
+def _profiles_from_db():
+    from models import User
+    rows = User.query.with_entities(User.id, User.voice_profile)\
+        .filter(User.voice_profile.isnot(None)).yield_per(1000)
+    for user_id, profile in rows:
+        try:
+            emb = decode_embedding(profile)
+        except Exception:
+            continue
+        yield user_id, emb
+
+
+def load_speaker_index(index: SharedSpeakerIndex = speaker_index, path: str | None = None,
+                       force: bool = False):
+    """
+    Attach `index` to the shared index file, rebuilding the file from every
+    stored voice profile when it does not match the database (or `force`).
+    Must be called inside an application context.
+    """
+    index.open(path or index_path(), force=force)
+    return index
@@ -1,74 +1,503 @@
 # backend/voice_service.py
+from __future__ import annotations
+
+import asyncio
+import io
 import os
-import tempfile
 import re
-import whisper
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import TYPE_CHECKING
+import numpy as np
 from rapidfuzz import fuzz
-import torchaudio
-from speechbrain.inference.speaker import EncoderClassifier
+from inference import BatchScheduler
+from clip_cache import clip_cache, clip_digest
 
-# load Whisper model once (CPU-only)
-_model = whisper.load_model("base")
+if TYPE_CHECKING:
+    import torch
+    import torchaudio
 
 # threshold for phrase verification (80%)
 _THRESHOLD = 0.8
 
+# Models are loaded lazily, on first use, by the scheduler worker threads, so
+# importing this module costs nothing. VOICE_MODELS limits which ones this
+# process may load at all (e.g. "ecapa" for pods that never transcribe, or ""
+# for admin-only workers). Call warm_up() to pay the load cost up front.
+_ALL_MODELS = ("whisper", "ecapa")
+ENABLED_MODELS = frozenset(
+    m.strip().lower()
+    for m in os.getenv("VOICE_MODELS", ",".join(_ALL_MODELS)).split(",")
+    if m.strip()
+)
+_WHISPER_MODEL_NAME = os.getenv("WHISPER_MODEL", "base")
+
+# "fast": trim silence, skip clips without enough speech and cap the decoded
+# length to the expected phrase; "full": plain model.transcribe
+_VERIFY_MODE = os.getenv("WHISPER_VERIFY_MODE", "fast").lower()
+_MIN_SPEECH_S = float(os.getenv("VOICE_MIN_SPEECH_MS", 300)) / 1000
+_SILENCE_DBFS = float(os.getenv("VOICE_SILENCE_DBFS", -50))
+
+_models: dict = {}
+_models_lock = threading.Lock()
+
+
+class ModelDisabled(RuntimeError):
+    """Raised when a model is requested that VOICE_MODELS excludes."""
+
+
+def _load_whisper():
+    import whisper
+    # CPU-only
+    return whisper.load_model(_WHISPER_MODEL_NAME, device="cpu")
+
+
+def _load_ecapa():
+    from speechbrain.inference.speaker import EncoderClassifier
+    return EncoderClassifier.from_hparams(
+        source="speechbrain/spkrec-ecapa-voxceleb",
+        run_opts={"device": "cpu"}
+    )
+
+
+_LOADERS = {"whisper": _load_whisper, "ecapa": _load_ecapa}
+
+
+def get_model(name: str):
+    """Return the named model, loading it once per process on first call."""
+    model = _models.get(name)
+    if model is not None:
+        return model
+    if name not in ENABLED_MODELS:
+        raise ModelDisabled(f"{name} is disabled on this worker (VOICE_MODELS)")
+    with _models_lock:
+        if name not in _models:
+            _models[name] = _LOADERS[name]()
+        return _models[name]
+
+
+def warm_up(models=None) -> list[str]:
+    """
+    Load the enabled models (or the given subset) now. Intended for a
+    gunicorn `post_fork`/`--preload` hook, `flask warm-up` or
+    POST /admin/warm-up. Returns the names of the models that are loaded.
+    """
+    for name in (models or ENABLED_MODELS):
+        if name in ENABLED_MODELS:
+            get_model(name)
+    return sorted(_models)
+
+
+def models_status() -> dict:
+    return {name: {"enabled": name in ENABLED_MODELS, "loaded": name in _models}
+            for name in _ALL_MODELS}
+
+
+# micro-batching / backpressure settings, shared by both schedulers
+_BATCH_MAX_SIZE = int(os.getenv("VOICE_BATCH_MAX_SIZE", 8))
+_BATCH_MAX_WAIT_MS = float(os.getenv("VOICE_BATCH_MAX_WAIT_MS", 10))
+_QUEUE_MAX = int(os.getenv("VOICE_QUEUE_MAX", 32))
+_QUEUE_TIMEOUT = float(os.getenv("VOICE_QUEUE_TIMEOUT", 30))
+
+
+def _embed_batch(wavs: list) -> list[list[float]]:
+    """
+    Run ECAPA-TDNN once over a list of 1-D 16 kHz waveforms.
+    Shorter clips are zero-padded; `wav_lens` tells the model their true length.
+    """
+    import torch
+
+    spkr_model = get_model("ecapa")
+    lengths = torch.tensor([w.shape[-1] for w in wavs], dtype=torch.float32)
+    batch = torch.zeros(len(wavs), int(lengths.max()))
+    for i, w in enumerate(wavs):
+        batch[i, :w.shape[-1]] = w
+    rel_lens = lengths / lengths.max()
+
+    emb_tensor = spkr_model.encode_batch(batch, rel_lens)
+
+    # [batch, 1, feat] → [batch, feat]; average any remaining extra dims
+    while emb_tensor.dim() > 2:
+        emb_tensor = emb_tensor.mean(dim=1)
+    return [e.cpu().tolist() for e in emb_tensor]
+
 
-_spkr_model = EncoderClassifier.from_hparams(
-    source="speechbrain/spkrec-ecapa-voxceleb",
-    run_opts={"device": "cpu"}
+def _transcribe_batch(items: list) -> list[str]:
+    """
+    Transcribe a list of (16 kHz float waveform, max tokens or None).
+    Capped ("fast") clips share one batched greedy Whisper pass; phrases are
+    short, so each fits in one 30 s window, and the cap stops the batch once
+    the longest expected phrase could have been emitted. Uncapped ("full")
+    clips go through model.transcribe one at a time, which keeps its
+    temperature fallback and handles clips longer than 30 s.
+    """
+    import torch
+    import whisper
+
+    model = get_model("whisper")
+    texts = [None] * len(items)
+    fast = []
+    for i, (audio, cap) in enumerate(items):
+        if cap is None:
+            texts[i] = model.transcribe(audio, language="en", fp16=False)["text"]
+        else:
+            fast.append(i)
+    if fast:
+        mels = torch.stack([
+            whisper.log_mel_spectrogram(whisper.pad_or_trim(items[i][0]))
+            for i in fast
+        ]).to(model.device)
+        # the expected phrase is deliberately not passed as `prompt`: it would
+        # bias the transcript toward the very text being verified
+        options = whisper.DecodingOptions(
+            language="en", fp16=False, without_timestamps=True,
+            sample_len=max(items[i][1] for i in fast),
+        )
+        for i, result in zip(fast, whisper.decode(model, mels, options)):
+            texts[i] = result.text
+    return texts
+
+
+embedding_scheduler = BatchScheduler(
+    "ecapa", _embed_batch,
+    max_batch_size=_BATCH_MAX_SIZE, max_wait_ms=_BATCH_MAX_WAIT_MS,
+    max_queue=_QUEUE_MAX, timeout=_QUEUE_TIMEOUT,
+)
+transcription_scheduler = BatchScheduler(
+    "whisper", _transcribe_batch,
+    max_batch_size=_BATCH_MAX_SIZE, max_wait_ms=_BATCH_MAX_WAIT_MS,
+    max_queue=_QUEUE_MAX, timeout=_QUEUE_TIMEOUT,
 )
 
-def extract_embedding(webm_bytes: bytes) -> list[float]:
+
+def inference_stats() -> dict:
+    resamplers = get_resampler.cache_info()
+    return {
+        "models":  models_status(),
+        "ecapa":   embedding_scheduler.stats(),
+        "whisper": transcription_scheduler.stats(),
+        "clip_cache": clip_cache.stats(),
+        "resamplers": {
+            "hits": resamplers.hits,
+            "misses": resamplers.misses,
+            "cached": resamplers.currsize,
+            "max": resamplers.maxsize,
+        },
+    }
+
+
+
+_TARGET_SR = 16000
+
+# ask FFmpeg to resample while decoding instead of resampling in torch
+_DECODE_TO_16K = os.getenv("VOICE_DECODE_TO_16K", "0").lower() in ("1", "true", "yes")
+
+
+@lru_cache(maxsize=int(os.getenv("VOICE_RESAMPLER_CACHE_SIZE", 8)))
+def get_resampler(orig_sr: int, new_sr: int = _TARGET_SR) -> torchaudio.transforms.Resample:
     """
-    Decode raw WebM, resample if needed, and return a 1‑D speaker embedding.
+    Prebuilt Resample transform for (orig_sr, new_sr). Building one computes its
+    sinc kernel, so they are kept in a bounded LRU rather than made per request.
     """
+    import torchaudio
+    return torchaudio.transforms.Resample(orig_sr, new_sr)
+
+
+def resample(wav: torch.Tensor, orig_sr: int, new_sr: int = _TARGET_SR) -> torch.Tensor:
+    if orig_sr == new_sr:
+        return wav
+    return get_resampler(orig_sr, new_sr)(wav)
 
-    # write to a temp .webm file so torchaudio/FFmpeg can decode
-    with tempfile.NamedTemporaryFile(suffix=".webm", delete=False) as tmp:
-        tmp.write(webm_bytes)
-        tmp.flush()
-        tmp_path = tmp.name
-    wav, sr = torchaudio.load(tmp_path)
-    # clean up
-    try:
-        os.unlink(tmp_path)
-    except OSError:
-        pass
 
-    # SpeechBrain ECAPA-TDNN expects 16 kHz
-    if sr != 16000:
-        wav = torchaudio.transforms.Resample(sr, 16000)(wav)
+def _decode_16k(data: bytes) -> torch.Tensor:
+    # FFmpeg's decoder-side resampler, straight to 16 kHz mono
+    from torchaudio.io import StreamReader
 
-    # Run ECAPA‑TDNN
-    emb_tensor = _spkr_model.encode_batch(wav)
+    reader = StreamReader(io.BytesIO(data))
+    reader.add_basic_audio_stream(
+        frames_per_chunk=_TARGET_SR, sample_rate=_TARGET_SR, num_channels=1
+    )
+    import torch
 
-    # Remove batch dim if present
-    if emb_tensor.dim() > 1:
-        emb = emb_tensor.squeeze(0)
-    else:
-        emb = emb_tensor
+    chunks = [chunk for (chunk,) in reader.stream() if chunk is not None]
+    if not chunks:
+        return torch.zeros(0)
+    return torch.cat(chunks).reshape(-1)
 
-    # If you still have extra dims (e.g. [time, feat]), average over all but the last
-    # so that you end up with shape [feat].
-    while emb.dim() > 1:
-        emb = emb.mean(dim=0)
 
-    return emb.cpu().tolist()
+def _decode(data: bytes) -> torch.Tensor:
+    if _DECODE_TO_16K:
+        return _decode_16k(data).contiguous()
 
-def transcribe_and_match(audio_bytes: bytes, phrase: str) -> tuple[str, float, bool]:
+    import torchaudio
+
+    # torchaudio/FFmpeg can read from a bytes-backed file object; no temp file
+    wav, sr = torchaudio.load(io.BytesIO(data))
+
+    # mix down to mono so clips can be batched together
+    wav = wav.mean(dim=0) if wav.dim() > 1 else wav
+
+    # SpeechBrain ECAPA-TDNN and Whisper both expect 16 kHz
+    return resample(wav, sr).contiguous()
+
+
+def _is_raw(audio) -> bool:
+    return isinstance(audio, (bytes, bytearray, memoryview))
+
+
+def decode_audio(data, digest: bytes | None = None, cache: bool = True) -> torch.Tensor:
     """
-    Transcribe `audio_bytes` with Whisper and compare to `phrase`.
-    Returns (transcript, score [0–1], match).
+    Decode WebM/Opus (or any FFmpeg-readable) bytes fully in memory into a
+    1-D 16 kHz mono float32 tensor. Passing an already decoded tensor returns
+    it. Results are kept in the clip cache by content hash unless `cache` is
+    False (e.g. for the growing prefix of a streamed recording).
     """
-    # write out to a temp .webm file so whisper can load via ffmpeg
-    with tempfile.NamedTemporaryFile(suffix=".webm", delete=False) as tmp:
-        tmp.write(audio_bytes)
-        tmp_path = tmp.name
+    if not _is_raw(data):
+        return data
+    if not cache:
+        return _decode(data)
+    return clip_cache.get_or_compute("wav", digest or clip_digest(data), lambda: _decode(data))
+
+
+def decode_pcm(data: bytes, sr: int = _TARGET_SR) -> torch.Tensor:
+    """Raw little-endian float32 mono samples at `sr` as a 16 kHz tensor, like decode_audio()."""
+    import torch
+
+    pcm = np.frombuffer(data, dtype="<f4", count=len(data) // 4).astype(np.float32)
+    return resample(torch.from_numpy(pcm), sr).contiguous()
+
+
+def extract_embedding(audio) -> list[float]:
+    """
+    Return a 1‑D speaker embedding for raw WebM bytes or a tensor from
+    decode_audio(). Raises inference.Overloaded when the ECAPA queue is full.
+    """
+    digest = clip_digest(audio) if _is_raw(audio) else None
+    return clip_cache.get_or_compute(
+        "emb", digest, lambda: embedding_scheduler.submit(decode_audio(audio, digest))
+    )
+
+# FFmpeg decoding releases the GIL, so several clips decode in parallel
+_DECODE_WORKERS = int(os.getenv("VOICE_DECODE_WORKERS", 4))
+_decode_pool: ThreadPoolExecutor | None = None
+_decode_pool_lock = threading.Lock()
+
+
+def _decoder() -> ThreadPoolExecutor:
+    global _decode_pool
+    with _decode_pool_lock:
+        if _decode_pool is None:
+            _decode_pool = ThreadPoolExecutor(max(1, _DECODE_WORKERS), thread_name_prefix="voice-decode")
+    return _decode_pool
+
+
+def decode_many(datas: list) -> list:
+    """decode_audio() over several clips, on a small shared thread pool."""
+    if len(datas) <= 1 or _DECODE_WORKERS <= 1:
+        return [decode_audio(d) for d in datas]
+    return list(_decoder().map(decode_audio, datas))
+
+
+async def _in_decoder(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_decoder(), fn, *args)
+
+
+async def decode_many_async(datas: list) -> list:
+    """decode_many() for coroutines: the clips decode on the pool while the caller awaits."""
+    return list(await asyncio.gather(*(_in_decoder(decode_audio, d) for d in datas)))
+
+
+def _cached_embeddings(audios: list):
+    digests = [clip_digest(a) if _is_raw(a) else None for a in audios]
+    results = [clip_cache.get("emb", d) if d is not None else None for d in digests]
+    return digests, results, [i for i, r in enumerate(results) if r is None]
+
+
+def _fill_embeddings(digests, results, todo, embeddings) -> list:
+    for i, emb in zip(todo, embeddings):
+        results[i] = emb
+        if digests[i] is not None:
+            clip_cache.set("emb", digests[i], emb)
+    return results
+
+
+def extract_embeddings(audios: list) -> list[list[float]]:
+    """
+    Embeddings for several clips at once: decoded in parallel and queued
+    together, so ECAPA sees them as one encode_batch call (up to
+    VOICE_BATCH_MAX_SIZE). Raw clips already in the clip cache are not
+    re-embedded. Raises inference.Overloaded like extract_embedding.
+    """
+    digests, results, todo = _cached_embeddings(audios)
+    if not todo:
+        return results
+    embeddings = embedding_scheduler.submit_many(decode_many([audios[i] for i in todo]))
+    return _fill_embeddings(digests, results, todo, embeddings)
+
+
+async def extract_embeddings_async(audios: list) -> list[list[float]]:
+    """extract_embeddings() for coroutines; no thread waits on the model."""
+    digests, results, todo = _cached_embeddings(audios)
+    if not todo:
+        return results
+    wavs = await decode_many_async([audios[i] for i in todo])
+    embeddings = await embedding_scheduler.asubmit_many(wavs)
+    return _fill_embeddings(digests, results, todo, embeddings)
+
+
+async def extract_embedding_async(audio) -> list[float]:
+    return (await extract_embeddings_async([audio]))[0]
+
+
+def _frame_db(wav, sr: int = _TARGET_SR) -> np.ndarray:
+    """Energy of each 20 ms frame of a decoded clip, in dBFS."""
+    x = np.asarray(wav, dtype=np.float32).reshape(-1)
+    frame = sr // 50
+    n = len(x) // frame
+    energy = (x[:n * frame].reshape(n, frame) ** 2).mean(axis=1) + 1e-10
+    return 10 * np.log10(energy)
+
+
+def speech_bounds(wav, sr: int = _TARGET_SR, pad_s: float = 0.15) -> tuple[int, int, float]:
+    """
+    Sample range (start, stop) of the speech in a decoded clip, padded by
+    `pad_s`, and the seconds of speech. Frames count as speech above both
+    VOICE_SILENCE_DBFS and 10 dB over the noise floor; (0, 0, 0.0) when none do.
+    """
+    db = _frame_db(wav, sr)
+    if len(db) == 0:
+        return 0, 0, 0.0
+    active = np.flatnonzero(db > max(np.percentile(db, 10) + 10, _SILENCE_DBFS))
+    if len(active) == 0:
+        return 0, 0, 0.0
+    frame, pad = sr // 50, int(pad_s * sr)
+    start = max(0, int(active[0]) * frame - pad)
+    stop = min(len(wav), (int(active[-1]) + 1) * frame + pad)
+    return start, stop, len(active) * 0.02
+
+
+def trim_silence(wav, sr: int = _TARGET_SR, pad_s: float = 0.15):
+    """
+    Cut leading and trailing silence from a decoded clip, keeping `pad_s`
+    around the speech. Returns (trimmed clip, seconds of speech); a clip
+    without speech comes back whole with 0 s.
+    """
+    start, stop, speech_s = speech_bounds(wav, sr, pad_s)
+    return (wav[start:stop] if speech_s else wav), speech_s
+
+
+def clip_quality(wav, sr: int = _TARGET_SR) -> float:
+    """
+    Rough enrollment quality in [0, 1] from a decoded clip: the amount of
+    speech (frames well above the noise floor, 2 s counts as full) scaled by
+    the speech-to-noise ratio (30 dB counts as full).
+    """
+    db = _frame_db(wav, sr)
+    if len(db) == 0:
+        return 0.0
+    floor, peak = np.percentile(db, 10), np.percentile(db, 95)
+    speech_s = np.count_nonzero(db > floor + 10) * 0.02
+    snr = max(0.0, peak - floor)
+    return float(min(1.0, speech_s / 2.0) * min(1.0, snr / 30.0))
+
+
+def average_embeddings(embeddings, weights=None) -> np.ndarray:
+    """
+    Weighted mean of L2-normalized embeddings, L2-normalized again. Clips whose
+    direction disagrees with the plain mean (cosine below 0) get no weight, so
+    one bad recording cannot drag the profile away from the speaker.
+    """
+    m = np.asarray(embeddings, dtype=np.float32)
+    m /= np.maximum(np.linalg.norm(m, axis=1, keepdims=True), 1e-12)
+    w = np.ones(len(m), dtype=np.float32) if weights is None else np.asarray(weights, dtype=np.float32)
+
+    center = m.mean(axis=0)
+    agreement = m @ (center / max(float(np.linalg.norm(center)), 1e-12))
+    w = w * np.clip(agreement, 0.0, 1.0)
+    if float(w.sum()) <= 0:
+        w = np.ones(len(m), dtype=np.float32)
+
+    avg = (w[:, None] * m).sum(axis=0) / w.sum()
+    return avg / max(float(np.linalg.norm(avg)), 1e-12)
+
+
+def _phrase_tokens(phrase: str) -> int:
+    # English runs ~4 characters per BPE token; leave room for misspellings
+    return len(phrase) // 2 + 8
+
+
+def _transcription_item(audio, digest: bytes | None, phrase: str, mode: str):
+    """Decoded (waveform, token cap) for the Whisper scheduler, or None to skip inference."""
+    wav = decode_audio(audio, digest)
+    if mode != "fast":
+        return wav, None
+    wav, speech_s = trim_silence(wav)
+    if speech_s < _MIN_SPEECH_S:
+        return None                                 # silent / too short
+    return wav, _phrase_tokens(phrase)
+
+
+def _transcript_key(audio, phrase: str, mode: str):
+    digest = clip_digest(audio) if _is_raw(audio) else None
+    kind = f"text:{_WHISPER_MODEL_NAME}"
+    if mode == "fast":
+        kind += f":fast:{_phrase_tokens(phrase)}"
+    return kind, digest
+
+
+def transcribe_and_match(audio, phrase: str, mode: str | None = None) -> tuple[str, float, bool]:
+    """
+    Transcribe `audio` (raw bytes or a decode_audio() tensor) with Whisper and
+    compare to `phrase`. Returns (transcript, score [0–1], match).
+    `mode` overrides WHISPER_VERIFY_MODE ("fast" or "full").
+    Raises inference.Overloaded when the Whisper queue is full.
+    """
+    mode = mode or _VERIFY_MODE
+    kind, digest = _transcript_key(audio, phrase, mode)
+
+    def transcribe():
+        item = _transcription_item(audio, digest, phrase, mode)
+        return "" if item is None else transcription_scheduler.submit(item)
+
+    transcript = clip_cache.get_or_compute(kind, digest, transcribe)
+    return match_phrase(transcript, phrase)
+
+
+async def transcribe_and_match_async(audio, phrase: str, mode: str | None = None) -> tuple[str, float, bool]:
+    """transcribe_and_match() for coroutines; decoding runs on the decode pool."""
+    mode = mode or _VERIFY_MODE
+    kind, digest = _transcript_key(audio, phrase, mode)
+    transcript = clip_cache.get(kind, digest) if digest is not None else None
+    if transcript is None:
+        item = await _in_decoder(_transcription_item, audio, digest, phrase, mode)
+        transcript = "" if item is None else await transcription_scheduler.asubmit(item)
+        if digest is not None:
+            clip_cache.set(kind, digest, transcript)
+    return match_phrase(transcript, phrase)
+
+
+async def score_speech_async(wav, phrase: str):
+    """
+    Transcript match and speaker embedding of the speech in a decoded clip,
+    with Whisper and ECAPA queried concurrently and nothing cached (for
+    streamed audio that keeps growing). Returns (transcript, score, match,
+    embedding), or None while the clip holds less than VOICE_MIN_SPEECH_MS of
+    speech. Raises inference.Overloaded when either queue is full.
+    """
+    wav, speech_s = trim_silence(wav)
+    if speech_s < _MIN_SPEECH_S:
+        return None
+    transcript, embedding = await asyncio.gather(
+        transcription_scheduler.asubmit((wav, _phrase_tokens(phrase))),
+        embedding_scheduler.asubmit(wav),
+    )
+    return (*match_phrase(transcript, phrase), embedding)
+
 
-    # CPU inference
-    result = _model.transcribe(tmp_path, language="en", fp16=False)
-    transcript = result["text"].strip()
+def match_phrase(transcript: str, phrase: str) -> tuple[str, float, bool]:
+    """Fuzzy-compare a transcript to `phrase`. Returns (transcript, score [0–1], match)."""
+    transcript = transcript.strip()
 
     # normalize (lower, strip punctuation)
     def normalize(s: str) -> str:
@@ -81,4 +510,4 @@ def transcribe_and_match(audio_bytes: bytes, phrase: str) -> tuple[str, float, b
     score = raw_score / 100.0
     match = score >= _THRESHOLD
 
-    return transcript, score, match
\ No newline at end of file
+    return transcript, score, match
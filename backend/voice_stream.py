@@ -0,0 +1,253 @@
+"""
+Voice login streamed over a WebSocket, decided while the user is speaking
+(served by asgi.py only):
+
+    ws://host/voice/stream?phrase_id=1[&format=webm|pcm][&sample_rate=16000]
+
+The client sends the recording as it is captured, in binary messages: the
+MediaRecorder chunks of one WebM/Opus recording (format=webm, the default) or
+little-endian float32 mono samples at `sample_rate` (format=pcm). A text
+message "end" (or {"type": "end"}) marks the end of the recording.
+
+Every VOICE_STREAM_UPDATE_MS the speech heard so far (found by the energy
+VAD in voice_service.speech_bounds) is transcribed and embedded again, and
+the server answers
+
+    {"type": "partial", "speech_s", "transcript", "score", "confidence"}
+
+As soon as the transcript matches the phrase (score >= the voice_service
+threshold) and the speaker index recognizes the voice, it sends
+
+    {"type": "decision", "match": true, "access_token", "transcript", "score", "confidence"}
+
+and closes. Otherwise the decision ("match": false, no token) follows the
+end of the utterance: VOICE_STREAM_HANGOVER_MS of silence after speech, the
+"end" message, or VOICE_STREAM_MAX_S of audio. Problems are reported as
+{"type": "error", "message"} before the socket closes.
+"""
+import asyncio
+import json
+import os
+import time
+import traceback
+from urllib.parse import parse_qs
+from audio_upload import MAX_AUDIO_BYTES
+from auth import VOICE_LOGIN_MIN_CONFIDENCE, issue_voice_token
+from inference import Overloaded
+from models import VoicePhrase
+from speaker_index import speaker_index
+from voice_service import decode_audio, decode_pcm, score_speech_async, speech_bounds
+
+PATH = "/voice/stream"
+
+# re-run the models at most this often while audio keeps arriving
+_UPDATE_S = float(os.getenv("VOICE_STREAM_UPDATE_MS", 500)) / 1000
+# silence after speech that ends the utterance
+_HANGOVER_S = float(os.getenv("VOICE_STREAM_HANGOVER_MS", 400)) / 1000
+_MAX_S = float(os.getenv("VOICE_STREAM_MAX_S", 10))
+
+_FORMATS = ("webm", "pcm")
+# PCM rates a client may declare; anything else would build an arbitrarily
+# large resampling kernel
+SAMPLE_RATES = (8000, 16000, 22050, 24000, 32000, 44100, 48000)
+_SR = 16000  # decode_audio() output rate
+
+
+class StreamError(Exception):
+    """A stream the server will not (or can no longer) evaluate."""
+
+
+class VoiceStream:
+    """Audio of one streamed login attempt, and the latest evaluation of it."""
+
+    def __init__(self, phrase_id: int, phrase: str, fmt: str = "webm", sample_rate: int = _SR):
+        self.phrase_id = phrase_id
+        self.phrase = phrase
+        self.format = fmt
+        self.sample_rate = sample_rate
+        self.started = time.monotonic()
+        self._buf = bytearray()
+        self._evaluated = -1        # buffer length at the last evaluation
+        self._last = None           # (transcript, score, match, confidence, user_id)
+        self._last_at = 0.0
+
+    def feed(self, data: bytes):
+        if len(self._buf) + len(data) > MAX_AUDIO_BYTES:
+            raise StreamError(f"Audio exceeds {MAX_AUDIO_BYTES} bytes")
+        self._buf += data
+
+    def due(self) -> float:
+        """Seconds until the next update is due; 0 when it is, inf without new audio."""
+        if len(self._buf) == self._evaluated:
+            return float("inf")
+        return max(0.0, self._last_at + _UPDATE_S - time.monotonic())
+
+    def _decode(self, data: bytes):
+        # runs on a worker thread: the prefix of a WebM recording is a valid
+        # (shorter) recording, so the whole buffer is decoded each time
+        if self.format == "pcm":
+            wav = decode_pcm(data, self.sample_rate)
+        else:
+            wav = decode_audio(data, cache=False)
+        return wav, speech_bounds(wav, pad_s=0.0)
+
+    async def evaluate(self, final: bool = False) -> dict:
+        """
+        Score the audio received so far. Returns a "partial" message, or a
+        "decision" once the phrase and speaker match, the utterance is over or
+        `final` is set.
+        """
+        self._last_at = time.monotonic()
+        if len(self._buf) != self._evaluated and self._buf:
+            self._evaluated = len(self._buf)
+            loop = asyncio.get_running_loop()
+            try:
+                wav, (_, stop, speech_s) = await loop.run_in_executor(None, self._decode, bytes(self._buf))
+            except Exception:
+                if not final:
+                    return {"type": "partial", "speech_s": 0.0}   # an incomplete chunk; wait for more
+                raise StreamError("Could not decode the audio")
+            audio_s = len(wav) / _SR
+            final = final or audio_s >= _MAX_S or (speech_s > 0 and audio_s - stop / _SR >= _HANGOVER_S)
+
+            try:
+                scored = await score_speech_async(wav, self.phrase)
+            except Overloaded:
+                if final:
+                    raise
+                self._evaluated = -1                      # retry on the next update
+                return {"type": "partial", "speech_s": speech_s}
+            if scored is not None:
+                transcript, score, match, embedding = scored
+                # an index scan or remap must not stall the event loop
+                best = await asyncio.to_thread(speaker_index.search, embedding, k=1)
+                user_id, confidence = best[0] if best else (None, 0.0)
+                self._last = (transcript, score, match, confidence, user_id)
+        else:
+            speech_s = 0.0
+
+        if self._last is None:
+            if final:
+                return {"type": "decision", "match": False, "message": "No speech heard"}
+            return {"type": "partial", "speech_s": speech_s}
+
+        transcript, score, match, confidence, user_id = self._last
+        message = {"transcript": transcript, "score": score, "confidence": confidence}
+        if match and user_id is not None and confidence >= VOICE_LOGIN_MIN_CONFIDENCE:
+            return {"type": "decision", "match": True, "user_id": user_id, **message}
+        if final:
+            return {"type": "decision", "match": False, **message}
+        return {"type": "partial", "speech_s": speech_s, **message}
+
+
+def _params(scope) -> tuple[int, str, int]:
+    query = {k: v[-1] for k, v in parse_qs(scope.get("query_string", b"").decode("latin1")).items()}
+    fmt = query.get("format", "webm")
+    if fmt not in _FORMATS:
+        raise StreamError(f"format must be one of {', '.join(_FORMATS)}")
+    try:
+        phrase_id = int(query["phrase_id"])
+    except (KeyError, ValueError):
+        raise StreamError("phrase_id is required")
+    sample_rate = query.get("sample_rate", str(_SR))
+    if sample_rate not in {str(r) for r in SAMPLE_RATES}:
+        raise StreamError(f"sample_rate must be one of {', '.join(map(str, SAMPLE_RATES))}")
+    return phrase_id, fmt, int(sample_rate)
+
+
+def _phrase_text(flask_app, phrase_id: int) -> str | None:
+    with flask_app.app_context():
+        phrase = VoicePhrase.query.get(phrase_id)
+        return phrase.text if phrase else None
+
+
+def _login(flask_app, stream: VoiceStream, decision: dict) -> dict:
+    # the same token and audit event as POST /auth/login/voice
+    with flask_app.app_context():
+        token = issue_voice_token(decision.pop("user_id"), stream.phrase_id, decision["confidence"],
+                                  method="stream", score=decision["score"])
+    if token is None:
+        return {**decision, "match": False}
+    return {**decision, "access_token": token}
+
+
+def _is_end(message: dict) -> bool:
+    text = (message.get("text") or "").strip()
+    if text == "end":
+        return True
+    try:
+        return json.loads(text).get("type") == "end"
+    except (ValueError, AttributeError):
+        return False
+
+
+async def _send(send, message: dict):
+    await send({"type": "websocket.send", "text": json.dumps(message)})
+
+
+async def _run(flask_app, stream: VoiceStream, receive, send) -> dict:
+    """Feed the stream and evaluate it, one evaluation at a time, until a decision."""
+    receiving = asyncio.ensure_future(receive())
+    evaluating = None
+    ended = False
+    try:
+        while True:
+            left = stream.started + _MAX_S - time.monotonic()
+            ended = ended or left <= 0
+            if evaluating is None and (ended or stream.due() == 0):
+                evaluating = asyncio.ensure_future(stream.evaluate(final=ended))
+            waiting = {receiving} | ({evaluating} if evaluating else set())
+            timeout = None if evaluating else min(stream.due(), left)
+            done, _ = await asyncio.wait(waiting, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            if receiving in done:
+                message = receiving.result()
+                if message["type"] == "websocket.disconnect":
+                    return None
+                if message.get("bytes") and not ended:
+                    stream.feed(message["bytes"])
+                elif _is_end(message):
+                    ended = True
+                receiving = asyncio.ensure_future(receive())
+
+            if evaluating in done:
+                result, evaluating = evaluating.result(), None
+                if result["type"] == "decision":
+                    if result["match"]:
+                        result = await asyncio.to_thread(_login, flask_app, stream, result)
+                    return result
+                await _send(send, result)
+    finally:
+        for task in (receiving, evaluating):
+            if task is not None:
+                task.cancel()
+
+
+async def serve(flask_app, scope, receive, send):
+    """ASGI websocket handler for PATH."""
+    if (await receive())["type"] != "websocket.connect":
+        return
+    await send({"type": "websocket.accept"})
+    code = 1000
+    try:
+        phrase_id, fmt, sample_rate = _params(scope)
+        phrase = await asyncio.to_thread(_phrase_text, flask_app, phrase_id)
+        if phrase is None:
+            raise StreamError(f"Phrase {phrase_id} not found")
+        stream = VoiceStream(phrase_id, phrase, fmt, sample_rate)
+        decision = await _run(flask_app, stream, receive, send)
+        if decision is None:
+            return                                   # client went away
+        decision["elapsed_ms"] = round((time.monotonic() - stream.started) * 1000)
+        await _send(send, decision)
+    except StreamError as e:
+        code = 1008
+        await _send(send, {"type": "error", "message": str(e)})
+    except Overloaded:
+        code = 1013
+        await _send(send, {"type": "error", "message": "Voice service busy, try again"})
+    except Exception:
+        traceback.print_exc()
+        code = 1011
+        await _send(send, {"type": "error", "message": "Error during verification"})
+    await send({"type": "websocket.close", "code": code})
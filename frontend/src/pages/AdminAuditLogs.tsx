@@ -15,8 +15,11 @@ const PAGE_SIZE = 25;
 
 export default function AdminAuditLogs() {
   const [logs, setLogs] = useState<AuditLog[]>([]);
+  // cursors[i] is the cursor that loads page i + 1 (null for the first page)
+  const [cursors, setCursors] = useState<(string | null)[]>([null]);
   const [page, setPage] = useState(1);
-  const [totalPages, setTotalPages] = useState(1);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [total, setTotal] = useState<number | null>(null);
   const [loading, setLoading] = useState(false);
 
   const [filterId, setFilterId] = useState<string>('');
@@ -33,33 +36,42 @@ export default function AdminAuditLogs() {
 
   const fetchLogs = async (
     pageNum = 1,
-    filters: Filters = {}
+    filters: Filters = {},
+    cursorStack: (string | null)[] = [null]
   ) => {
     setLoading(true);
     try {
+      const cursor = cursorStack[pageNum - 1];
       const params = {
-        page:     pageNum,
         per_page: PAGE_SIZE,
+        ...(cursor ? { cursor } : {}),
+        ...(pageNum === 1 ? { total: 'approx' } : {}),
         ...filters
       };
       const { data } = await axios.get('/admin/audit-logs', { params });
       setLogs(data.logs);
-      setTotalPages(data.pages);
-      setPage(data.page);
+      setPage(pageNum);
+      setNextCursor(data.next_cursor);
+      if (pageNum === 1) setTotal(data.total);
+      const stack = cursorStack.slice(0, pageNum);
+      if (data.next_cursor) stack.push(data.next_cursor);
+      setCursors(stack);
     } catch (err) {
       console.error('Failed fetching logs', err);
     } finally {
       setLoading(false);
     }
   };
-  
+
+  const currentFilters = (): Filters => ({
+    id:       filterId,
+    user_id:  filterUserId,
+    username: filterUsername,
+    action:   filterAction
+  });
+
   const onSearch = () => {
-    fetchLogs(1, {
-      id:       filterId,
-      user_id:  filterUserId,
-      username: filterUsername,
-      action:   filterAction
-    });
+    fetchLogs(1, currentFilters());
   };
 
   useEffect(() => { fetchLogs(1); }, []);
@@ -135,28 +147,19 @@ export default function AdminAuditLogs() {
         <div className="audit-pagination">
           <button
             className="audit-btn prev-btn"
-            onClick={() => fetchLogs(page - 1, {
-              id:       filterId,
-              user_id:  filterUserId,
-              username: filterUsername,
-              action:   filterAction
-            })}
+            onClick={() => fetchLogs(page - 1, currentFilters(), cursors)}
             disabled={page <= 1 || loading}
           >
             Previous
           </button>
           <span className="audit-page-info">
-            Page {page} of {totalPages}
+            Page {page}
+            {total !== null && ` of ~${Math.max(1, Math.ceil(total / PAGE_SIZE))}`}
           </span>
           <button
             className="audit-btn next-btn"
-            onClick={() => fetchLogs(page + 1, {
-              id:       filterId,
-              user_id:  filterUserId,
-              username: filterUsername,
-              action:   filterAction
-            })}
-            disabled={page >= totalPages || loading}
+            onClick={() => fetchLogs(page + 1, currentFilters(), cursors)}
+            disabled={!nextCursor || loading}
           >
             Next
           </button>
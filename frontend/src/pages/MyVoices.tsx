@@ -5,7 +5,8 @@ import './MyVoices.css';
 type Voice = {
   id: number;
   created_at: string;
-  audio: string;
+  size: number;
+  audio_url: string;
 };
 
 export default function MyVoices() {
@@ -64,15 +65,16 @@ export default function MyVoices() {
     mediaRecorderRef.current?.stop();
   };
 
-  const playVoice = (b64: string) => {
-    const byteChars = atob(b64);
-    const bytes = new Uint8Array(byteChars.length);
-    for (let i = 0; i < byteChars.length; i++) {
-      bytes[i] = byteChars.charCodeAt(i);
+  const playVoice = async (v: Voice) => {
+    try {
+      // recordings are fetched one at a time; the listing carries no audio
+      const res = await axios.get<Blob>(v.audio_url, { responseType: 'blob' });
+      if (playingUrl) URL.revokeObjectURL(playingUrl);
+      setPlayingUrl(URL.createObjectURL(res.data));
+    } catch (e) {
+      console.error(e);
+      alert('Failed to load recording');
     }
-    const blob = new Blob([bytes], { type: 'audio/webm' });
-    const url = URL.createObjectURL(blob);
-    setPlayingUrl(url);
   };
 
   const deleteVoice = async (id: number) => {
@@ -105,7 +107,7 @@ export default function MyVoices() {
           <li key={v.id} className="myvoices-item">
             <span className="voice-date">{new Date(v.created_at).toLocaleString()}</span>
             <div className="voice-controls">
-              <button onClick={() => playVoice(v.audio)} className="btn btn-small btn-play">Play</button>
+              <button onClick={() => playVoice(v)} className="btn btn-small btn-play">Play</button>
               <button onClick={() => deleteVoice(v.id)} className="btn btn-small btn-delete">Delete</button>
             </div>
           </li>
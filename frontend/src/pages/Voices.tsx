@@ -9,7 +9,8 @@ interface User {
 interface VoiceEntry {
   id: number;
   created_at: string; // ISO date
-  audio: string;      // base64
+  size: number;       // bytes
+  audio_url: string;  // streamed on demand
 }
 
 export default function Voices(): JSX.Element {
@@ -18,6 +19,7 @@ export default function Voices(): JSX.Element {
   const [voices, setVoices] = useState<VoiceEntry[]>([]);
   const [loading, setLoading] = useState<boolean>(false);
   const [error, setError] = useState<string>('');
+  const [audioUrls, setAudioUrls] = useState<Record<number, string>>({});
 
   const token = localStorage.getItem('access_token');
 
@@ -35,6 +37,8 @@ export default function Voices(): JSX.Element {
   const handleUserChange = async (e: React.ChangeEvent<HTMLSelectElement>): Promise<void> => {
     const userId = parseInt(e.target.value, 10);
     setSelectedUser(userId);
+    Object.values(audioUrls).forEach(url => URL.revokeObjectURL(url));
+    setAudioUrls({});
     setLoading(true);
     setError('');
     try {
@@ -51,6 +55,20 @@ export default function Voices(): JSX.Element {
     }
   };
 
+  // fetch one recording's audio when it is played
+  const loadAudio = async (v: VoiceEntry): Promise<void> => {
+    try {
+      const res = await fetch(`http://localhost:5000${v.audio_url}`, {
+        headers: { Authorization: `Bearer ${token}` },
+      });
+      if (!res.ok) throw new Error('Failed to load recording');
+      const url = URL.createObjectURL(await res.blob());
+      setAudioUrls(urls => ({ ...urls, [v.id]: url }));
+    } catch (err: any) {
+      setError(err.message);
+    }
+  };
+
   // helper to delete a voice
   const handleDelete = async (voiceId: number): Promise<void> => {
     if (!window.confirm('Are you sure you want to delete this recording?')) return;
@@ -91,7 +109,11 @@ export default function Voices(): JSX.Element {
             <div key={v.id} className="voice-item">
               <div className="voice-info">
                 <p>Recorded: {new Date(v.created_at).toLocaleString()}</p>
-                <audio controls src={`data:audio/webm;base64,${v.audio}`} />
+                {audioUrls[v.id] ? (
+                  <audio controls autoPlay src={audioUrls[v.id]} />
+                ) : (
+                  <button onClick={() => loadAudio(v)}>Play</button>
+                )}
               </div>
               <button
                 className="delete-btn"